@@ -3,10 +3,11 @@ import itertools
 import numpy as np
 from PIL import Image
 from sklearn.cluster import MiniBatchKMeans
-from skimage.color import rgb2lab, deltaE_cie76
 import sys
 
-from ChromaStackStudio import VirtualPhysics, rgb_to_lab, load_inventory
+from ChromaStackStudio import VirtualPhysics, load_inventory
+from color_science import rgb_to_lab
+from lut_store import load_lut
 
 # ================= 配置 =================
 INVENTORY_FILE = "my_filament.json"
@@ -58,12 +59,10 @@ def evaluate_combination(engine, filament_combo, target_lab, target_weights):
     """
     评估一组耗材的表现
     """
-    # 1. 生成这组耗材能混出的所有颜色 (LUT)
+    # 1. 生成这组耗材能混出的所有颜色 (LUT) 及其 Lab 值
     # 注意：这里 filament_combo 是具体的参数对象列表
-    lut_rgb, _ = engine.generate_lut_km(filament_combo)
-    
-    # 2. 转为 Lab
-    lut_lab = rgb_to_lab(lut_rgb)
+    # 同一组合在磁盘缓存中只计算一次，后续评估直接映射读取
+    _, lut_lab, _ = load_lut(filament_combo, engine=engine)
     
     # 3. 计算误差
     # 对于图片中的每一个特征色，在 LUT 中找到最接近的颜色，记录误差
@@ -1,19 +1,23 @@
 import numpy as np
 import trimesh
-import itertools
 import json
 import os
 import sys
 import colorsys
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-from scipy.spatial import KDTree
 from PIL import Image
 import scipy.ndimage as ndimage
 from skimage.segmentation import felzenszwalb
 from shapely.geometry import Polygon
 import cv2
 
+from color_science import rgb_to_lab, linear_to_srgb_bytes
+from geometry_cleanup import min_island_area
+from model_export import parse_export_formats, part_name, save_stack_map, write_3mf, write_stl_parts
+from parallel_mesher import resolve_workers
+from region_stack import RegionStackMap
+
 # ================= 配置区域 =================
 # 打印物理参数
 LAYER_HEIGHT = 0.08      # 颜色层层高 (mm)
@@ -22,6 +26,39 @@ PIXEL_SIZE = 0.2         # 像素尺寸/水平分辨率 (mm)
 BASE_HEIGHT = 0.8        # 白色底座厚度 (mm)
 ALPHA_THRESHOLD = 128    # PNG透明度阈值 (0-255)，低于此值视为透明不打印
 
+# LUT 引擎: "prefix" 逐层前缀共享 / "mitm" 折半合成 / "auto" 层数 >= MITM_MIN_LAYERS 时使用折半合成
+LUT_METHOD = "auto"
+MITM_MIN_LAYERS = 6
+MITM_CHUNK_COMBOS = 1 << 20  # 折半合成每块的组合数 (控制峰值内存)
+
+# 稀疏 LUT (None 表示使用完整 LUT)。可选键:
+#   max_distinct  每个像素柱最多使用几种耗材
+#   max_changes   相邻层之间最多切换几次耗材
+#   base_slot     贴近底座的第 0 层必须使用的槽位
+#   merge_delta_e 色差 (ΔE76) 小于该值的层叠合并为一个代表
+SPARSE_LUT = None  # 例如 {"max_distinct": 3, "max_changes": 2, "merge_delta_e": 1.0}
+SPARSE_CHUNK_COMBOS = 1 << 20  # 稀疏枚举每块的组合数
+
+# 颜色匹配方式: "region" 先分割再按区域平均色匹配; "pixel" 逐像素匹配 (不分割，保留全部细节)
+MATCHING_MODE = "region"
+# 区域模式下的最小区域面积 (mm²)，更小的区域在匹配前并入最近的大区域；0 表示不处理
+MIN_REGION_AREA_MM2 = 0.0
+
+# 网格生成方式: "contour" 逐层提取轮廓后拉伸 (layer_mesher);
+# "greedy" 整个模型体素化后剔除内部面、合并共面矩形，每个槽位输出一个焊接的封闭网格 (greedy_mesher)
+MESHER = "contour"
+# 几何清理 (网格生成前): 喷嘴宽度 (mm)；每层中面积小于 MIN_ISLAND_AREA_MM2 的孤岛/孔洞并入周围区域，
+# "auto" 表示喷嘴宽度的平方，0 表示不处理；SIMPLIFY_TOLERANCE_MM > 0 时 contour 网格的轮廓按该容差简化
+# (上限约 0.7 像素，相邻槽位之间不会产生缝隙)
+NOZZLE_WIDTH = 0.4
+MIN_ISLAND_AREA_MM2 = 0.0
+SIMPLIFY_TOLERANCE_MM = 0.0
+# 网格生成的工作进程数 (0 表示按 CPU 核数；1 表示在当前进程中计算)
+MESH_WORKERS = 0
+# 导出格式: "3mf" 多零件工程文件 / "stl" 每个槽位一个二进制 STL /
+# "npz" 层叠图 (匹配结果，之后可用 model_export.load_stack_map 读取并直接生成网格)
+EXPORT_FORMATS = ("3mf",)
+
 # K-M 理论边界条件
 BACKING_REFLECTANCE = np.array([0.94, 0.94, 0.94]) # 底座(白色PLA)的反射率
 
@@ -81,13 +118,59 @@ def get_selected_filaments(inventory, target_names):
 
 # ================= 2. 物理核心引擎 & 颜色转换工具 =================
 
-class VirtualPhysics:
-    @staticmethod
-    def linear_to_srgb_bytes(linear):
-        linear = np.clip(linear, 0, 1)
-        srgb = np.where(linear <= 0.0031308, 12.92 * linear, 1.055 * (linear ** (1.0 / 2.4)) - 0.055)
-        return (srgb * 255).astype(np.uint8)
+def compact_uint_dtype(max_value):
+    """返回能容纳 [0, max_value] 的最小无符号整数类型"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+def resolve_lut_method(total_layers, method=LUT_METHOD):
+    """完整 LUT 实际使用的引擎: "auto" 按层数选择 "prefix" / "mitm" (LUT 的缓存键包含该结果)"""
+    if method == "auto":
+        return "mitm" if total_layers >= MITM_MIN_LAYERS else "prefix"
+    if method not in ("prefix", "mitm"):
+        raise ValueError(f"未知的 LUT 引擎: {method}")
+    return method
+
+class StackCodec:
+    """
+    层叠的混合进制编码。
+    一个 L 层、N 种耗材的层叠用单个整数表示:
+        code = slot_0 * N^(L-1) + slot_1 * N^(L-2) + ... + slot_(L-1)
+    第 0 层 (贴近底座) 为最高位，与 LUT 的排列顺序一致。
+    各层耗材编号按需解码为 uint8，不再保存 (N^L, L) 或 (H, W, L) 的 int64 矩阵。
+    """
+    def __init__(self, num_filaments, total_layers=TOTAL_LAYERS):
+        self.num_filaments = int(num_filaments)
+        self.total_layers = int(total_layers)
+        self.num_codes = self.num_filaments ** self.total_layers
+        self.dtype = compact_uint_dtype(self.num_codes - 1)
+        self.place_values = self.num_filaments ** np.arange(self.total_layers - 1, -1, -1, dtype=np.int64)
+
+    def layer_slots(self, codes, layer_idx):
+        """解码单层: 返回与 codes 同形状的 uint8 耗材编号"""
+        digit = np.asarray(codes) // self.dtype.type(self.place_values[layer_idx])
+        return (digit % self.dtype.type(self.num_filaments)).astype(np.uint8)
+
+    def decode(self, codes):
+        """解码全部层: (...) -> (..., L) uint8"""
+        codes = np.asarray(codes)
+        slots = np.empty(codes.shape + (self.total_layers,), dtype=np.uint8)
+        for layer_idx in range(self.total_layers):
+            slots[..., layer_idx] = self.layer_slots(codes, layer_idx)
+        return slots
+
+    def encode(self, slots):
+        """编码: (..., L) 耗材编号 -> (...) 层叠编码"""
+        slots = np.asarray(slots)
+        codes = np.zeros(slots.shape[:-1], dtype=self.dtype)
+        for layer_idx in range(self.total_layers):
+            codes *= self.dtype.type(self.num_filaments)
+            codes += slots[..., layer_idx].astype(self.dtype)
+        return codes
 
+class VirtualPhysics:
     @staticmethod
     def km_reflectance_vectorized(K, S, h, Rg):
         S = np.maximum(S, 1e-6)
@@ -102,66 +185,197 @@ class VirtualPhysics:
         R = numerator / denominator
         return np.clip(R, 0, 1)
 
-    def generate_lut_km(self, filaments_list, total_layers=TOTAL_LAYERS, layer_height=LAYER_HEIGHT):
+    @staticmethod
+    def km_layer_coefficients(K, S, h):
+        """
+        预计算单层材料与底色无关的 K-M 系数。
+        km_reflectance_vectorized 可改写为关于 Rg 的分式线性函数:
+            R = (p + q * Rg) / (r - t * Rg)
+        其中 sinh/cosh 只取决于耗材和层高，因此每种耗材只需计算一次。
+        返回: (p, q, r, t)，形状与 K 相同
+        """
+        S = np.maximum(S, 1e-6)
+        a = 1 + (K / S)
+        b = np.sqrt(np.maximum(a**2 - 1, 1e-9))
+        bSh = b * S * h
+        sinh_bSh = np.sinh(bSh)
+        b_cosh_bSh = b * np.cosh(bSh)
+        p = sinh_bSh
+        q = b_cosh_bSh - a * sinh_bSh
+        r = a * sinh_bSh + b_cosh_bSh
+        t = sinh_bSh
+        return p, q, r, t
+
+    @staticmethod
+    def layer_optical_properties(K, S, h):
+        """
+        单层材料的 R (黑底反射率) 与 T (透射率)，与 filament_cali/cali_verify.py 中
+        get_layer_optical_properties 的一般解相同，数值保护与 km_reflectance_vectorized 一致。
+        叠加到底色 Rg 上: R_total = R + T^2 * Rg / (1 - R * Rg)，与 Rg 递推式等价。
+        """
+        S = np.maximum(S, 1e-6)
+        a = 1 + (K / S)
+        b = np.sqrt(np.maximum(a**2 - 1, 1e-9))
+        bSh = b * S * h
+        sinh_bSh = np.sinh(bSh)
+        denominator = a * sinh_bSh + b * np.cosh(bSh)
+        return sinh_bSh / denominator, b / denominator
+
+    def _prefix_reflectance(self, Ks, Ss, num_layers, layer_height, backing):
+        """
+        前缀共享: 第 k 层结束时，每个不同的前缀 (底部 k+1 层) 只计算一次，
+        总计算量为 N + N^2 + ... + N^L，而不是 L * N^L。
+        排列顺序与 itertools.product 一致 (第 0 层为最高位)。
+        返回: (N^num_layers, 3) float32 反射率
+        """
+        p, q, r, t = self.km_layer_coefficients(Ks, Ss, np.float32(layer_height))
+        current_R = np.asarray(backing, dtype=np.float32).reshape(1, 3)
+        for layer_idx in range(num_layers):
+            Rg = current_R[:, np.newaxis, :]                   # (前缀数, 1, 3)
+            denominator = np.maximum(r - t * Rg, 1e-6)          # (前缀数, N, 3)
+            current_R = (p + q * Rg) / denominator
+            current_R = np.clip(current_R, 0, 1, out=current_R).reshape(-1, 3)
+        return current_R
+
+    def _half_stack_properties(self, Ks, Ss, num_layers, layer_height):
+        """
+        上半部分 (不含底座) 的复合光学属性，按 "从下往上逐层叠加" 枚举。
+        非对称层叠从上、下两侧看反射率不同，因此同时保存 R_top、R_bot 与 T。
+        返回: 三个 (N^num_layers, 3) float32 数组，第一层为最高位
+        """
+        R_layer, T_layer = self.layer_optical_properties(Ks, Ss, np.float32(layer_height))
+        R_top = np.zeros((1, 3), dtype=np.float32)
+        R_bot = np.zeros((1, 3), dtype=np.float32)
+        T = np.ones((1, 3), dtype=np.float32)
+        for _ in range(num_layers):
+            # 在已有层叠 (M, 1, 3) 之上再放一层 (1, N, 3)
+            top, bot, trans = R_top[:, np.newaxis, :], R_bot[:, np.newaxis, :], T[:, np.newaxis, :]
+            denominator = np.maximum(1.0 - R_layer * top, 1e-6)
+            R_top = (R_layer + T_layer**2 * top / denominator).reshape(-1, 3)
+            T_new = (T_layer * trans / denominator).reshape(-1, 3)
+            R_bot = (bot + trans**2 * R_layer / denominator).reshape(-1, 3)
+            T = T_new
+        return R_top, R_bot, T
+
+    def iter_lut_chunks_mitm(self, filaments_list, total_layers=TOTAL_LAYERS, layer_height=LAYER_HEIGHT, chunk_combos=MITM_CHUNK_COMBOS):
+        """
+        折半 (meet-in-the-middle) 构建 LUT，按块产出以限制峰值内存。
+        下半部分 (贴底座的 floor(L/2) 层) 连同底座算出 N^lo 个等效底色 Rg，
+        上半部分算出 N^hi 组 (R_top, R_bot, T)，再用层叠合成公式做向量化外积:
+            R = R_top + T^2 * Rg / (1 - R_bot * Rg)
+        每个组合只做一次合成，而不是 L 次递推。
+        产出: (起始编码, (块大小, 3) uint8 sRGB)，编码顺序与 generate_lut_km 一致
+        """
+        Ks = np.array([f['FILAMENT_K'] for f in filaments_list], dtype=np.float32)
+        Ss = np.array([f['FILAMENT_S'] for f in filaments_list], dtype=np.float32)
+        lo_layers = total_layers // 2
+        hi_layers = total_layers - lo_layers
+
+        Rg_low = self._prefix_reflectance(Ks, Ss, lo_layers, layer_height, BACKING_REFLECTANCE)
+        R_top, R_bot, T_up = self._half_stack_properties(Ks, Ss, hi_layers, layer_height)
+        T_up_sq = T_up**2
+        num_hi = len(R_top)
+
+        # 每块处理若干个完整的 "下半部分" 行，块内编码连续
+        rows_per_chunk = max(1, chunk_combos // num_hi)
+        for row_start in range(0, len(Rg_low), rows_per_chunk):
+            Rg = Rg_low[row_start:row_start + rows_per_chunk, np.newaxis, :]
+            denominator = np.maximum(1.0 - R_bot * Rg, 1e-6)
+            R = R_top + T_up_sq * Rg / denominator
+            yield row_start * num_hi, linear_to_srgb_bytes(R.reshape(-1, 3))
+
+    def generate_lut_sparse(self, filaments_list, total_layers=TOTAL_LAYERS, layer_height=LAYER_HEIGHT,
+                            max_distinct=None, max_changes=None, base_slot=None, merge_delta_e=0.0):
+        """
+        稀疏 LUT: 只枚举满足约束的层叠，再把色差小于 merge_delta_e 的层叠合并为一个代表。
+        合并时优先保留使用耗材种类少、换色次数少的层叠，减少网格碎片。
+        返回: (lut_colors_srgb, lut_codes)，lut_codes 为升序的混合进制编码 (不再连续)
+        """
+        num_filaments = len(filaments_list)
+        codec = StackCodec(num_filaments, total_layers)
+        print(f" [K-M 引擎] 稀疏模式: {num_filaments} 种耗材, {total_layers} 层 "
+              f"(max_distinct={max_distinct}, max_changes={max_changes}, base_slot={base_slot}, ΔE={merge_delta_e})")
+
+        # 1. 分块枚举满足约束的编码
+        kept_codes, kept_distinct, kept_changes = [], [], []
+        for start in range(0, codec.num_codes, SPARSE_CHUNK_COMBOS):
+            codes = np.arange(start, min(start + SPARSE_CHUNK_COMBOS, codec.num_codes), dtype=codec.dtype)
+            slots = codec.decode(codes)
+            changes = np.count_nonzero(slots[:, 1:] != slots[:, :-1], axis=1)
+            sorted_slots = np.sort(slots, axis=1)
+            distinct = 1 + np.count_nonzero(sorted_slots[:, 1:] != sorted_slots[:, :-1], axis=1)
+            keep = np.ones(len(codes), dtype=bool)
+            if max_distinct is not None:
+                keep &= distinct <= max_distinct
+            if max_changes is not None:
+                keep &= changes <= max_changes
+            if base_slot is not None:
+                keep &= slots[:, 0] == base_slot
+            kept_codes.append(codes[keep])
+            kept_distinct.append(distinct[keep].astype(np.uint8))
+            kept_changes.append(changes[keep].astype(np.uint8))
+        lut_codes = np.concatenate(kept_codes)
+        distinct = np.concatenate(kept_distinct)
+        changes = np.concatenate(kept_changes)
+        if len(lut_codes) == 0:
+            raise ValueError("稀疏 LUT 约束过严，没有任何层叠满足条件")
+
+        # 2. 只对保留的层叠计算颜色 (逐层 gather)
+        Ks = np.array([f['FILAMENT_K'] for f in filaments_list], dtype=np.float32)
+        Ss = np.array([f['FILAMENT_S'] for f in filaments_list], dtype=np.float32)
+        p, q, r, t = self.km_layer_coefficients(Ks, Ss, np.float32(layer_height))
+        current_R = np.broadcast_to(BACKING_REFLECTANCE.astype(np.float32), (len(lut_codes), 3))
+        for layer_idx in range(total_layers):
+            slot = codec.layer_slots(lut_codes, layer_idx)
+            denominator = np.maximum(r[slot] - t[slot] * current_R, 1e-6)
+            current_R = np.clip((p[slot] + q[slot] * current_R) / denominator, 0, 1)
+        lut_colors_srgb = linear_to_srgb_bytes(current_R)
+
+        # 3. 按 ΔE 合并: Lab 空间中边长 ΔE/√3 的网格内任意两点色差不超过 ΔE，每格保留一个代表
+        if merge_delta_e and merge_delta_e > 0:
+            cells = np.floor(rgb_to_lab(lut_colors_srgb) / (merge_delta_e / np.sqrt(3))).astype(np.int64)
+            cells -= cells.min(axis=0)
+            extent = cells.max(axis=0) + 1
+            cell_keys = (cells[:, 0] * extent[1] + cells[:, 1]) * extent[2] + cells[:, 2]
+            # 排序优先级: 网格 -> 耗材种类 -> 换色次数 -> 编码
+            order = np.lexsort((lut_codes, changes, distinct, cell_keys))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = cell_keys[order[1:]] != cell_keys[order[:-1]]
+            representatives = np.sort(order[first])
+            lut_codes = lut_codes[representatives]
+            lut_colors_srgb = lut_colors_srgb[representatives]
+
+        print(f"  > 稀疏 LUT: {len(lut_codes)} / {codec.num_codes} 个层叠")
+        return lut_colors_srgb, lut_codes
+
+    def generate_lut_km(self, filaments_list, total_layers=TOTAL_LAYERS, layer_height=LAYER_HEIGHT, method=LUT_METHOD):
+        """
+        method: "prefix" 逐层前缀共享 / "mitm" 折半合成 / "auto" 按层数自动选择
+        """
         num_filaments = len(filaments_list) # <--- 获取动态数量
         print(f" [K-M 引擎] 检测到 {num_filaments} 种耗材，正在计算光路混合...")
         
-        Ks = np.array([f['FILAMENT_K'] for f in filaments_list])
-        Ss = np.array([f['FILAMENT_S'] for f in filaments_list])
+        num_combos = num_filaments ** total_layers
+        method = resolve_lut_method(total_layers, method)
         
-        # ⚠️ 动态生成组合索引：range(num_filaments) 而不是 range(4)
-        indices = np.array(list(itertools.product(range(num_filaments), repeat=total_layers)))
-        num_combos = len(indices)
+        print(f"  > 组合总数: {num_filaments}^{total_layers} = {num_combos} ({method})")
         
-        print(f"  > 组合总数: {num_filaments}^{total_layers} = {num_combos}")
+        if method == "mitm":
+            lut_colors_srgb = np.empty((num_combos, 3), dtype=np.uint8)
+            for start, chunk in self.iter_lut_chunks_mitm(filaments_list, total_layers, layer_height):
+                lut_colors_srgb[start:start + len(chunk)] = chunk
+        else:
+            Ks = np.array([f['FILAMENT_K'] for f in filaments_list], dtype=np.float32)
+            Ss = np.array([f['FILAMENT_S'] for f in filaments_list], dtype=np.float32)
+            current_R = self._prefix_reflectance(Ks, Ss, total_layers, layer_height, BACKING_REFLECTANCE)
+            lut_colors_srgb = linear_to_srgb_bytes(current_R)
         
-        current_R = np.tile(BACKING_REFLECTANCE, (num_combos, 1))
-        for layer_idx in range(total_layers):
-            filament_ids = indices[:, layer_idx] 
-            layer_K = Ks[filament_ids]
-            layer_S = Ss[filament_ids]
-            current_R = self.km_reflectance_vectorized(layer_K, layer_S, layer_height, current_R)
+        # 层叠编码: 完整 LUT 的第 i 行恰好对应混合进制编码 i，
+        # 需要具体某层的耗材时再用 StackCodec 按需解码
+        codec = StackCodec(num_filaments, total_layers)
+        lut_codes = np.arange(num_combos, dtype=codec.dtype)
         
-        lut_colors_srgb = self.linear_to_srgb_bytes(current_R)
-        return lut_colors_srgb, indices
-
-def rgb_to_lab(rgb):
-    """
-    将 sRGB (0-255) 转换为 CIELAB 颜色空间 (D65)。
-    输入: numpy array (N, 3) 范围 0-255
-    输出: numpy array (N, 3) Lab 值
-    """
-    # 1. 归一化到 0-1
-    rgb = rgb.astype(float) / 255.0
-
-    # 2. sRGB -> Linear RGB (反 Gamma 校正)
-    mask = rgb > 0.04045
-    rgb[mask] = ((rgb[mask] + 0.055) / 1.055) ** 2.4
-    rgb[~mask] = rgb[~mask] / 12.92
-
-    # 3. Linear RGB -> XYZ (D65)
-    # 转换矩阵
-    M = np.array([[0.4124564, 0.3575761, 0.1804375],
-                  [0.2126729, 0.7151522, 0.0721750],
-                  [0.0193339, 0.1191920, 0.9503041]])
-    XYZ = np.dot(rgb, M.T)
-
-    # 4. XYZ -> Lab
-    # D65 参考白点
-    XYZ_ref = np.array([0.95047, 1.00000, 1.08883])
-    XYZ = XYZ / XYZ_ref
-
-    mask = XYZ > 0.008856
-    f_XYZ = np.zeros_like(XYZ)
-    f_XYZ[mask] = XYZ[mask] ** (1.0/3.0)
-    f_XYZ[~mask] = 7.787 * XYZ[~mask] + 16.0/116.0
-
-    Lab = np.zeros_like(XYZ)
-    Lab[:, 0] = 116.0 * f_XYZ[:, 1] - 16.0       # L
-    Lab[:, 1] = 500.0 * (f_XYZ[:, 0] - f_XYZ[:, 1]) # a
-    Lab[:, 2] = 200.0 * (f_XYZ[:, 1] - f_XYZ[:, 2]) # b
-
-    return Lab
+        return lut_colors_srgb, lut_codes
 
 def visualize_gamut(lut_colors):
     print("\n📊 正在生成色域预览图...")
@@ -236,11 +450,14 @@ def _generate_voxels_from_centers(centers, dx, dy, dz):
     all_faces = all_faces.reshape(-1, 3)
     return trimesh.Trimesh(vertices=all_verts, faces=all_faces)
 
-def create_voxel_mesh_masked(indices_matrix, slot_id, width_pixels, height_pixels, solid_mask_2d, z_offset=0.0, is_base_layer=False):
+def create_voxel_mesh_masked(stack_codes_matrix, slot_id, width_pixels, height_pixels, solid_mask_2d, z_offset=0.0, is_base_layer=False, codec=None, reverse_layers=False):
     """
     [修复版] 
     1. 解决了 trimesh.load_path 不接受列表的报错。
     2. 增加了孔洞处理 (RETR_CCOMP)，防止 'O' 型图案中间被填实。
+    3. stack_codes_matrix 为 (H, W) 层叠编码，由 codec 逐层解码；
+       reverse_layers=True 时按倒序取层 (双面模型的背面)，无需复制矩阵。
+    单槽位、逐层 findContours 的参考实现；主流程使用 layer_mesher.mesh_layer_stack。
     """
     meshes_to_combine = []
 
@@ -269,8 +486,9 @@ def create_voxel_mesh_masked(indices_matrix, slot_id, width_pixels, height_pixel
         
     elif not is_base_layer:
         # 场景 B: 彩色层 (逐层切片, 单层厚度 = LAYER_HEIGHT)
-        for layer_idx in range(TOTAL_LAYERS):
-            current_layer_slots = indices_matrix[:, :, layer_idx]
+        for layer_idx in range(codec.total_layers):
+            source_layer = codec.total_layers - 1 - layer_idx if reverse_layers else layer_idx
+            current_layer_slots = codec.layer_slots(stack_codes_matrix, source_layer)
             layer_mask = (current_layer_slots == slot_id) & solid_mask_2d
             if np.any(layer_mask):
                 tasks.append({
@@ -454,50 +672,141 @@ def generate_regions_felzenszwalb(img_arr_rgb, min_pixel_size=10, scale=100, sig
         
     return segments
 
-def region_based_rematching(img_lab, regions, tree, lut_indices_map, mask=None):
+class RegionStats:
     """
-    核心逻辑：区域平均 -> 唯一匹配
-    (修复了 shape mismatch 错误)
+    区域统计 (struct-of-arrays)，第 i 项对应区域 ID labels[i]
+        labels:   (R,) 有效区域 ID (不含背景 0)
+        counts:   (R,) 像素数
+        mean_lab: (R, 3) 平均 Lab
+        var_lab:  (R, 3) Lab 各通道方差
+        bbox:     (R, 4) 包围盒 [y0, x0, y1, x1) (像素，右下为开区间)
+    """
+    def __init__(self, labels, counts, mean_lab, var_lab, bbox):
+        self.labels = labels
+        self.counts = counts
+        self.mean_lab = mean_lab
+        self.var_lab = var_lab
+        self.bbox = bbox
+
+    def __len__(self):
+        return len(self.labels)
+
+def compute_region_stats(img_lab, regions, mask=None):
+    """
+    一次遍历计算每个区域的像素数、平均 Lab、方差和包围盒
+    (在展平的标签图上做 np.bincount，透明像素计入背景 0 后丢弃，替代逐通道的 ndimage.mean)
     """
-    print("  [重匹配] 正在计算区域平均颜色并查询 KDTree...")
     H, W = regions.shape
-    
-    # 1. 获取所有有效的 Region ID
-    if mask is not None:
-        active_regions = np.unique(regions[mask])
-    else:
-        active_regions = np.unique(regions)
-    
-    # 去除背景 (ID 0)
-    active_regions = active_regions[active_regions > 0]
-    
-    # 2. 计算每个区域的平均颜色 (修复点)
-    # 我们需要分别对 3 个通道 (L, a, b) 进行统计，否则会报错
-    mean_colors = np.zeros((len(active_regions), 3))
+    solid = regions > 0 if mask is None else mask & (regions > 0)
+    labels_flat = np.where(solid, regions, 0).ravel().astype(np.intp, copy=False)
+    num_bins = int(labels_flat.max()) + 1
+
+    counts_all = np.bincount(labels_flat, minlength=num_bins)
+    labels = np.flatnonzero(counts_all[1:]) + 1
+    counts = counts_all[labels]
+
+    mean_lab = np.empty((len(labels), 3))
+    var_lab = np.empty((len(labels), 3))
     for i in range(3):
-        # 对第 i 个通道计算均值
-        mean_colors[:, i] = ndimage.mean(input=img_lab[..., i], labels=regions, index=active_regions)
-    
-    # 3. 对平均颜色进行 KDTree 查询
-    dists, stack_indices = tree.query(mean_colors)
+        channel = img_lab[..., i].ravel().astype(np.float64)
+        sums = np.bincount(labels_flat, weights=channel, minlength=num_bins)[labels]
+        sq_sums = np.bincount(labels_flat, weights=channel * channel, minlength=num_bins)[labels]
+        mean_lab[:, i] = sums / counts
+        var_lab[:, i] = np.maximum(sq_sums / counts - mean_lab[:, i] ** 2, 0.0)
+
+    # 包围盒 (ufunc.at 要求索引与坐标同为 intp，否则退化为慢速路径)
+    coords = (np.repeat(np.arange(H, dtype=np.intp), W), np.tile(np.arange(W, dtype=np.intp), H))
+    lo = np.full((2, num_bins), np.iinfo(np.intp).max, dtype=np.intp)
+    hi = np.full((2, num_bins), -1, dtype=np.intp)
+    for axis in range(2):
+        np.minimum.at(lo[axis], labels_flat, coords[axis])
+        np.maximum.at(hi[axis], labels_flat, coords[axis])
+    bbox = np.stack([lo[0, labels], lo[1, labels], hi[0, labels] + 1, hi[1, labels] + 1], axis=1).astype(np.int32)
+
+    return RegionStats(labels, counts, mean_lab, var_lab, bbox)
+
+def absorb_small_regions(regions, stats, min_region_pixels, mask=None):
+    """
+    把像素数小于 min_region_pixels 的区域并入距离最近的大区域 (EDT 最近像素)
+    返回新的区域图；没有可并入的大区域时原样返回
+    """
+    small = stats.counts < min_region_pixels
+    if not np.any(small) or np.all(small):
+        return regions
+
+    is_large = np.zeros(int(regions.max()) + 1, dtype=bool)
+    is_large[stats.labels[~small]] = True
+    large_pixels = is_large[regions]
+    if mask is not None:
+        large_pixels &= mask
+
+    # 对每个非大区域像素找到最近的大区域像素
+    _, (iy, ix) = ndimage.distance_transform_edt(~large_pixels, return_indices=True)
+    absorbed = regions[iy, ix]
+    small_pixels = (regions > 0) & ~large_pixels
+    return np.where(small_pixels, absorbed, regions)
+
+def region_based_rematching(img_lab, regions, tree, lut_codes, mask=None, min_region_pixels=0, as_region_map=False):
+    """
+    核心逻辑：区域平均 -> 唯一匹配
+    min_region_pixels > 0 时，小于该像素数的区域在查询 KDTree 前并入最近的大区域。
+    返回: (H, W) 层叠编码矩阵 (用于 STL) 与 (H, W) LUT 索引矩阵 (用于预览)，
+    两者均使用最小的无符号整数类型。
+    as_region_map 为 True 时第一项改为 RegionStackMap (区域图 + 区域层叠表，相邻同层叠区域已合并)，
+    不再广播成逐像素编码。
+    """
+    print("  [重匹配] 正在计算区域平均颜色并查询 KDTree...")
+
+    # 1. 区域统计 (像素数 / 平均 Lab / 方差 / 包围盒)
+    stats = compute_region_stats(img_lab, regions, mask=mask)
+    if min_region_pixels > 0:
+        regions = absorb_small_regions(regions, stats, min_region_pixels, mask=mask)
+        stats = compute_region_stats(img_lab, regions, mask=mask)
+    active_regions = stats.labels
+
+    # 2. 对平均颜色进行 KDTree 查询
+    dists, stack_indices = tree.query(stats.mean_lab)
     
-    # 4. 构建映射表
+    # 3. 构建映射表
     max_region_id = regions.max()
     
-    # 映射表 A: Region ID -> 物理层叠 (用于 STL)
-    matched_stacks = lut_indices_map[stack_indices]
-    id_to_stack_map = np.zeros((max_region_id + 1, TOTAL_LAYERS), dtype=int)
-    id_to_stack_map[active_regions] = matched_stacks
+    # 映射表 A: Region ID -> 层叠编码 (用于 STL)
+    id_to_code_map = np.zeros(max_region_id + 1, dtype=lut_codes.dtype)
+    id_to_code_map[active_regions] = lut_codes[stack_indices]
     
     # 映射表 B: Region ID -> LUT 索引 (用于预览图)
-    id_to_lut_idx_map = np.zeros(max_region_id + 1, dtype=int)
+    id_to_lut_idx_map = np.zeros(max_region_id + 1, dtype=compact_uint_dtype(len(lut_codes) - 1))
     id_to_lut_idx_map[active_regions] = stack_indices
 
-    # 5. 广播回像素空间
-    final_stack_matrix = id_to_stack_map[regions]       # (H, W, 5)
+    # 4. 广播回像素空间
     final_lut_idx_matrix = id_to_lut_idx_map[regions]   # (H, W) 用于预览
+    if as_region_map:
+        return RegionStackMap.from_regions(regions, id_to_code_map, mask=mask), final_lut_idx_matrix
+    final_code_matrix = id_to_code_map[regions]         # (H, W) 层叠编码
     
-    return final_stack_matrix, final_lut_idx_matrix
+    return final_code_matrix, final_lut_idx_matrix
+
+def pixel_based_matching(img_rgb, match_index, lut_codes, mask=None, as_region_map=False):
+    """
+    逐像素匹配 (不做区域分割)
+    match_index: lut_match_index.LutMatchIndex，按 sRGB 颜色查最近 LUT 条目
+    返回值与 region_based_rematching 相同: (H, W) 层叠编码矩阵与 (H, W) LUT 索引矩阵，
+    mask 之外的像素与区域模式的背景一致，取 LUT 第 0 项。
+    as_region_map 为 True 时第一项为 RegionStackMap (同编码的 4 邻接连通区域为一个区域)。
+    """
+    print("  [逐像素匹配] 正在按颜色表查询最近 LUT 条目...")
+    if mask is not None:
+        stack_indices = np.zeros(mask.shape, dtype=np.int64)
+        stack_indices[mask] = match_index.query_rgb(img_rgb[mask])
+    else:
+        stack_indices = match_index.query_rgb(img_rgb)
+
+    final_code_matrix = lut_codes[stack_indices]
+    final_lut_idx_matrix = stack_indices.astype(compact_uint_dtype(len(lut_codes) - 1))
+    if as_region_map:
+        solid = np.ones(final_code_matrix.shape, dtype=bool) if mask is None else mask
+        return RegionStackMap.from_code_matrix(final_code_matrix, solid), final_lut_idx_matrix
+    return final_code_matrix, final_lut_idx_matrix
 
 
 # ================= 4. 主程序流程 =================
@@ -515,9 +824,10 @@ def main():
     for i, f in enumerate(selected_filaments):
         print(f"  Slot {i+1}: {f['Name']}")
     
-    # 3. K-M 物理计算
-    engine = VirtualPhysics()
-    lut_colors, lut_indices_map = engine.generate_lut_km(selected_filaments, TOTAL_LAYERS, LAYER_HEIGHT)
+    # 3. K-M 物理计算 (命中磁盘缓存时直接映射读取)
+    from lut_store import load_lut
+    lut_colors, lut_lab, lut_codes = load_lut(selected_filaments, TOTAL_LAYERS, LAYER_HEIGHT, sparse=SPARSE_LUT)
+    codec = StackCodec(num_slots, TOTAL_LAYERS)
     
     visualize_gamut(lut_colors)
     print("\n" + "="*50)
@@ -529,49 +839,37 @@ def main():
     if not os.path.exists(INPUT_IMAGE):
         print(f"错误: 找不到图片 {INPUT_IMAGE}")
         return
-        
-    img = Image.open(INPUT_IMAGE).convert('RGBA')
+
+    # 缩放 -> 透明度掩码 -> Lab / 分割 -> 匹配 -> 网格，各阶段与 GUI 后端共用 (pipeline.py)
+    from lut_store import lut_key
+    from pipeline import ChromaStackPipeline, MatchLut, file_digest, load_image_rgba
+    pipeline = ChromaStackPipeline()
+    trace = {}
+    image_key = file_digest(INPUT_IMAGE)
     w_pixels = int(TARGET_WIDTH_MM / PIXEL_SIZE)
-    aspect = img.height / img.width
-    h_pixels = int(w_pixels * aspect)
-    print(f"目标分辨率: {w_pixels} x {h_pixels} px")
-    
-    img_resized = img.resize((w_pixels, h_pixels), Image.Resampling.LANCZOS)
-    img_arr = np.array(img_resized)
-    
-    alpha_channel_2d = img_arr[..., 3]
-    solid_mask_2d = alpha_channel_2d > ALPHA_THRESHOLD
+    load_image = lambda width: load_image_rgba(INPUT_IMAGE, width)
 
-    # 5. KDTree 颜色匹配
+    # 5. 颜色匹配 (区域模式: KDTree; 逐像素模式: 颜色索引)
     print("正在匹配像素颜色 (CIELAB 空间)...")
-    lut_lab = rgb_to_lab(lut_colors)
-    tree = KDTree(lut_lab)
-    img_lab_2d = rgb_to_lab(img_arr[..., :3].reshape(-1, 3)).reshape(h_pixels, w_pixels, 3)
-    
-    # print("  > 正在执行分水岭分割 (Watershed)...")
-    # regions = watershed_superpixels_from_lab(
-    #     img_lab_2d, 
-    #     mask=solid_mask_2d, 
-    #     seed_step=5,
-    #     grad_sigma=1.0
-    # )
-
-    regions = generate_regions_felzenszwalb(
-        img_arr[..., :3],  # 传入 RGB
+    lut = MatchLut(lut_lab, lut_codes, lut_key(selected_filaments, TOTAL_LAYERS, LAYER_HEIGHT, sparse=SPARSE_LUT))
+    matched = pipeline.match_image(
+        image_key, w_pixels, load_image, lut,
+        alpha_threshold=ALPHA_THRESHOLD,
+        matching_mode=MATCHING_MODE,
         min_pixel_size=5, # 约等于 1.6mm² 的最小打印面积
         scale=10,          # 针对复杂插画，50-100 比较合适
         sigma=0.5,
-        mask=solid_mask_2d
-    )
-    
-    final_stack_matrix, mapped_indices = region_based_rematching(
-        img_lab_2d,
-        regions,
-        tree,
-        lut_indices_map,
-        mask=solid_mask_2d
+        min_region_pixels=int(round(MIN_REGION_AREA_MM2 / PIXEL_SIZE ** 2)),
+        trace=trace
     )
+    # 匹配结果保持为区域图 + 区域层叠表 (相邻同层叠区域已合并)
+    region_map, mapped_indices = matched.value
+    h_pixels = mapped_indices.shape[0]
+    print(f"目标分辨率: {w_pixels} x {h_pixels} px")
+    print(f"🧩 层叠区域: {len(region_map)} 个")
 
+    # 缩放结果已缓存，这里只取透明度通道
+    alpha_channel_2d = pipeline.resize(image_key, w_pixels, load_image).value[..., 3]
     generate_preview_image_rgba(
         lut_colors, 
         mapped_indices, 
@@ -581,91 +879,50 @@ def main():
         "preview_simulation_km.png"
     )
 
+    export_formats = parse_export_formats(EXPORT_FORMATS)
+    part_names = [part_name(f["Name"]) for f in selected_filaments]
+    part_colors = [f.get('Color', '#808080') for f in selected_filaments]
+    if "npz" in export_formats:
+        save_stack_map(os.path.join("Output", "ChromaStack_Project.npz"), region_map.code_matrix(), region_map.mask,
+                       codec, PIXEL_SIZE, LAYER_HEIGHT, part_names, part_colors)
+        print("🗺️ 已保存层叠图: ChromaStack_Project.npz")
+    if "3mf" not in export_formats and "stl" not in export_formats:
+        print("\n=== 完成! ===")
+        return
+
     # ================= 6. 生成 3MF 双面模型 =================
     print(f"\n📦 开始打包生成 3MF 文件 (共 {num_slots} 色)...")
-    
-    h_color_stack = TOTAL_LAYERS * LAYER_HEIGHT 
-    z_back_start = 0.0
-    z_base_start = h_color_stack
-    z_front_start = h_color_stack + BASE_HEIGHT
-    
-    # 这里选择底面和原图一致，顶面水平翻转，PEI纹理板打出来更好看
-    # 1. 翻转 Mask (形状镜像) - axis=1 是水平方向
-    mask_common = np.flip(solid_mask_2d, axis=1)
-    
-    # 2. 翻转 颜色矩阵 (像素位置镜像)
-    # final_stack_matrix 形状是 (H, W, Layers)
-    matrix_mirrored_base = np.flip(final_stack_matrix, axis=1)
 
-    # 3. 分配矩阵
-    # 正面 (Top): 使用镜像后的矩阵
-    matrix_front = matrix_mirrored_base
-    
-    # 背面 (Bottom): 既要水平镜像(为了位置)，又要Z轴倒序(为了层叠顺序)
-    # [..., ::-1] 是将最后一维 (Layers) 倒序
-    matrix_back = matrix_mirrored_base.copy()[..., ::-1] 
+    # 几何清理 (小于最小可打印面积的孤岛/孔洞) + 网格生成；
+    # 底面和原图一致，顶面水平翻转 (PEI纹理板打出来更好看)，见 pipeline.build_slot_parts
+    print(f"🧵 网格生成: {resolve_workers(MESH_WORKERS)} 个进程")
+    meshed = pipeline.mesh(
+        matched.key, region_map, codec, LAYER_HEIGHT, BASE_HEIGHT, PIXEL_SIZE,
+        mesher=MESHER,
+        min_island_mm2=min_island_area(MIN_ISLAND_AREA_MM2, NOZZLE_WIDTH),
+        simplify_tolerance_mm=SIMPLIFY_TOLERANCE_MM,
+        workers=MESH_WORKERS,
+        trace=trace
+    )
+    slot_parts = meshed.value.slot_parts
+    print("⏱️ 各阶段耗时: " + ", ".join(f"{stage} {info['seconds']:.2f}s" for stage, info in trace.items()))
 
-    # --- 初始化场景 ---
-    scene = trimesh.Scene()
-    
+    # --- 导出: 每个槽位一个零件，流式写入 3MF (颜色与耗材槽位映射一并写出) ---
     for i in range(num_slots):
-        fil_name = selected_filaments[i]['Name'].replace(" ", "_")
-        meshes_list = [] 
-        
-        # 1. 背面 (Bottom Layer - 贴床面)
-        mesh_back = create_voxel_mesh_masked(
-            matrix_back, i, w_pixels, h_pixels, mask_common, 
-            z_offset=z_back_start, is_base_layer=False
-        )
-        if mesh_back: meshes_list.append(mesh_back)
-
-        # 2. 中间 (仅限 Slot 1 - 白色底座)
-        if i == 0: 
-            mesh_mid = create_voxel_mesh_masked(
-                matrix_front, i, w_pixels, h_pixels, mask_common,
-                z_offset=z_base_start, is_base_layer=True
-            )
-            if mesh_mid: meshes_list.append(mesh_mid)
-
-        # 3. 正面 (Top Layer)
-        mesh_front = create_voxel_mesh_masked(
-            matrix_front, i, w_pixels, h_pixels, mask_common,
-            z_offset=z_front_start, is_base_layer=False
-        )
-        if mesh_front: meshes_list.append(mesh_front)
-
-        # --- 合并 & 挂载到组 ---
-        if meshes_list:
-            final_mesh = trimesh.util.concatenate(meshes_list)
-            
-            # 视觉颜色
-            hex_color = selected_filaments[i].get('Color', '#808080') 
-            try:
-                c_rgb = [int(hex_color[j:j+2], 16) for j in (1, 3, 5)]
-                c_rgba = c_rgb + [255]
-                final_mesh.visual.face_colors = c_rgba
-            except:
-                pass
-
-            # 给零件命名
-            final_mesh.metadata['name'] = fil_name
-
-            # 添加到场景
-            scene.add_geometry(final_mesh, node_name=fil_name, geom_name=fil_name)
-            print(f"  > 已添加零件: {fil_name}")
-            
-        else:
-            # print(f"  > 跳过空零件: Slot {i+1} ({fil_name})")
-            pass
+        if slot_parts[i]:
+            print(f"  > 已添加零件: {part_names[i]}")
 
-    # --- 导出 ---
-    if len(scene.geometry) > 0:
+    if "3mf" in export_formats:
         output_filename = "ChromaStack_Project.3mf"
         print(f"💾 正在保存 3MF 文件: {output_filename} ...")
-        scene.export(os.path.join("Output", output_filename))
-        print("✅ 保存成功！请将 .3mf 文件拖入 Bambu Studio / Orca Slicer。")
-    else:
-        print("⚠️ 场景为空，未生成文件。")
+        export_stats = write_3mf(os.path.join("Output", output_filename), slot_parts, part_names, part_colors)
+        if export_stats['parts'] > 0:
+            print(f"✅ 保存成功！({export_stats['triangles']} 个三角形) 请将 .3mf 文件拖入 Bambu Studio / Orca Slicer。")
+        else:
+            print("⚠️ 场景为空，未生成文件。")
+    if "stl" in export_formats:
+        stl_files = write_stl_parts("Output", "ChromaStack_Project", slot_parts, part_names)
+        print(f"💾 已保存 {len(stl_files)} 个 STL 文件: {', '.join(name for name, _ in stl_files)}")
 
     print("\n=== 完成! ===")
 
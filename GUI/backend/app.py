@@ -14,6 +14,9 @@ from .routes.filament import filament_bp
 from .routes.static import static_bp
 from .routes.config import config_bp
 from .routes.model import model_bp
+from .routes.jobs import jobs_bp
+from .routes.assets import assets_bp
+from .routes.metrics import metrics_bp
 
 # 创建Flask应用
 app = Flask(__name__)
@@ -28,6 +31,9 @@ app.register_blueprint(filament_bp)
 app.register_blueprint(static_bp)
 app.register_blueprint(config_bp)
 app.register_blueprint(model_bp)
+app.register_blueprint(jobs_bp)
+app.register_blueprint(assets_bp)
+app.register_blueprint(metrics_bp)
 
 if __name__ == '__main__':
     # 启动服务器
@@ -24,6 +24,38 @@ class Config:
     
     # 耗材库文件路径 - 使用相对路径
     FILAMENT_FILE = current_dir.parent.parent / 'my_filament.json'
+    
+    # 进程内 LUT + KDTree 缓存的内存上限 (字节)
+    LUT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    
+    # 准入控制: 单个 /preview 或 /generate 任务的预算
+    JOB_MEMORY_BUDGET_BYTES = 4 * 1024 * 1024 * 1024
+    JOB_TIME_BUDGET_SECONDS = 600
+    # 'downgrade' 超出预算时先降级 (稀疏 LUT、加大像素尺寸)，仍超出则拒绝；'reject' 直接拒绝
+    JOB_ADMISSION_MODE = 'downgrade'
+    JOB_DOWNGRADE_SPARSE_LUT = {'max_distinct': 3, 'max_changes': 3}
+    JOB_MAX_PIXEL_SIZE = 1.0
+    
+    # 后台任务队列: 工作线程数 (同时运行的任务数)、排队 + 运行中的任务数上限、保留的已结束任务数
+    JOB_WORKERS = 2
+    JOB_MAX_PENDING = 8
+    JOB_HISTORY = 100
+    # 同步请求 (async=false) 等待任务结束的最长时间 (秒)，超时后取消任务并返回 504
+    JOB_SYNC_TIMEOUT_SECONDS = 300
+    
+    # 流水线各阶段 (缩放、分割、匹配、网格) 输出缓存的内存上限 (字节)
+    PIPELINE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    
+    # 仓库级 tmp 目录 (预览图、图片资源库，/tmp/<文件> 提供访问)
+    TMP_DIR = current_dir.parent.parent / 'tmp'
+    # tmp 目录垃圾回收: 文件保留时间、两次自动回收的最小间隔 (秒)
+    TMP_MAX_AGE_SECONDS = 24 * 3600
+    TMP_GC_INTERVAL_SECONDS = 600
+    
+    # 阶段计时 (Server-Timing 响应头、响应中的 timing、/metrics 直方图)；关闭时各阶段不计时
+    INSTRUMENTATION_ENABLED = True
+    # 同时记录各阶段的 tracemalloc 峰值内存 (会使所有内存分配变慢，默认关闭)
+    INSTRUMENTATION_TRACE_MEMORY = False
 
 # 确保上传目录存在
 Config.UPLOAD_FOLDER.mkdir(exist_ok=True)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片资源路由模块
+"""
+
+from flask import Blueprint, request, jsonify
+
+from ..utils.asset_store import asset_store
+from ..utils.file_utils import allowed_file
+
+# 创建蓝图
+assets_bp = Blueprint('assets', __name__)
+
+
+@assets_bp.route('/assets', methods=['POST'])
+def upload_asset():
+    """
+    上传图片 (内容相同的图片只存一份)，之后 /colorize、/preview、/generate、/estimate 传 asset_id 即可
+
+    Returns:
+        json: asset_id (内容的 SHA-256)、原图宽高、文件大小、是否新建
+    """
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': '缺少文件'}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': '文件名不能为空'}), 400
+        if not allowed_file(file.filename):
+            return jsonify({'error': '不支持的文件类型'}), 400
+
+        try:
+            asset, created = asset_store.put(file.read(), file.filename)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'success': True, 'created': created, **asset.to_dict()}), 201 if created else 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@assets_bp.route('/assets/<asset_id>', methods=['GET'])
+def get_asset(asset_id):
+    """
+    查询图片资源 (同时刷新保留时间)
+
+    Returns:
+        json: 原图宽高与文件大小；不存在或已过期时 404
+    """
+    asset = asset_store.get(asset_id)
+    if asset is None:
+        return jsonify({'error': '图片资源不存在或已过期'}), 404
+    return jsonify({'success': True, **asset.to_dict()}), 200
+
+
+@assets_bp.route('/assets', methods=['GET'])
+def get_asset_stats():
+    """
+    资源库统计
+
+    Returns:
+        json: 资源数、缩放缓存的命中率与内存占用、tmp 目录已清理的文件数
+    """
+    try:
+        return jsonify({'success': True, 'assets': asset_store.stats()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
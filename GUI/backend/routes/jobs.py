@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台任务路由模块
+"""
+
+from flask import Blueprint, jsonify
+
+from ..utils.job_queue import job_queue
+
+# 创建蓝图
+jobs_bp = Blueprint('jobs', __name__)
+
+
+@jobs_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    """
+    任务队列概况
+
+    Returns:
+        json: 队列深度、运行中任务数、各类任务的平均排队/运行/阶段耗时，以及保留的任务列表
+    """
+    try:
+        return jsonify({'success': True, 'queue': job_queue.stats(), 'jobs': job_queue.list_jobs()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    查询任务状态
+
+    Returns:
+        json: 状态、阶段、进度百分比、部分结果、耗时；结束后包含 result (与同步接口的响应相同，
+              阶段计时同时写入 Server-Timing 响应头)
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    response = jsonify({'success': True, **job.to_dict()})
+    if job.server_timing:
+        response.headers['Server-Timing'] = job.server_timing
+    return response, 200
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """
+    取消任务: 排队中的任务不再执行，运行中的任务在下一个阶段/槽位检查点停止
+
+    Returns:
+        json: 任务当前状态 (取消是异步的，state 变为 cancelled 前 cancel_requested 为 true)
+    """
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'success': True, **job.to_dict(include_result=False)}), 200
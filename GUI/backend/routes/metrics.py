@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控指标路由模块 (Prometheus 文本格式)
+"""
+
+from flask import Blueprint, Response, jsonify
+
+from ..utils.job_queue import job_queue
+from ..utils.lut_cache import lut_cache
+from ..utils.pipeline_cache import get_pipeline
+
+# 创建蓝图
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def render_gauges():
+    """任务队列深度与各缓存的内存占用、命中次数"""
+    queue = job_queue.stats()
+    caches = {
+        'lut': lut_cache.stats(),
+        'pipeline': get_pipeline().stats(),
+    }
+    lines = [
+        '# HELP chromastack_jobs_queued 排队中的任务数',
+        '# TYPE chromastack_jobs_queued gauge',
+        f"chromastack_jobs_queued {queue['queued']}",
+        '# HELP chromastack_jobs_running 运行中的任务数',
+        '# TYPE chromastack_jobs_running gauge',
+        f"chromastack_jobs_running {queue['running']}",
+        '# HELP chromastack_cache_bytes 进程内缓存的内存占用 (字节)',
+        '# TYPE chromastack_cache_bytes gauge',
+    ]
+    for name, stats in caches.items():
+        lines.append(f'chromastack_cache_bytes{{cache="{name}"}} {stats["current_bytes"]}')
+    lines.append('# HELP chromastack_cache_evictions_total 进程内缓存的淘汰次数')
+    lines.append('# TYPE chromastack_cache_evictions_total counter')
+    for name, stats in caches.items():
+        lines.append(f'chromastack_cache_evictions_total{{cache="{name}"}} {stats["evictions"]}')
+    return '\n'.join(lines) + '\n'
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus 指标: 各任务类型、各阶段的耗时/CPU/峰值内存直方图，任务队列与缓存的当前状态
+
+    Returns:
+        text/plain: Prometheus 文本格式 (version 0.0.4)
+    """
+    try:
+        import instrumentation
+        text = instrumentation.histograms.render() + render_gauges()
+        return Response(text, mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -9,9 +9,12 @@ import json
 import numpy as np
 from pathlib import Path
 from flask import Blueprint, request, jsonify
-import cv2
-import trimesh
-from shapely.geometry import Polygon
+from ..utils.lut_cache import get_lut_bundle, lut_cache
+from ..utils.cost_estimator import admit_job
+from ..utils.job_queue import QueueFull, job_queue
+from ..utils.asset_store import asset_store
+from ..utils.pipeline_cache import get_pipeline
+from ..config import Config
 # 设置 matplotlib 非交互式后端，避免 Tkinter 线程错误
 import matplotlib
 matplotlib.use('Agg')
@@ -25,7 +28,7 @@ model_bp = Blueprint('model', __name__)
 CONFIG_FILE = Path(__file__).parent.parent.parent.parent / 'config' / 'model_generation.yaml'
 INVENTORY_FILE = Path(__file__).parent.parent.parent.parent / 'my_filament.json'
 
-# TOTAL_LAYERS 常量
+# TOTAL_LAYERS 默认值 (可通过配置项 total_layers 覆盖，6 层以上自动使用折半合成 LUT)
 TOTAL_LAYERS = 5
 
 def visualize_gamut(lut_colors):
@@ -91,135 +94,6 @@ def visualize_gamut(lut_colors):
     plt.close()  # 关闭图形，释放内存
     print(f"📈 色域图已保存为 {output_path}")
 
-def create_voxel_mesh_masked(indices_matrix, slot_id, width_pixels, height_pixels, solid_mask_2d, z_offset=0.0, is_base_layer=False, layer_height=0.08, base_height=0.8, pixel_size=0.2):
-    """
-    [修复版] 为单个耗材创建带 Mask 的网格
-    1. 解决了 trimesh.load_path 不接受列表的报错。
-    2. 增加了孔洞处理 (RETR_CCOMP)，防止 'O' 型图案中间被填实。
-    
-    参数:
-    indices_matrix: (H, W, Layers) 每个像素的层叠索引
-    slot_id: 耗材在插槽中的索引
-    width_pixels, height_pixels: 图片分辨率
-    solid_mask_2d: (H, W) 布尔掩码，True 表示需要打印
-    z_offset: 起始高度
-    is_base_layer: 是否为底座层（单层）
-    layer_height: 颜色层层高 (mm)
-    base_height: 白色底座厚度 (mm)
-    pixel_size: 像素尺寸/水平分辨率 (mm)
-    """
-    meshes_to_combine = []
-
-    # 辅助函数：将 OpenCV 轮廓坐标转换为物理坐标
-    def convert_contour_to_points(cnt):
-        # cnt shape: (N, 1, 2) -> (N, 2)
-        pts = cnt.reshape(-1, 2)
-        physical_pts = np.zeros_like(pts, dtype=float)
-        # X轴转换 (注意：Main函数里可能已经做过镜像，这里只负责缩放)
-        physical_pts[:, 0] = pts[:, 0] * pixel_size
-        # Y轴转换 (OpenCV原点在左上，3D打印在左下，需要翻转Y)
-        physical_pts[:, 1] = (height_pixels - 1 - pts[:, 1]) * pixel_size
-        return physical_pts
-
-    # 待处理的任务列表：(Layer_Index, Mask)
-    tasks = []
-    
-    if is_base_layer and slot_id == 0:
-        # 场景 A: 白色底座 (单层厚度 = base_height)
-        layer_mask_u8 = (solid_mask_2d.astype(np.uint8)) * 255
-        tasks.append({
-            "mask": layer_mask_u8, 
-            "height": base_height, 
-            "z_start": z_offset
-        })
-        
-    elif not is_base_layer:
-        # 场景 B: 彩色层 (逐层切片, 单层厚度 = layer_height)
-        for layer_idx in range(TOTAL_LAYERS):
-            current_layer_slots = indices_matrix[:, :, layer_idx]
-            layer_mask = (current_layer_slots == slot_id) & solid_mask_2d
-            if np.any(layer_mask):
-                tasks.append({
-                    "mask": layer_mask.astype(np.uint8) * 255,
-                    "height": layer_height,
-                    "z_start": z_offset + layer_idx * layer_height
-                })
-
-    # --- 核心处理循环 ---
-    for task in tasks:
-        mask_u8 = task["mask"]
-        extrude_h = task["height"]
-        z_pos = task["z_start"]
-
-        # 1. 查找轮廓 (使用 RETR_CCOMP 以支持孔洞层级)
-        # contours: 轮廓点列表
-        # hierarchy: [Next, Previous, First_Child, Parent]
-        contours, hierarchy = cv2.findContours(mask_u8, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-        
-        if contours and hierarchy is not None:
-            hierarchy = hierarchy[0] # 降维 (1, N, 4) -> (N, 4)
-            
-            for i, cnt in enumerate(contours):
-                # hierarchy[i][3] 是 Parent Index。如果为 -1，说明它是最外层轮廓 (Shell)
-                if hierarchy[i][3] == -1:
-                    # 1. 构建外壳 (Shell)
-                    shell_pts = convert_contour_to_points(cnt)
-                    if len(shell_pts) < 3: continue # 忽略噪点
-                    
-                    # 2. 寻找属于它的孔洞 (Holes)
-                    holes_pts_list = []
-                    child_idx = hierarchy[i][2] # First Child
-                    while child_idx != -1:
-                        hole_cnt = contours[child_idx]
-                        if len(hole_cnt) >= 3:
-                            holes_pts_list.append(convert_contour_to_points(hole_cnt))
-                        child_idx = hierarchy[child_idx][0] # Next Sibling (同级孔洞)
-
-                    # 3. 创建 Shapely 多边形
-                    try:
-                        raw_poly = Polygon(shell=shell_pts, holes=holes_pts_list)
-                        
-                        # 4. 清理无效几何 (修复自交)
-                        # buffer(0) 可能会把一个 Polygon 变成 MultiPolygon
-                        cleaned_geom = raw_poly.buffer(0)
-
-                        if cleaned_geom.is_empty:
-                            continue
-
-                        # 统一标准化为列表处理
-                        # 如果是 MultiPolygon，这就包含了多个子多边形
-                        # 如果是 Polygon，就把它放进列表里
-                        if cleaned_geom.geom_type == 'MultiPolygon':
-                            polys_to_process = list(cleaned_geom.geoms)
-                        elif cleaned_geom.geom_type == 'Polygon':
-                            polys_to_process = [cleaned_geom]
-                        else:
-                            continue
-
-                        # 5. 遍历列表进行拉伸
-                        for p in polys_to_process:
-                            if p.area > 1e-6: # 忽略极小碎屑
-                                mesh = trimesh.creation.extrude_polygon(p, height=extrude_h)
-                                
-                                # 6. 移动到正确高度
-                                z_min = mesh.bounds[0][2]
-                                mesh.apply_translation([0, 0, z_pos - z_min])
-                                
-                                meshes_to_combine.append(mesh)
-                            
-                    except Exception as e:
-                        print(f"    [!] 几何构建警告: {e}")
-                        continue
-
-    if not meshes_to_combine:
-        return None
-        
-    # 合并当前 Slot 的所有 Mesh
-    print(f"    - 合并 {len(meshes_to_combine)} 个几何体片段...")
-    combined_mesh = trimesh.util.concatenate(meshes_to_combine)
-    return combined_mesh
-
-
 def load_config():
     """加载配置文件"""
     if CONFIG_FILE.exists():
@@ -244,6 +118,278 @@ def save_config(config_data):
         return False
 
 
+def get_sparse_lut_options(config, form):
+    """
+    读取稀疏 LUT 参数 (请求参数优先于配置文件)
+    lut_mode 为 'sparse' 时返回约束字典，否则返回 None (完整 LUT)
+    """
+    if form.get('lut_mode', config.get('lut_mode', 'full')) != 'sparse':
+        return None
+    return {
+        'max_distinct': form.get('lut_max_distinct', config.get('lut_max_distinct')),
+        'max_changes': form.get('lut_max_changes', config.get('lut_max_changes')),
+        'base_slot': form.get('lut_base_slot', config.get('lut_base_slot')),
+        'merge_delta_e': form.get('lut_merge_delta_e', config.get('lut_merge_delta_e')),
+    }
+
+
+def get_matching_mode(config, form):
+    """颜色匹配方式: 'region' (分割后按区域匹配) 或 'pixel' (逐像素匹配)"""
+    mode = form.get('matching_mode', config.get('matching_mode', 'region'))
+    return 'pixel' if mode == 'pixel' else 'region'
+
+
+def run_admission(image_size, num_filaments, total_layers, model_width, pixel_size, sparse, stage,
+                  is_double_sided=True, matching_mode='region', mode=None):
+    """
+    在分配内存前估算开销并执行准入控制 (image_size 为原图 (宽, 高)，上传时已记录，不解码像素)
+    mode 为 None 时使用 Config.JOB_ADMISSION_MODE
+
+    Returns:
+        dict: admit_job 的结果 (admitted / params / estimate / downgrades)
+    """
+    from lut_store import normalize_sparse_options
+
+    width, height = image_size
+    return admit_job({
+        'num_filaments': num_filaments,
+        'total_layers': total_layers,
+        'model_width': model_width,
+        'pixel_size': pixel_size,
+        'aspect': height / width,
+        'is_double_sided': is_double_sided,
+        'sparse': normalize_sparse_options(sparse),
+        'stage': stage,
+        'matching_mode': matching_mode,
+    }, mode=mode)
+
+
+def admission_rejected_response(admission):
+    """超出预算时的 413 响应 (任务结果)"""
+    return {
+        'error': '任务超出资源预算，请减少耗材数量、层数或增大像素尺寸',
+        'estimate': admission['estimate'],
+        'downgrades': admission['downgrades'],
+    }, 413
+
+
+def admission_summary(admission):
+    """写入 JSON 响应的准入信息"""
+    return {
+        'peak_memory_bytes': admission['estimate']['peak_memory_bytes'],
+        'total_seconds': admission['estimate']['total_seconds'],
+        'downgrades': admission['downgrades'],
+    }
+
+
+def match_asset_colors(asset, target_width, bundle, alpha_threshold, matching_mode, min_pixel_size, scale, sigma,
+                       min_region_pixels=0, trace=None):
+    """
+    流水线: 缩放 -> 透明度掩码 -> Lab / 分割 -> 颜色匹配 (各阶段按参数哈希缓存，/preview 与 /generate 共用)
+    min_region_pixels: 区域模式下小于该像素数的区域在匹配前并入最近的大区域
+
+    Returns:
+        StageResult: match 阶段输出 (key, MatchResult(区域图 + 区域层叠表, LUT 索引矩阵))
+    """
+    # 解码 + LANCZOS 缩放结果只由流水线的 resize 阶段按资源 ID 和目标宽度缓存
+    return get_pipeline().match_image(
+        asset.asset_id, target_width, lambda width: asset_store.load_rgba(asset, width), bundle,
+        alpha_threshold=alpha_threshold, matching_mode=matching_mode, min_pixel_size=min_pixel_size,
+        scale=scale, sigma=sigma, min_region_pixels=min_region_pixels, trace=trace
+    )
+
+
+def resolve_image_asset():
+    """
+    请求中的图片: asset_id (POST /assets 返回) 或直接上传的 file (同样存入资源库，按内容哈希命名)
+
+    Returns:
+        tuple: (Asset, None) 或 (None, 错误响应)
+    """
+    asset_id = request.form.get('asset_id')
+    if asset_id:
+        asset = asset_store.get(asset_id)
+        if asset is None:
+            return None, (jsonify({'error': '图片资源不存在或已过期，请重新上传'}), 404)
+        return asset, None
+
+    if 'file' not in request.files:
+        return None, (jsonify({'error': '缺少文件'}), 400)
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({'error': '文件名不能为空'}), 400)
+    try:
+        asset, _ = asset_store.put(file.read(), file.filename)
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    return asset, None
+
+
+def load_job_asset(asset_id):
+    """任务开始时取回图片资源 (排队期间可能已被清理)"""
+    asset = asset_store.get(asset_id)
+    if asset is None:
+        return None, ({'error': '图片资源不存在或已过期，请重新上传'}, 404)
+    return asset, None
+
+
+def get_mesh_options(config, form):
+    """
+    读取网格生成与导出参数 (请求参数优先于配置文件)
+    导出格式不合法时抛出 ValueError
+    """
+    from model_export import parse_export_formats
+
+    return {
+        # 网格生成方式: 'contour' (逐层轮廓拉伸) 或 'greedy' (体素贪心合并，每个槽位一个焊接网格)
+        'mesher': form.get('mesher', config.get('mesher', 'contour')),
+        # 网格生成的工作进程数 (0 表示按 CPU 核数)
+        'mesh_workers': int(form.get('mesh_workers', config.get('mesh_workers', 0))),
+        # 几何清理: 最小孤岛/孔洞面积 (mm²，'auto' 为喷嘴宽度的平方，0 不处理) 与轮廓简化容差 (mm，0 不简化)
+        'nozzle_width': float(form.get('nozzle_width', config.get('nozzle_width', 0.4))),
+        'min_island_area': form.get('min_island_area', config.get('min_island_area', 0)),
+        'simplify_tolerance': float(form.get('simplify_tolerance', config.get('simplify_tolerance', 0))),
+        # 导出格式: '3mf' / 'stl' (每个槽位一个二进制 STL) / 'npz' (层叠图)，逗号分隔可同时导出多种
+        'export_formats': parse_export_formats(form.get('export_formats', config.get('export_formats', '3mf'))),
+    }
+
+
+def build_model_outputs(region_map, source_key, codec, part_names, part_colors, layer_height, model_depth, pixel_size,
+                        is_double_sided, mesh_options, job=None, trace=None):
+    """
+    由区域层叠生成模型并按 mesh_options['export_formats'] 导出到 Output 目录
+    (网格阶段按 source_key + 网格参数缓存，同一匹配结果重复生成时直接导出)
+
+    Args:
+        region_map: RegionStackMap，颜色匹配得到的区域图 + 区域层叠表 (图片方向)
+        source_key: 区域图的内容哈希 (流水线 match 阶段的键或层叠图文件的哈希)
+        part_names / part_colors: 每个槽位的零件名与颜色
+        job: 后台任务 (job_queue.Job)，各阶段和每个槽位之后汇报进度并检查是否已取消
+        trace: 记录流水线各阶段是否命中缓存及耗时
+
+    Returns:
+        dict: 写入 JSON 响应的字段 (model_path / stl_paths / stack_map_path 为前端可访问的相对路径)
+    """
+    import uuid
+    import instrumentation
+    from geometry_cleanup import min_island_area
+    from model_export import save_stack_map, write_3mf, write_stl_parts
+
+    export_formats = mesh_options['export_formats']
+    report = job.report if job is not None else (lambda *args, **kwargs: None)
+    outputs = {'model_path': None, 'stl_paths': [], 'stack_map_path': None,
+               'geometry_cleanup': {'triangles_saved': 0, 'simplified_triangles_saved': 0}}
+    
+    # 创建输出目录
+    output_dir = Path(__file__).parent.parent.parent.parent / 'Output'
+    output_dir.mkdir(exist_ok=True)
+    stem = f"ChromaStack_Project_{uuid.uuid4().hex}"
+    
+    # 层叠图: 保存匹配结果 (未镜像、未清理)，之后可以不重新匹配直接生成网格
+    if 'npz' in export_formats:
+        stack_map_filename = f"{stem}.npz"
+        with instrumentation.stage('export'):
+            save_stack_map(output_dir / stack_map_filename, region_map.code_matrix(), region_map.mask, codec,
+                           pixel_size, layer_height, part_names, part_colors)
+        outputs['stack_map_path'] = f'/Output/{stack_map_filename}'
+        print(f"🗺️ 已保存层叠图: {stack_map_filename}")
+        report(stack_map_path=outputs['stack_map_path'])
+    if '3mf' not in export_formats and 'stl' not in export_formats:
+        return outputs
+    
+    # 几何清理 + 网格生成 (镜像、正反两面与底座见 pipeline.build_slot_parts)
+    meshed = get_pipeline().mesh(
+        source_key, region_map, codec, layer_height, model_depth, pixel_size,
+        mesher=mesh_options['mesher'], double_sided=is_double_sided,
+        min_island_mm2=min_island_area(mesh_options['min_island_area'], mesh_options['nozzle_width']),
+        simplify_tolerance_mm=mesh_options['simplify_tolerance'], workers=mesh_options['mesh_workers'],
+        report=report, trace=trace
+    )
+    slot_parts, cleanup_report = meshed.value
+    outputs['geometry_cleanup'].update(cleanup_report)
+    
+    # 每写完一个零件汇报一次进度 (同时是取消检查点)
+    report('export', 70, geometry_cleanup=dict(outputs['geometry_cleanup']))
+    def on_part(done, total):
+        report(percent=70 + 30 * done / max(total, 1))
+    
+    # 导出 3MF 文件: 每个槽位一个零件，流式写入 (颜色与耗材槽位映射一并写出)
+    if '3mf' in export_formats:
+        model_filename = f"{stem}.3mf"
+        print(f"💾 正在保存 3MF 文件: {model_filename} ...")
+        with instrumentation.stage('export'):
+            export_stats = write_3mf(output_dir / model_filename, slot_parts, part_names, part_colors,
+                                     on_part=on_part)
+        if export_stats['parts'] > 0:
+            print(f"✅ 保存成功！({export_stats['parts']} 个零件，{export_stats['triangles']} 个三角形)")
+            outputs['model_path'] = f'/Output/{model_filename}'
+        else:
+            print("⚠️ 场景为空，未生成文件。")
+    
+    # 导出 STL 文件: 每个槽位一个二进制 STL
+    if 'stl' in export_formats:
+        with instrumentation.stage('export'):
+            stl_files = write_stl_parts(output_dir, stem, slot_parts, part_names, on_part=on_part)
+        outputs['stl_paths'] = [f'/Output/{filename}' for filename, _ in stl_files]
+        print(f"💾 已保存 {len(stl_files)} 个 STL 文件 ({sum(n for _, n in stl_files)} 个三角形)")
+    
+    return outputs
+
+
+def is_async_request(form):
+    """
+    默认提交任务后立即返回任务 ID (配置项 async_jobs，默认开启)；
+    请求参数 async=false 时在当前请求中等待结果 (脚本、命令行调用)
+    """
+    return str(form.get('async', load_config().get('async_jobs', True))).lower() == 'true'
+
+
+def instrumented(kind, fn):
+    """
+    为任务函数打开阶段计时 (Config.INSTRUMENTATION_ENABLED 关闭时原样返回)
+
+    各阶段的墙钟/CPU 时间 (及可选的峰值内存) 写入响应的 timing 字段和 job.server_timing
+    (Server-Timing 响应头)，并计入 /metrics 的直方图
+    """
+    if not Config.INSTRUMENTATION_ENABLED:
+        return fn
+
+    def run(job, *args):
+        import time
+        import instrumentation
+        started = time.perf_counter()
+        with instrumentation.recording(Config.INSTRUMENTATION_TRACE_MEMORY) as recorder:
+            result, status_code = fn(job, *args)
+        instrumentation.histograms.observe(kind, recorder, time.perf_counter() - started)
+        job.server_timing = recorder.server_timing()
+        return dict(result, timing=recorder.to_dict()), status_code
+    return run
+
+
+def submit_job(kind, fn, *args, async_request=False):
+    """
+    把耗时任务交给后台任务队列
+
+    async_request 为 True 时立即返回 202 和任务 ID (进度见 GET /jobs/<id>，DELETE /jobs/<id> 取消)，
+    否则等待任务结束后返回任务结果 (与原同步接口的响应相同，附带 Server-Timing 响应头)；
+    同步等待超过 JOB_SYNC_TIMEOUT_SECONDS 时取消任务并返回 504，队列已满时返回 503
+    """
+    try:
+        job = job_queue.submit(kind, instrumented(kind, fn), *args)
+    except QueueFull as e:
+        return jsonify({'error': str(e), 'queue': job_queue.stats()}), 503
+    if async_request:
+        return jsonify({'success': True, 'job_id': job.id, 'status_url': f'/jobs/{job.id}'}), 202
+    if not job.wait(Config.JOB_SYNC_TIMEOUT_SECONDS):
+        # 调用方已不再等待结果，任务在下一个检查点停止，不再占用工作线程
+        job_queue.cancel(job.id)
+        return jsonify({'error': f'任务超时 ({Config.JOB_SYNC_TIMEOUT_SECONDS} 秒)，已取消', 'job_id': job.id}), 504
+    response = jsonify(job.result)
+    if job.server_timing:
+        response.headers['Server-Timing'] = job.server_timing
+    return response, job.status_code
+
+
 def load_filaments():
     """加载耗材库"""
     filaments = []
@@ -297,236 +443,304 @@ def get_filaments():
         return jsonify({'error': str(e)}), 500
 
 
+@model_bp.route('/cache/lut', methods=['GET'])
+def get_lut_cache_stats():
+    """获取进程内 LUT 缓存的命中统计"""
+    try:
+        return jsonify({'success': True, 'stats': lut_cache.stats()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@model_bp.route('/cache/pipeline', methods=['GET'])
+def get_pipeline_cache_stats():
+    """获取流水线各阶段的缓存命中统计与计算耗时"""
+    try:
+        return jsonify({'success': True, 'stats': get_pipeline().stats()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@model_bp.route('/estimate', methods=['POST'])
+def estimate_job_cost():
+    """
+    估算任务开销 (不执行任务)
+    参数: filaments 或 num_filaments、model_width、pixel_size、total_layers、
+          aspect 或 image_width + image_height (或上传 file / asset_id)、is_double_sided、stage、matching_mode
+    """
+    try:
+        from PIL import Image
+        from lut_store import normalize_sparse_options
+
+        params = request.get_json(silent=True) or request.form
+        config = load_config()
+
+        if 'num_filaments' in params:
+            num_filaments = int(params['num_filaments'])
+        else:
+            filaments = params.get('filaments', '[]')
+            num_filaments = len(json.loads(filaments) if isinstance(filaments, str) else filaments)
+        if num_filaments < 1:
+            return jsonify({'error': '请提供耗材列表或耗材数量'}), 400
+
+        if params.get('asset_id'):
+            asset = asset_store.get(params['asset_id'])
+            if asset is None:
+                return jsonify({'error': '图片资源不存在或已过期，请重新上传'}), 404
+            aspect = asset.aspect
+        elif 'file' in request.files:
+            with Image.open(request.files['file'].stream) as probe:
+                width, height = probe.size
+            aspect = height / width
+        elif 'aspect' in params:
+            aspect = float(params['aspect'])
+        else:
+            aspect = float(params.get('image_height', config.get('image_height', 1))) / \
+                float(params.get('image_width', config.get('image_width', 1)))
+
+        is_double_sided = str(params.get('is_double_sided', config.get('is_double_sided', True))).lower() == 'true'
+        result = admit_job({
+            'num_filaments': num_filaments,
+            'total_layers': int(params.get('total_layers', config.get('total_layers', TOTAL_LAYERS))),
+            'model_width': float(params.get('model_width', config.get('model_width', 80))),
+            'pixel_size': float(params.get('pixel_size', config.get('pixel_size', 0.2))),
+            'aspect': aspect,
+            'is_double_sided': is_double_sided,
+            'sparse': normalize_sparse_options(get_sparse_lut_options(config, params)),
+            'stage': params.get('stage', 'generate'),
+            'matching_mode': get_matching_mode(config, params),
+        })
+        return jsonify({'success': True, **result}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @model_bp.route('/colorize', methods=['POST'])
 def colorize_image():
-    """自动配色"""
+    """自动配色 (后台任务，默认立即返回任务 ID，async=false 时等待结果)"""
     try:
-        # 从FormData获取文件和参数
-        if 'file' not in request.files:
-            return jsonify({'error': '缺少文件'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': '文件名不能为空'}), 400
-        
-        # 获取颜色数量参数
-        color_count = int(request.form.get('color_count', 5))
-        
-        # 保存文件到临时目录
-        temp_dir = Path(__file__).parent.parent.parent.parent / 'tmp'
-        temp_dir.mkdir(exist_ok=True)
-        
-        file_path = temp_dir / file.filename
-        file.save(file_path)
-        
-        # 导入并执行自动配色
-        from AutoSelector import extract_image_features
+        # 图片: asset_id 或上传的文件 (存入资源库)
+        asset, error = resolve_image_asset()
+        if error:
+            return error
         
-        # 执行颜色提取
-        centers_lab, weights = extract_image_features(str(file_path), n_colors=500)
-        
-        if centers_lab is None:
-            return jsonify({'error': '图片处理失败'}), 500
-        
-        # 从ChromStackStudio和AutoSelector导入必要的函数
-        from ChromaStackStudio import VirtualPhysics, load_inventory
-        from AutoSelector import evaluate_combination
-        import itertools
-        
-        # 加载耗材库
-        inventory = load_inventory(str(INVENTORY_FILE))
-        if not inventory:
-            return jsonify({'error': '耗材库为空'}), 500
-        
-        # 创建虚拟物理引擎实例
-        engine = VirtualPhysics()
-        
-        # 评估所有可能的耗材组合
-        combo_scores = []
-        
-        # 生成所有可能的耗材组合（选择color_count个耗材）
-        combinations = list(itertools.combinations(inventory, color_count))
-        print(f"共有 {len(combinations)} 种耗材组合待评估...")
-        
-        for combo in combinations:
-            try:
-                score = evaluate_combination(engine, list(combo), centers_lab, weights)
-                combo_scores.append((score, [f['Name'] for f in combo]))
-            except Exception as e:
-                print(f"评估耗材组合时出错: {e}")
-                continue
-        
-        # 如果没有找到合适的组合，返回错误
-        if not combo_scores:
-            return jsonify({'error': '无法找到合适的耗材组合'}), 500
-        
-        # 按分数排序，选择前三的组合
-        combo_scores.sort(key=lambda x: x[0])
-        top_combinations = combo_scores[:3]
-        
-        # 提取最佳组合
-        best_score, best_combo = top_combinations[0]
-        
-        # 准备返回数据
-        top_combos_data = []
-        for score, combo in top_combinations:
-            top_combos_data.append({
-                'score': score,
-                'filaments': combo
-            })
-        
-        return jsonify({
-            'success': True,
-            'best_combination': {
-                'score': best_score,
-                'filaments': best_combo
-            },
-            'top_combinations': top_combos_data
-        }), 200
+        form = request.form.to_dict()
+        return submit_job('colorize', colorize_job, form, asset.asset_id, async_request=is_async_request(form))
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 
+def colorize_job(job, form, asset_id):
+    """自动配色任务: 提取图片特征后评估所有耗材组合 (每个组合之后都可以取消)"""
+    asset, error = load_job_asset(asset_id)
+    if error:
+        return error
+    
+    # 获取颜色数量参数
+    color_count = int(form.get('color_count', 5))
+    
+    # 导入并执行自动配色
+    import instrumentation
+    from AutoSelector import extract_image_features
+    
+    # 执行颜色提取
+    job.report('features', 0)
+    with instrumentation.stage('features'):
+        centers_lab, weights = extract_image_features(str(asset.path), n_colors=500)
+    
+    if centers_lab is None:
+        return {'error': '图片处理失败'}, 500
+    
+    # 从ChromStackStudio和AutoSelector导入必要的函数
+    from ChromaStackStudio import StackCodec, VirtualPhysics, load_inventory
+    from AutoSelector import evaluate_combination
+    import itertools
+    
+    # 加载耗材库
+    inventory = load_inventory(str(INVENTORY_FILE))
+    if not inventory:
+        return {'error': '耗材库为空'}, 500
+    
+    # 创建虚拟物理引擎实例
+    engine = VirtualPhysics()
+    
+    # 评估所有可能的耗材组合
+    combo_scores = []
+    
+    # 生成所有可能的耗材组合（选择color_count个耗材）
+    combinations = list(itertools.combinations(inventory, color_count))
+    print(f"共有 {len(combinations)} 种耗材组合待评估...")
+    job.report('evaluating', 5, evaluated=0, total=len(combinations))
+    
+    for combo_idx, combo in enumerate(combinations):
+        # 进度 + 取消检查点
+        job.report(percent=5 + 95 * combo_idx / len(combinations), evaluated=combo_idx)
+        try:
+            with instrumentation.stage('evaluate'):
+                score = evaluate_combination(engine, list(combo), centers_lab, weights)
+            combo_scores.append((score, [f['Name'] for f in combo]))
+        except Exception as e:
+            print(f"评估耗材组合时出错: {e}")
+            continue
+    
+    job.report(percent=100, evaluated=len(combinations))
+    
+    # 如果没有找到合适的组合，返回错误
+    if not combo_scores:
+        return {'error': '无法找到合适的耗材组合'}, 500
+    
+    # 按分数排序，选择前三的组合
+    combo_scores.sort(key=lambda x: x[0])
+    top_combinations = combo_scores[:3]
+    
+    # 提取最佳组合
+    best_score, best_combo = top_combinations[0]
+    
+    # 准备返回数据
+    top_combos_data = []
+    for score, combo in top_combinations:
+        top_combos_data.append({
+            'score': score,
+            'filaments': combo
+        })
+    
+    return {
+        'success': True,
+        'best_combination': {
+            'score': best_score,
+            'filaments': best_combo
+        },
+        'top_combinations': top_combos_data
+    }, 200
+
+
 @model_bp.route('/preview', methods=['POST'])
 def generate_preview():
-    """生成预览图"""
+    """生成预览图 (后台任务，默认立即返回任务 ID，async=false 时等待结果)"""
     try:
-        # 从FormData获取文件和参数
-        if 'file' not in request.files:
-            return jsonify({'error': '缺少文件'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': '文件名不能为空'}), 400
-
-        # 获取耗材参数
-        filaments_str = request.form.get('filaments', '[]')
-        selected_filaments = json.loads(filaments_str)
-        
-        # 保存文件到临时目录
-        temp_dir = Path(__file__).parent.parent.parent.parent / 'tmp'
-        temp_dir.mkdir(exist_ok=True)
-        
-        file_path = temp_dir / file.filename
-        file.save(file_path)
-        
-        # 加载配置
-        config = load_config()
-        
-        # 获取算法参数
-        min_pixel_size = int(request.form.get('min_pixel_size', config.get('min_pixel_size', 5)))
-        scale = int(request.form.get('scale', config.get('scale', 10)))
-        sigma = float(request.form.get('sigma', config.get('sigma', 0.5)))
-        
-        # 获取模型参数
-        model_width = float(request.form.get('model_width', config.get('model_width', 80)))
-        pixel_size = float(request.form.get('pixel_size', config.get('pixel_size', 0.2)))
-        alpha_threshold = int(request.form.get('alpha_threshold', config.get('alpha_threshold', 128)))
-        layer_height = float(request.form.get('layer_height', config.get('layer_height', 0.08)))
-        
-        # 导入必要的模块
-        from ChromaStackStudio import VirtualPhysics, rgb_to_lab, load_inventory, generate_regions_felzenszwalb, region_based_rematching
-        from scipy.spatial import KDTree
-        
-        # 加载耗材库
-        inventory = load_inventory(str(INVENTORY_FILE))
-        
-        # 根据名称找到选中的耗材
-        selected = []
-        for name in selected_filaments:
-            filament = next((f for f in inventory if f['Name'] == name), None)
-            if filament:
-                selected.append(filament)
-        
-        if len(selected) < 2:
-            return jsonify({'error': '请至少选择2个耗材'}), 400
-        
-        # 生成LUT
-        engine = VirtualPhysics()
-        lut_rgb, lut_indices_map = engine.generate_lut_km(selected, total_layers=TOTAL_LAYERS, layer_height=layer_height)
-        
-        # 生成色彩域预览图
-        visualize_gamut(lut_rgb)
-        
-        # 生成唯一的预览图文件名
-        import uuid
-        preview_filename = f'preview_result_{uuid.uuid4().hex}.png'
-        output_path = temp_dir / preview_filename
-        
-        # 加载原始图片
-        from PIL import Image
-        
-        img = Image.open(file_path).convert('RGBA')
-        width, height = img.size
-        
-        # 调整大小 - 与ChromaStackStudio.py保持一致
-        target_width = int(model_width / pixel_size)  # 根据模型宽度和像素尺寸计算目标宽度
-        # 保持原始图片比例计算目标高度
-        aspect = height / width
-        target_height = int(target_width * aspect)
-        img = img.resize((target_width, target_height), Image.LANCZOS)
-        
-        # 转换为数组
-        img_arr = np.array(img)
-        
-        # 计算透明度掩码
-        alpha_channel_2d = img_arr[..., 3]
-        solid_mask_2d = alpha_channel_2d > alpha_threshold  # 使用从前端传入的参数
-        
-        # KDTree 颜色匹配
-        lut_lab = rgb_to_lab(lut_rgb)
-        tree = KDTree(lut_lab)
-        img_lab_2d = rgb_to_lab(img_arr[..., :3].reshape(-1, 3)).reshape(target_height, target_width, 3)
+        # 图片: asset_id 或上传的文件 (存入资源库)
+        asset, error = resolve_image_asset()
+        if error:
+            return error
         
-        # 区域分割
-        regions = generate_regions_felzenszwalb(
-            img_arr[..., :3],  # 传入 RGB
-            min_pixel_size=min_pixel_size,  # 使用从前端传入的参数
-            scale=scale,           # 使用从前端传入的参数
-            sigma=sigma,          # 使用从前端传入的参数
-            mask=solid_mask_2d
-        )
-        
-        # 区域基于的重匹配
-        final_stack_matrix, final_lut_idx_matrix = region_based_rematching(
-            img_lab_2d,
-            regions,
-            tree,
-            lut_indices_map,
-            mask=solid_mask_2d
-        )
-        
-        # 生成预览图
-        preview_img = Image.fromarray(lut_rgb[final_lut_idx_matrix])
-        preview_img.save(output_path)
-        
-        # 返回相对路径，前端可以直接访问
-        return jsonify({
-            'success': True,
-            'preview_path': f'/tmp/{preview_filename}',
-            'lut_colors': lut_rgb.tolist() if hasattr(lut_rgb, 'tolist') else lut_rgb,
-            'target_width': target_width,
-            'target_height': target_height
-        }), 200
+        form = request.form.to_dict()
+        return submit_job('preview', preview_job, form, asset.asset_id, async_request=is_async_request(form))
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 
+def preview_job(job, form, asset_id):
+    """预览任务: LUT -> 颜色匹配 -> 预览图"""
+    asset, error = load_job_asset(asset_id)
+    if error:
+        return error
+    
+    # 获取耗材参数
+    filaments_str = form.get('filaments', '[]')
+    selected_filaments = json.loads(filaments_str)
+    temp_dir = Config.TMP_DIR
+    temp_dir.mkdir(exist_ok=True)
+    
+    # 加载配置
+    config = load_config()
+    
+    # 获取算法参数
+    min_pixel_size = int(form.get('min_pixel_size', config.get('min_pixel_size', 5)))
+    scale = int(form.get('scale', config.get('scale', 10)))
+    sigma = float(form.get('sigma', config.get('sigma', 0.5)))
+    matching_mode = get_matching_mode(config, form)
+    min_region_area = float(form.get('min_region_area', config.get('min_region_area', 0)))
+    
+    # 获取模型参数
+    model_width = float(form.get('model_width', config.get('model_width', 80)))
+    pixel_size = float(form.get('pixel_size', config.get('pixel_size', 0.2)))
+    alpha_threshold = int(form.get('alpha_threshold', config.get('alpha_threshold', 128)))
+    layer_height = float(form.get('layer_height', config.get('layer_height', 0.08)))
+    total_layers = int(form.get('total_layers', config.get('total_layers', TOTAL_LAYERS)))
+    
+    # 导入必要的模块
+    import instrumentation
+    from ChromaStackStudio import load_inventory
+    
+    # 加载耗材库
+    inventory = load_inventory(str(INVENTORY_FILE))
+    
+    # 根据名称找到选中的耗材
+    selected = []
+    for name in selected_filaments:
+        filament = next((f for f in inventory if f['Name'] == name), None)
+        if filament:
+            selected.append(filament)
+    
+    if len(selected) < 2:
+        return {'error': '请至少选择2个耗材'}, 400
+    
+    # 准入控制: 超出预算时降级或拒绝
+    admission = run_admission((asset.width, asset.height), len(selected), total_layers, model_width, pixel_size,
+                              get_sparse_lut_options(config, form), stage='preview',
+                              matching_mode=matching_mode)
+    if not admission['admitted']:
+        return admission_rejected_response(admission)
+    pixel_size = admission['params']['pixel_size']
+    
+    # 获取LUT (进程内缓存 -> 磁盘缓存 -> 重新计算)
+    job.report('lut', 5, admission=admission_summary(admission))
+    with instrumentation.stage('lut'):
+        bundle = get_lut_bundle(selected, total_layers, layer_height, sparse=admission['params']['sparse'])
+    lut_rgb, lut_codes = bundle.lut_rgb, bundle.lut_codes
+    
+    # 生成色彩域预览图
+    with instrumentation.stage('gamut'):
+        visualize_gamut(lut_rgb)
+    
+    # 生成唯一的预览图文件名
+    import uuid
+    preview_filename = f'preview_result_{uuid.uuid4().hex}.png'
+    output_path = temp_dir / preview_filename
+    
+    # 调整大小 - 与ChromaStackStudio.py保持一致
+    target_width = int(model_width / pixel_size)  # 根据模型宽度和像素尺寸计算目标宽度
+    target_height = asset_store.target_size(asset, target_width)[1]
+    
+    # 颜色匹配 (流水线各阶段按参数缓存，之后的 /generate 直接复用匹配结果)
+    job.report('matching', 30, target_width=target_width, target_height=target_height)
+    trace = {}
+    matched = match_asset_colors(asset, target_width, bundle, alpha_threshold, matching_mode, min_pixel_size,
+                                 scale, sigma, min_region_pixels=int(round(min_region_area / pixel_size ** 2)),
+                                 trace=trace)
+    
+    # 生成预览图
+    from PIL import Image
+    
+    job.report('preview', 90, pipeline=dict(trace))
+    with instrumentation.stage('preview'):
+        preview_img = Image.fromarray(lut_rgb[matched.value.lut_idx_matrix])
+        preview_img.save(output_path)
+    
+    # 返回相对路径，前端可以直接访问
+    return {
+        'success': True,
+        'preview_path': f'/tmp/{preview_filename}',
+        'lut_colors': lut_rgb.tolist() if hasattr(lut_rgb, 'tolist') else lut_rgb,
+        'target_width': target_width,
+        'target_height': target_height,
+        'admission': admission_summary(admission),
+        'pipeline': trace
+    }, 200
+
+
 @model_bp.route('/generate', methods=['POST'])
 def generate_model():
-    """生成模型"""
+    """生成模型 (后台任务，默认立即返回任务 ID，async=false 时等待结果)"""
     try:
-        # 从FormData获取文件和参数
-        if 'file' not in request.files:
-            return jsonify({'error': '缺少文件'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': '文件名不能为空'}), 400
+        # 图片: asset_id 或上传的文件 (存入资源库)
+        asset, error = resolve_image_asset()
+        if error:
+            return error
         
         # 将API所有参数输出到控制台
         print(f"调试：收到的FormData参数 = {request.form}")
@@ -538,205 +752,183 @@ def generate_model():
         if not selected_filaments:
             return jsonify({'error': '请选择至少一个耗材'}), 400
         
-        # 保存文件到临时目录
-        temp_dir = Path(__file__).parent.parent.parent.parent / 'tmp'
-        temp_dir.mkdir(exist_ok=True)
-        
-        file_path = temp_dir / file.filename
-        file.save(file_path)
-        
-        # 加载配置
-        config = load_config()
-        
-        # 获取算法参数
-        min_pixel_size = int(request.form.get('min_pixel_size', config.get('min_pixel_size', 5)))
-        scale = int(request.form.get('scale', config.get('scale', 10)))
-        sigma = float(request.form.get('sigma', config.get('sigma', 0.5)))
-        
-        # 获取模型参数
-        layer_height = float(request.form.get('layer_height', config.get('layer_height', 0.08)))
-        model_width = float(request.form.get('model_width', config.get('model_width', 80)))
-        model_height = float(request.form.get('model_height', config.get('model_height', 80)))
-        model_depth = float(request.form.get('model_depth', config.get('model_depth', 0.8)))
-        pixel_size = float(request.form.get('pixel_size', config.get('pixel_size', 0.2)))
-        alpha_threshold = int(request.form.get('alpha_threshold', config.get('alpha_threshold', 128)))
-        # 获取是否生成双面模型的参数
-        is_double_sided = request.form.get('is_double_sided', str(config.get('is_double_sided', True))).lower() == 'true'
-        
-        # 导入必要的模块
-        from ChromaStackStudio import VirtualPhysics, load_inventory
-        
-        # 加载耗材库
-        inventory = load_inventory(str(INVENTORY_FILE))
-        
-        # 根据名称找到选中的耗材
-        selected = []
-        for name in selected_filaments:
-            filament = next((f for f in inventory if f['Name'] == name), None)
-            if filament:
-                selected.append(filament)
-        
-        if len(selected) < 2:
-            return jsonify({'error': '请至少选择2个耗材'}), 400
-        
-        # 生成LUT
-        engine = VirtualPhysics()
-        lut_rgb, lut_indices_map = engine.generate_lut_km(selected, TOTAL_LAYERS, layer_height)
-        
-        # 加载原始图片
-        from PIL import Image
-        
-        img = Image.open(file_path).convert('RGBA')
-        width, height = img.size
-        
-        # 调整大小 - 与ChromaStackStudio.py保持一致
-        target_width = int(model_width / pixel_size)  # 根据模型宽度和像素尺寸计算目标宽度
-        # 保持原始图片比例计算目标高度
-        aspect = height / width
-        target_height = int(target_width * aspect)
-        img = img.resize((target_width, target_height), Image.LANCZOS)
-        
-        # 转换为数组
-        img_arr = np.array(img)
-        
-        # 计算透明度掩码
-        alpha_channel_2d = img_arr[..., 3]
-        solid_mask_2d = alpha_channel_2d > alpha_threshold  # 使用从前端传入的参数
-        
-        from ChromaStackStudio import rgb_to_lab, generate_regions_felzenszwalb, region_based_rematching
-        from scipy.spatial import KDTree
-        
-        # KDTree 颜色匹配
-        lut_lab = rgb_to_lab(lut_rgb)
-        tree = KDTree(lut_lab)
-        img_lab_2d = rgb_to_lab(img_arr[..., :3].reshape(-1, 3)).reshape(target_height, target_width, 3)
-        
-        # 区域分割
-        regions = generate_regions_felzenszwalb(
-            img_arr[..., :3],  # 传入 RGB
-            min_pixel_size=min_pixel_size,  # 使用从前端传入的参数
-            scale=scale,           # 使用从前端传入的参数
-            sigma=sigma,          # 使用从前端传入的参数
-            mask=solid_mask_2d
-        )
-        
-        # 区域基于的重匹配
-        final_stack_matrix, final_lut_idx_matrix = region_based_rematching(
-            img_lab_2d,
-            regions,
-            tree,
-            lut_indices_map,
-            mask=solid_mask_2d
-        )
-        
-        # 生成 3D 模型
-        import trimesh
-        from shapely.geometry import Polygon
-        import cv2
-        
-        # 创建输出目录
-        output_dir = Path(__file__).parent.parent.parent.parent / 'Output'
-        output_dir.mkdir(exist_ok=True)
-        
-        # 计算尺寸
-        h_color_stack = TOTAL_LAYERS * layer_height
-        z_back_start = 0.0
-        z_base_start = h_color_stack
-        z_front_start = h_color_stack + model_depth
-        
-        # 翻转 Mask (形状镜像) - axis=1 是水平方向
-        mask_common = np.flip(solid_mask_2d, axis=1)
-        
-        # 翻转 颜色矩阵 (像素位置镜像)
-        matrix_mirrored_base = np.flip(final_stack_matrix, axis=1)
-        
-        # 分配矩阵
-        # 正面 (Top): 使用镜像后的矩阵
-        matrix_front = matrix_mirrored_base
-        
-        # 背面 (Bottom): 既要水平镜像(为了位置)，又要Z轴倒序(为了层叠顺序)
-        matrix_back = matrix_mirrored_base.copy()[..., ::-1]
-        
-        # 初始化场景
-        scene = trimesh.Scene()
-        
-        # 为每个耗材生成网格
-        num_slots = len(selected)
-        
-        for i in range(num_slots):
-            fil_name = selected[i]['Name'].replace(" ", "_")
-            meshes_list = []
-            
-            # 1. 背面 (Bottom Layer - 贴床面)
-            mesh_back = create_voxel_mesh_masked(
-                matrix_back, i, target_width, target_height, mask_common, 
-                z_offset=z_back_start, is_base_layer=False,
-                layer_height=layer_height, base_height=model_depth, pixel_size=pixel_size
-            )
-            if mesh_back:
-                meshes_list.append(mesh_back)
-
-            # 2. 中间 (仅限 Slot 1 - 白色底座)
-            if i == 0:
-                mesh_mid = create_voxel_mesh_masked(
-                    matrix_front, i, target_width, target_height, mask_common,
-                    z_offset=z_base_start, is_base_layer=True,
-                    layer_height=layer_height, base_height=model_depth, pixel_size=pixel_size
-                )
-                if mesh_mid:
-                    meshes_list.append(mesh_mid)
-
-            # 3. 正面 (Top Layer) - 仅在双面模式下生成
-            if is_double_sided:
-                mesh_front = create_voxel_mesh_masked(
-                    matrix_front, i, target_width, target_height, mask_common,
-                    z_offset=z_front_start, is_base_layer=False,
-                    layer_height=layer_height, base_height=model_depth, pixel_size=pixel_size
-                )
-                if mesh_front:
-                    meshes_list.append(mesh_front)
-
-            # 合并 & 挂载到组
-            if meshes_list:
-                final_mesh = trimesh.util.concatenate(meshes_list)
-                
-                # 视觉颜色
-                hex_color = selected[i].get('Color', '#808080')
-                try:
-                    c_rgb = [int(hex_color[j:j+2], 16) for j in (1, 3, 5)]
-                    c_rgba = c_rgb + [255]
-                    final_mesh.visual.face_colors = c_rgba
-                except:
-                    pass
-
-                # 给零件命名
-                final_mesh.metadata['name'] = fil_name
-
-                # 添加到场景
-                scene.add_geometry(final_mesh, node_name=fil_name, geom_name=fil_name)
-                print(f"  > 已添加零件: {fil_name}")
-            else:
-                pass
+        form = request.form.to_dict()
+        return submit_job('generate', generate_job, form, asset.asset_id, selected_filaments,
+                          async_request=is_async_request(form))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+def generate_job(job, form, asset_id, selected_filaments):
+    """生成任务: LUT -> 颜色匹配 -> 网格生成 -> 导出"""
+    asset, error = load_job_asset(asset_id)
+    if error:
+        return error
+    
+    # 加载配置
+    config = load_config()
+    
+    # 获取算法参数
+    min_pixel_size = int(form.get('min_pixel_size', config.get('min_pixel_size', 5)))
+    scale = int(form.get('scale', config.get('scale', 10)))
+    sigma = float(form.get('sigma', config.get('sigma', 0.5)))
+    matching_mode = get_matching_mode(config, form)
+    min_region_area = float(form.get('min_region_area', config.get('min_region_area', 0)))
+    
+    # 获取模型参数
+    layer_height = float(form.get('layer_height', config.get('layer_height', 0.08)))
+    total_layers = int(form.get('total_layers', config.get('total_layers', TOTAL_LAYERS)))
+    model_width = float(form.get('model_width', config.get('model_width', 80)))
+    model_height = float(form.get('model_height', config.get('model_height', 80)))
+    model_depth = float(form.get('model_depth', config.get('model_depth', 0.8)))
+    pixel_size = float(form.get('pixel_size', config.get('pixel_size', 0.2)))
+    alpha_threshold = int(form.get('alpha_threshold', config.get('alpha_threshold', 128)))
+    # 获取是否生成双面模型的参数
+    is_double_sided = form.get('is_double_sided', str(config.get('is_double_sided', True))).lower() == 'true'
+    # 网格生成与导出参数
+    try:
+        mesh_options = get_mesh_options(config, form)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    # 导入必要的模块
+    import instrumentation
+    from ChromaStackStudio import StackCodec, load_inventory
+    from model_export import part_name
+    
+    # 加载耗材库
+    inventory = load_inventory(str(INVENTORY_FILE))
+    
+    # 根据名称找到选中的耗材
+    selected = []
+    for name in selected_filaments:
+        filament = next((f for f in inventory if f['Name'] == name), None)
+        if filament:
+            selected.append(filament)
+    
+    if len(selected) < 2:
+        return {'error': '请至少选择2个耗材'}, 400
+    
+    # 准入控制: 超出预算时降级或拒绝
+    admission = run_admission((asset.width, asset.height), len(selected), total_layers, model_width, pixel_size,
+                              get_sparse_lut_options(config, form), stage='generate',
+                              is_double_sided=is_double_sided, matching_mode=matching_mode)
+    if not admission['admitted']:
+        return admission_rejected_response(admission)
+    pixel_size = admission['params']['pixel_size']
+    
+    # 获取LUT (进程内缓存 -> 磁盘缓存 -> 重新计算)
+    job.report('lut', 5, admission=admission_summary(admission))
+    with instrumentation.stage('lut'):
+        bundle = get_lut_bundle(selected, total_layers, layer_height, sparse=admission['params']['sparse'])
+    lut_rgb, lut_codes = bundle.lut_rgb, bundle.lut_codes
+    codec = StackCodec(len(selected), total_layers)
+    
+    # 调整大小 - 与ChromaStackStudio.py保持一致
+    target_width = int(model_width / pixel_size)  # 根据模型宽度和像素尺寸计算目标宽度
+    
+    # 颜色匹配 (与 /preview 共用流水线缓存，参数相同时直接从网格阶段开始)
+    # (保持为区域图 + 区域层叠表，相邻同层叠区域已合并)
+    job.report('matching', 15)
+    trace = {}
+    matched = match_asset_colors(asset, target_width, bundle, alpha_threshold, matching_mode, min_pixel_size,
+                                 scale, sigma, min_region_pixels=int(round(min_region_area / pixel_size ** 2)),
+                                 trace=trace)
+    region_map = matched.value.region_map
+    print(f"🧩 层叠区域: {len(region_map)} 个")
+    job.report(pipeline=dict(trace))
+    
+    # 生成 3D 模型并按格式导出
+    part_names = [part_name(f['Name']) for f in selected]
+    part_colors = [f.get('Color', '#808080') for f in selected]
+    outputs = build_model_outputs(region_map, matched.key, codec, part_names, part_colors, layer_height, model_depth,
+                                  pixel_size, is_double_sided, mesh_options, job=job, trace=trace)
+    
+    # 返回相对路径，前端可以直接访问
+    return {
+        'success': True,
+        'admission': admission_summary(admission),
+        'pipeline': trace,
+        **outputs
+    }, 200
+
+
+@model_bp.route('/generate/stack_map', methods=['POST'])
+def generate_model_from_stack_map():
+    """由层叠图 (.npz，/generate 以 export_formats=npz 导出) 生成模型，不重新做颜色匹配 (后台任务)"""
+    try:
+        if 'stack_map' not in request.files:
+            return jsonify({'error': '缺少层叠图文件'}), 400
         
-        # 导出 3MF 文件
-        import uuid
-        model_filename = f"ChromaStack_Project_{uuid.uuid4().hex}.3mf"
-        model_path = output_dir / model_filename
+        file = request.files['stack_map']
+        if file.filename == '':
+            return jsonify({'error': '文件名不能为空'}), 400
         
-        if len(scene.geometry) > 0:
-            print(f"💾 正在保存 3MF 文件: {model_filename} ...")
-            scene.export(str(model_path))
-            print("✅ 保存成功！")
-        else:
-            print("⚠️ 场景为空，未生成文件。")
-            model_filename = None
+        # 层叠图很小，读入内存后交给任务
+        import io
+        stack_map_file = io.BytesIO(file.read())
         
-        # 返回相对路径，前端可以直接访问
-        return jsonify({
-            'success': True,
-            'model_path': f'/Output/{model_filename}' if model_filename else None
-        }), 200
+        form = request.form.to_dict()
+        return submit_job('generate', stack_map_job, form, stack_map_file, async_request=is_async_request(form))
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
+
+
+def stack_map_job(job, form, stack_map_file):
+    """由层叠图生成模型的任务"""
+    # 加载配置
+    config = load_config()
+    
+    # 获取模型参数 (像素尺寸、层高、层数由层叠图决定)
+    model_depth = float(form.get('model_depth', config.get('model_depth', 0.8)))
+    is_double_sided = form.get('is_double_sided', str(config.get('is_double_sided', True))).lower() == 'true'
+    try:
+        mesh_options = get_mesh_options(config, form)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    import hashlib
+    import instrumentation
+    from ChromaStackStudio import StackCodec
+    from model_export import load_stack_map
+    from region_stack import RegionStackMap
+    
+    try:
+        with instrumentation.stage('load'):
+            stack_map = load_stack_map(stack_map_file)
+    except (ValueError, KeyError, OSError) as e:
+        return {'error': f'无法读取层叠图: {e}'}, 400
+    
+    # 准入控制: 层叠图的分辨率已固定，不能降级，超出预算直接拒绝
+    height_px, width_px = stack_map['mask'].shape
+    admission = run_admission((width_px, height_px), stack_map['num_filaments'], stack_map['total_layers'],
+                              width_px * stack_map['pixel_size'], stack_map['pixel_size'], None, stage='stack_map',
+                              is_double_sided=is_double_sided, mode='reject')
+    if not admission['admitted']:
+        return admission_rejected_response(admission)
+    job.report(admission=admission_summary(admission))
+    codec = StackCodec(stack_map['num_filaments'], stack_map['total_layers'])
+    names = stack_map['names'] or [f'Slot_{i + 1}' for i in range(codec.num_filaments)]
+    colors = stack_map['colors'] or ['#808080'] * codec.num_filaments
+    
+    # 重新导出层叠图没有意义，只生成网格
+    mesh_options['export_formats'] = tuple(f for f in mesh_options['export_formats'] if f != 'npz') or ('3mf',)
+    region_map = RegionStackMap.from_code_matrix(stack_map['codes'], stack_map['mask'])
+    # 层叠图文件的内容哈希作为网格阶段的输入键
+    source_key = hashlib.sha256(stack_map_file.getvalue()).hexdigest()
+    trace = {}
+    outputs = build_model_outputs(region_map, source_key, codec, names, colors, stack_map['layer_height'],
+                                  model_depth, stack_map['pixel_size'], is_double_sided, mesh_options, job=job,
+                                  trace=trace)
+    
+    # 返回相对路径，前端可以直接访问
+    return {
+        'success': True,
+        'admission': admission_summary(admission),
+        'pipeline': trace,
+        **outputs
+    }, 200
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片资源库
+
+图片只上传一次 (POST /assets)，按内容的 SHA-256 得到资源 ID，之后 /colorize、/preview、/generate
+只传 asset_id。直接上传 file 的旧用法同样存入资源库，不再按原文件名写 tmp/<filename>
+(不同用户的同名文件不会互相覆盖)。
+
+资源库只保存文件，不缓存解码结果: 缩放后的 RGBA 数组由流水线的 resize 阶段按 (资源 ID, 目标宽)
+缓存 (与其他阶段共用一个内存上限)，同一张图反复预览只解码、缩放一次。
+tmp 目录中超过保留时间未使用的文件 (资源、预览图等)
+在上传时顺带清理 (最多每 TMP_GC_INTERVAL_SECONDS 一次)；资源每次使用都会刷新修改时间。
+"""
+
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from ..config import Config
+
+ASSET_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class Asset:
+    """资源库中的一张图片"""
+
+    def __init__(self, asset_id, path, width, height):
+        self.asset_id = asset_id
+        self.path = path
+        self.width = width
+        self.height = height
+
+    @property
+    def aspect(self):
+        return self.height / self.width
+
+    def to_dict(self):
+        return {
+            'asset_id': self.asset_id,
+            'width': self.width,
+            'height': self.height,
+            'size_bytes': self.path.stat().st_size if self.path.exists() else 0,
+        }
+
+
+class AssetStore:
+    """
+    按内容哈希存储的图片
+
+    Args:
+        root (Path): 资源文件目录
+        tmp_dir (Path): 垃圾回收的目录 (包含 root)
+        max_age_seconds (float): tmp 中文件的保留时间 (按修改时间)
+        gc_interval_seconds (float): 自动垃圾回收的最小间隔
+    """
+
+    def __init__(self, root, tmp_dir, max_age_seconds, gc_interval_seconds):
+        self.root = Path(root)
+        self.tmp_dir = Path(tmp_dir)
+        self.max_age_seconds = max_age_seconds
+        self.gc_interval_seconds = gc_interval_seconds
+        self._assets = {}
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+        self.files_removed = 0
+
+    def put(self, data, filename=''):
+        """
+        存入一张图片 (内容相同的图片只存一份)
+
+        Args:
+            data (bytes): 文件内容
+            filename (str): 原文件名 (只用于保留扩展名)
+
+        Returns:
+            tuple: (Asset, 是否新建)
+
+        Raises:
+            ValueError: 不是可解码的图片
+        """
+        self.maybe_collect_garbage()
+        asset_id = hashlib.sha256(data).hexdigest()
+        asset = self.get(asset_id)
+        if asset is not None:
+            return asset, False
+
+        try:
+            with Image.open(io.BytesIO(data)) as probe:
+                width, height = probe.size
+        except Exception:
+            raise ValueError('无法识别的图片文件')
+        suffix = Path(filename).suffix.lower()
+        if suffix.lstrip('.') not in Config.ALLOWED_EXTENSIONS:
+            suffix = '.img'
+
+        # 先写临时文件再原子替换，并发上传同一张图也不会读到半个文件
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f'{asset_id}{suffix}'
+        part = self.root / f'.{asset_id}.{uuid.uuid4().hex}.part'
+        part.write_bytes(data)
+        os.replace(part, path)
+
+        asset = Asset(asset_id, path, width, height)
+        with self._lock:
+            self._assets[asset_id] = asset
+        return asset, True
+
+    def get(self, asset_id):
+        """
+        按 ID 获取资源 (刷新修改时间，避免被垃圾回收)；不存在时返回 None
+        进程重启后从磁盘上的资源文件恢复
+        """
+        if not isinstance(asset_id, str) or not ASSET_ID_PATTERN.match(asset_id):
+            return None
+        with self._lock:
+            asset = self._assets.get(asset_id)
+        if asset is None:
+            paths = [p for p in self.root.glob(f'{asset_id}.*') if p.is_file()] if self.root.exists() else []
+            if not paths:
+                return None
+            with Image.open(paths[0]) as probe:
+                asset = Asset(asset_id, paths[0], *probe.size)
+            with self._lock:
+                self._assets[asset_id] = asset
+        elif not asset.path.exists():
+            self._forget(asset_id)
+            return None
+        try:
+            os.utime(asset.path)
+        except OSError:
+            pass
+        return asset
+
+    def target_size(self, asset, target_width):
+        """与原流程一致的缩放尺寸: 高度按原图宽高比取整"""
+        return int(target_width), int(int(target_width) * asset.aspect)
+
+    def load_rgba(self, asset, target_width):
+        """
+        解码并缩放为 (target_height, target_width, 4) uint8 RGBA
+        (每次调用都重新解码，结果由流水线的 resize 阶段缓存)
+
+        Returns:
+            np.ndarray: 缩放后的图片
+        """
+        with Image.open(asset.path) as img:
+            return np.array(img.convert('RGBA').resize(self.target_size(asset, target_width), Image.LANCZOS))
+
+    def _forget(self, asset_id):
+        with self._lock:
+            self._assets.pop(asset_id, None)
+
+    def maybe_collect_garbage(self):
+        """距上次垃圾回收超过 gc_interval_seconds 时清理 tmp 目录"""
+        if time.time() - self._last_gc >= self.gc_interval_seconds:
+            self.collect_garbage()
+
+    def collect_garbage(self, max_age_seconds=None):
+        """
+        删除 tmp 目录 (含资源目录) 中超过保留时间未修改的文件
+
+        Returns:
+            dict: 删除的文件数和字节数
+        """
+        self._last_gc = time.time()
+        max_age = self.max_age_seconds if max_age_seconds is None else max_age_seconds
+        cutoff = time.time() - max_age
+        removed, freed = 0, 0
+        if self.tmp_dir.exists():
+            for path in self.tmp_dir.rglob('*'):
+                try:
+                    stat = path.stat()
+                    if not path.is_file() or stat.st_mtime >= cutoff:
+                        continue
+                    path.unlink()
+                except OSError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+                if path.parent == self.root:
+                    self._forget(path.name.split('.', 1)[0])
+        self.files_removed += removed
+        if removed:
+            print(f"🧹 已清理 tmp 目录: {removed} 个文件，{freed / 1024 / 1024:.1f} MB")
+        return {'files_removed': removed, 'bytes_freed': freed}
+
+    def stats(self):
+        """
+        获取资源库统计
+
+        Returns:
+            dict: 已知的资源数和垃圾回收删除的文件数
+        """
+        with self._lock:
+            return {
+                'assets': len(self._assets),
+                'files_removed': self.files_removed,
+            }
+
+
+asset_store = AssetStore(Config.TMP_DIR / 'assets', Config.TMP_DIR,
+                         Config.TMP_MAX_AGE_SECONDS, Config.TMP_GC_INTERVAL_SECONDS)
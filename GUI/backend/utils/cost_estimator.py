@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务开销估算与准入控制
+
+根据耗材数、层数、模型宽度/像素尺寸和图片宽高比，在分配内存之前预测
+各阶段的峰值内存和耗时，超出预算时降级 (稀疏 LUT、加大像素尺寸) 或拒绝。
+各系数在参考工作站上粗略标定，只用于数量级判断。
+"""
+
+import math
+
+from ..config import Config
+
+# ---- 每单位开销系数 (字节 / 秒) ----
+# LUT: 每个层叠
+LUT_BUILD_SECONDS = 80e-9           # 前缀共享 / 折半合成
+LUT_BUILD_TEMP_BYTES = 36           # float32 反射率及中间结果 (前缀共享)
+LUT_RESIDENT_BYTES = 3 + 12 + 4     # sRGB + Lab(float32) + 层叠编码
+LUT_LAB_SECONDS = 250e-9
+TREE_BUILD_SECONDS = 400e-9
+TREE_BYTES = 24 + 8 + 8             # KDTree 数据副本 + 索引 + 节点
+# 图像: 每个像素
+IMAGE_RESIDENT_BYTES = 4 + 1 + 12 + 8 + 4   # RGBA + 掩码 + Lab(float32) + 区域 ID + 编码/LUT 索引
+LAB_TEMP_BYTES = 32                 # 颜色编号、排序副本与逆索引
+LAB_SECONDS = 250e-9                # 每种不同颜色的 Lab 转换
+LAB_DEDUP_SECONDS = 60e-9           # 每个像素的打包与排序去重
+SEGMENT_TEMP_BYTES = 360            # felzenszwalb 内部的 float 图像与图结构
+SEGMENT_SECONDS = 2e-6
+REMATCH_TEMP_BYTES = 48
+REMATCH_SECONDS = 150e-9
+REGION_QUERY_SECONDS = 20e-6        # 每个区域一次 KDTree 查询
+PIXELS_PER_REGION = 10              # felzenszwalb(min_size≈5) 在照片上的典型区域大小
+PIXEL_MATCH_SECONDS = 30e-9         # 逐像素匹配: 颜色表 gather
+PIXEL_MATCH_MISS_SECONDS = 2e-6     # 颜色表未命中: Lab 转换 + KDTree 查询 (按不同颜色数计)
+DISTINCT_COLOR_FRACTION = 0.25      # 照片中不同颜色数占像素数的典型比例
+# 网格: 每个像素、每面
+MESH_SECONDS = 4e-6
+MESH_TEMP_BYTES = 8
+TRIANGLES_PER_PIXEL = 0.5           # 照片类输入的最坏情况
+TRIANGLE_BYTES = 120                # trimesh 顶点/面/缓存及合并时的副本
+EXPORT_SECONDS_PER_TRIANGLE = 1e-6
+
+STAGES_PREVIEW = ('lut', 'lab', 'segmentation', 'rematching')
+STAGES_GENERATE = STAGES_PREVIEW + ('meshing', 'export')
+STAGES_STACK_MAP = ('meshing', 'export')   # 由层叠图生成: 不计算 LUT、不做颜色匹配
+
+
+def _surjective_path_colorings(k, runs):
+    """恰好使用 k 种颜色、相邻不同色地给长度为 runs 的路径着色的方案数"""
+    total = 0
+    for i in range(k + 1):
+        m = k - i
+        if m == 0:
+            ways = 0
+        else:
+            ways = m * (m - 1) ** (runs - 1)
+        total += (-1) ** i * math.comb(k, i) * ways
+    return total
+
+
+def count_sparse_stacks(num_filaments, total_layers, max_distinct=None, max_changes=None, base_slot=None, **_):
+    """
+    精确计算满足稀疏约束的层叠数量 (ΔE 合并之前的上界)
+    层叠 = 若干段同色 run，切换 j 次即 j+1 段，分段方式 C(L-1, j)。
+    """
+    N, L = int(num_filaments), int(total_layers)
+    max_k = min(N, L) if max_distinct is None else min(int(max_distinct), N, L)
+    max_j = L - 1 if max_changes is None else min(int(max_changes), L - 1)
+    count = 0
+    for j in range(max_j + 1):
+        for k in range(1, min(max_k, j + 1) + 1):
+            count += math.comb(L - 1, j) * math.comb(N, k) * _surjective_path_colorings(k, j + 1)
+    if base_slot is not None:
+        count //= N   # 第 0 层固定为某一槽位，按对称性占 1/N
+    return count
+
+
+def estimate_job(num_filaments, total_layers, model_width, pixel_size, aspect,
+                 is_double_sided=True, sparse=None, stage='generate', matching_mode='region'):
+    """
+    估算一次 /preview、/generate 或 /generate/stack_map 的开销
+
+    Args:
+        num_filaments (int): 耗材数量
+        total_layers (int): 混色层数
+        model_width (float): 模型宽度 (mm)
+        pixel_size (float): 像素尺寸 (mm)
+        aspect (float): 图片高宽比
+        is_double_sided (bool): 是否双面
+        sparse (dict): 稀疏 LUT 参数
+        stage (str): 'preview'、'generate' 或 'stack_map' (由层叠图生成，只有网格和导出)
+        matching_mode (str): 'region' 或 'pixel' (逐像素匹配，不做分割)
+
+    Returns:
+        dict: 各阶段的内存/耗时估计、峰值内存和总耗时
+    """
+    width_px = int(model_width / pixel_size)
+    height_px = int(width_px * aspect)
+    pixels = width_px * height_px
+    full_combos = int(num_filaments) ** int(total_layers)
+    lut_entries = count_sparse_stacks(num_filaments, total_layers, **sparse) if sparse else full_combos
+    sides = 2 if is_double_sided else 1
+    regions = max(1, pixels // PIXELS_PER_REGION)
+    triangles = int(pixels * TRIANGLES_PER_PIXEL * sides)
+
+    # 由层叠图生成时不构建 LUT
+    lut_resident = lut_entries * (LUT_RESIDENT_BYTES + TREE_BYTES) if stage != 'stack_map' else 0
+    image_resident = pixels * IMAGE_RESIDENT_BYTES
+    # 稀疏模式按块枚举全部编码，计算量仍与完整组合数相关，但临时内存只与保留数量相关
+    lut_temp = lut_entries * LUT_BUILD_TEMP_BYTES
+    stages = {
+        'lut': {
+            'memory_bytes': lut_resident + lut_temp,
+            'seconds': full_combos * LUT_BUILD_SECONDS + lut_entries * (LUT_LAB_SECONDS + TREE_BUILD_SECONDS),
+        },
+        'lab': {
+            'memory_bytes': lut_resident + image_resident + pixels * LAB_TEMP_BYTES,
+            'seconds': pixels * (LAB_DEDUP_SECONDS + DISTINCT_COLOR_FRACTION * LAB_SECONDS),
+        },
+        'segmentation': {
+            'memory_bytes': lut_resident + image_resident + pixels * SEGMENT_TEMP_BYTES,
+            'seconds': pixels * SEGMENT_SECONDS,
+        },
+        'rematching': {
+            'memory_bytes': lut_resident + image_resident + pixels * REMATCH_TEMP_BYTES,
+            'seconds': pixels * REMATCH_SECONDS + regions * REGION_QUERY_SECONDS,
+        },
+        'meshing': {
+            'memory_bytes': lut_resident + image_resident + pixels * MESH_TEMP_BYTES + triangles * TRIANGLE_BYTES,
+            'seconds': pixels * MESH_SECONDS,   # 每层一次提取所有槽位的边界；双面时另一面复用切片，只做平移
+        },
+        'export': {
+            'memory_bytes': lut_resident + image_resident + 2 * triangles * TRIANGLE_BYTES,
+            'seconds': triangles * EXPORT_SECONDS_PER_TRIANGLE,
+        },
+    }
+    if matching_mode == 'pixel':
+        # 不做 Lab 整图转换和分割，只对颜色表未命中的颜色查询
+        stages['rematching'] = {
+            'memory_bytes': lut_resident + image_resident + pixels * REMATCH_TEMP_BYTES,
+            'seconds': pixels * (PIXEL_MATCH_SECONDS + DISTINCT_COLOR_FRACTION * PIXEL_MATCH_MISS_SECONDS),
+        }
+    selected = {'generate': STAGES_GENERATE, 'stack_map': STAGES_STACK_MAP}.get(stage, STAGES_PREVIEW)
+    if matching_mode == 'pixel':
+        selected = tuple(name for name in selected if name not in ('lab', 'segmentation'))
+    stages = {name: stages[name] for name in selected}
+    return {
+        'width_px': width_px,
+        'height_px': height_px,
+        'lut_entries': lut_entries,
+        'estimated_triangles': triangles if stage != 'preview' else 0,
+        'stages': stages,
+        'peak_memory_bytes': max(s['memory_bytes'] for s in stages.values()),
+        'total_seconds': sum(s['seconds'] for s in stages.values()),
+    }
+
+
+def _within_budget(estimate, memory_budget, time_budget):
+    return estimate['peak_memory_bytes'] <= memory_budget and estimate['total_seconds'] <= time_budget
+
+
+def admit_job(params, memory_budget=None, time_budget=None, mode=None):
+    """
+    准入控制: 估算开销，超出预算时按 "稀疏 LUT -> 加大像素尺寸" 的顺序降级
+
+    Args:
+        params (dict): estimate_job 的参数 (num_filaments, total_layers, model_width,
+                       pixel_size, aspect, is_double_sided, sparse, stage, matching_mode)
+        memory_budget (int): 峰值内存上限 (字节)，默认 Config.JOB_MEMORY_BUDGET_BYTES
+        time_budget (float): 耗时上限 (秒)，默认 Config.JOB_TIME_BUDGET_SECONDS
+        mode (str): 'downgrade' 允许降级 / 'reject' 超出即拒绝
+
+    Returns:
+        dict: admitted (bool)、params (可能已降级)、estimate、downgrades (降级说明列表)
+    """
+    memory_budget = Config.JOB_MEMORY_BUDGET_BYTES if memory_budget is None else memory_budget
+    time_budget = Config.JOB_TIME_BUDGET_SECONDS if time_budget is None else time_budget
+    mode = mode or Config.JOB_ADMISSION_MODE
+
+    params = dict(params)
+    downgrades = []
+    estimate = estimate_job(**params)
+    if _within_budget(estimate, memory_budget, time_budget) or mode != 'downgrade':
+        return {'admitted': _within_budget(estimate, memory_budget, time_budget),
+                'params': params, 'estimate': estimate, 'downgrades': downgrades}
+
+    # 1. 稀疏 LUT
+    if not params.get('sparse'):
+        params['sparse'] = dict(Config.JOB_DOWNGRADE_SPARSE_LUT)
+        estimate = estimate_job(**params)
+        downgrades.append({'type': 'sparse_lut', 'sparse': params['sparse'], 'lut_entries': estimate['lut_entries']})
+
+    # 2. 逐步加大像素尺寸
+    original_pixel_size = params['pixel_size']
+    while not _within_budget(estimate, memory_budget, time_budget):
+        next_size = round(params['pixel_size'] * 1.25, 3)
+        if next_size > Config.JOB_MAX_PIXEL_SIZE:
+            break
+        params['pixel_size'] = next_size
+        estimate = estimate_job(**params)
+    if params['pixel_size'] != original_pixel_size:
+        downgrades.append({'type': 'pixel_size', 'from': original_pixel_size, 'to': params['pixel_size']})
+
+    return {'admitted': _within_budget(estimate, memory_budget, time_budget),
+            'params': params, 'estimate': estimate, 'downgrades': downgrades}
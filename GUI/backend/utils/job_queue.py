@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台任务队列
+
+/preview、/generate、/colorize 提交后立即得到任务 ID，由有界的工作线程池执行:
+    - 任务函数通过 job.report(阶段, 百分比, **部分结果) 汇报进度，
+      同时也是取消检查点: DELETE /jobs/<id> 之后，下一个检查点抛出 JobCancelled
+    - 排队 + 运行中的任务数超过上限时拒绝提交 (QueueFull)
+    - 记录每个任务的排队时间、运行时间和各阶段耗时，/jobs 汇总后用于确定工作线程数
+已结束的任务只保留最近 JOB_HISTORY 个。
+"""
+
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config import Config
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务在检查点发现已被取消"""
+
+
+class QueueFull(Exception):
+    """排队任务数已达上限"""
+
+
+class Job:
+    """
+    一个后台任务
+
+    任务函数的返回值为 (响应 dict, HTTP 状态码)，与同步接口的 JSON 响应一致。
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = QUEUED
+        self.stage = QUEUED
+        self.percent = 0.0
+        self.partial = {}
+        self.result = None
+        self.status_code = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stage_seconds = OrderedDict()
+        self.server_timing = None
+        self._stage_started = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """取消检查点"""
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def report(self, stage=None, percent=None, **partial):
+        """
+        汇报进度 (并检查是否已取消)
+
+        Args:
+            stage (str): 当前阶段，与上一阶段不同时记录上一阶段耗时
+            percent (float): 总体进度 0-100
+            **partial: 部分结果，合并到 job.partial
+        """
+        self.check_cancelled()
+        with self._lock:
+            if stage is not None and stage != self.stage:
+                self._close_stage()
+                self.stage = stage
+                self._stage_started = time.perf_counter()
+            if percent is not None:
+                self.percent = float(min(max(percent, 0.0), 100.0))
+            self.partial.update(partial)
+
+    def _close_stage(self):
+        if self._stage_started is not None:
+            elapsed = time.perf_counter() - self._stage_started
+            self.stage_seconds[self.stage] = self.stage_seconds.get(self.stage, 0.0) + elapsed
+            self._stage_started = None
+
+    def wait(self, timeout=None):
+        """等待任务结束，返回是否已结束"""
+        return self._done.wait(timeout)
+
+    @property
+    def queue_seconds(self):
+        end = self.started_at if self.started_at is not None else time.time()
+        return end - self.created_at
+
+    @property
+    def run_seconds(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at if self.finished_at is not None else time.time()) - self.started_at
+
+    def to_dict(self, include_result=True):
+        """GET /jobs/<id> 的响应内容"""
+        with self._lock:
+            info = {
+                'job_id': self.id,
+                'kind': self.kind,
+                'state': self.state,
+                'stage': self.stage,
+                'percent': round(self.percent, 1),
+                'partial': dict(self.partial),
+                'cancel_requested': self.cancel_requested,
+                'timing': {
+                    'queue_seconds': round(self.queue_seconds, 3),
+                    'run_seconds': round(self.run_seconds, 3),
+                    'stages': {stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()},
+                },
+            }
+            if self.error is not None:
+                info['error'] = self.error
+            if include_result and self.result is not None:
+                info['result'] = self.result
+                info['status_code'] = self.status_code
+            return info
+
+
+class JobQueue:
+    """
+    有界的后台任务队列
+
+    Args:
+        workers (int): 工作线程数 (同时运行的任务数)
+        max_pending (int): 排队 + 运行中的任务数上限
+        history (int): 保留的已结束任务数
+    """
+
+    def __init__(self, workers, max_pending, history):
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.history = max(1, int(history))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='chromastack-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._totals = {}
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """
+        提交任务: fn(job, *args, **kwargs) -> (响应 dict, 状态码)
+
+        Raises:
+            QueueFull: 排队 + 运行中的任务数已达上限
+        """
+        job = Job(kind)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f'任务队列已满 ({self._pending}/{self.max_pending})')
+            self._pending += 1
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.started_at = time.time()
+        try:
+            job.check_cancelled()
+            job.state = RUNNING
+            job.report('preparing', 0)
+            result, status_code = fn(job, *args, **kwargs)
+            job.result, job.status_code = result, status_code
+            job.state = SUCCEEDED if status_code < 400 else FAILED
+            if job.state == FAILED:
+                job.error = result.get('error')
+            else:
+                job.percent = 100.0
+        except JobCancelled:
+            job.state = CANCELLED
+            job.result, job.status_code = {'error': '任务已取消', 'job_id': job.id}, 499
+        except Exception as e:
+            traceback.print_exc()
+            job.state = FAILED
+            job.error = str(e)
+            job.result, job.status_code = {'error': str(e)}, 500
+        finally:
+            job.finished_at = time.time()
+            with job._lock:
+                job._close_stage()
+                job.stage = job.state
+            with self._lock:
+                self._pending -= 1
+                self._record(job)
+                # 按结束顺序保留: 运行较久的任务刚结束时不会因为提交得早而被立即删除
+                if job.id in self._jobs:
+                    self._jobs.move_to_end(job.id)
+                self._trim()
+            job._done.set()
+
+    def _record(self, job):
+        totals = self._totals.setdefault(job.kind, {'count': 0, 'queue_seconds': 0.0, 'run_seconds': 0.0,
+                                                   'states': {}, 'stages': {}})
+        totals['count'] += 1
+        totals['queue_seconds'] += job.queue_seconds
+        totals['run_seconds'] += job.run_seconds
+        totals['states'][job.state] = totals['states'].get(job.state, 0) + 1
+        for stage, seconds in job.stage_seconds.items():
+            totals['stages'][stage] = totals['stages'].get(stage, 0.0) + seconds
+
+    def _trim(self):
+        """只保留最近结束的 history 个任务 (未结束的任务不删除)"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        请求取消任务: 排队中的任务不会开始，运行中的任务在下一个检查点停止
+
+        Returns:
+            Job: 任务 (不存在时为 None)
+        """
+        job = self.get(job_id)
+        if job is not None and job.state not in FINISHED_STATES:
+            job._cancel.set()
+        return job
+
+    def stats(self):
+        """队列深度、运行中任务数和各类任务的平均耗时"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+            kinds = {}
+            for kind, totals in self._totals.items():
+                count = totals['count']
+                kinds[kind] = {
+                    'count': count,
+                    'states': dict(totals['states']),
+                    'avg_queue_seconds': round(totals['queue_seconds'] / count, 3),
+                    'avg_run_seconds': round(totals['run_seconds'] / count, 3),
+                    'avg_stage_seconds': {stage: round(seconds / count, 3)
+                                          for stage, seconds in totals['stages'].items()},
+                }
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'queued': sum(job.state == QUEUED for job in jobs),
+                'running': sum(job.state == RUNNING for job in jobs),
+                'kinds': kinds,
+            }
+
+    def list_jobs(self):
+        """全部保留的任务 (不含结果)"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict(include_result=False) for job in jobs]
+
+
+job_queue = JobQueue(Config.JOB_WORKERS, Config.JOB_MAX_PENDING, Config.JOB_HISTORY)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内 LUT 缓存
+
+按 (耗材名称 + K/S 哈希, 层数, 层高) 缓存 LUT、Lab LUT 和预构建的 cKDTree，
+同一组耗材反复预览 (只调整 scale / sigma 等参数) 时无需重新生成 LUT 和 KDTree。
+"""
+
+import threading
+from collections import OrderedDict
+
+from scipy.spatial import cKDTree
+
+from ..config import Config
+
+
+class LutBundle:
+    """一组耗材对应的 LUT 及其匹配结构"""
+
+    def __init__(self, lut_rgb, lut_lab, lut_codes, tree, key=None):
+        self.key = key   # 缓存键，流水线匹配阶段的输入之一
+        self.lut_rgb = lut_rgb
+        self.lut_lab = lut_lab
+        self.lut_codes = lut_codes
+        self.tree = tree
+        self.nbytes = (
+            lut_rgb.nbytes + lut_lab.nbytes + lut_codes.nbytes
+            + tree.data.nbytes + tree.indices.nbytes
+            + 64 * (tree.n // tree.leafsize + 1)   # 树节点的粗略估计
+        )
+        self._match_index = None
+        self._match_index_lock = threading.Lock()
+
+    @property
+    def match_index(self):
+        """逐像素匹配用的颜色索引，首次使用时构建，随 LUT 一起缓存"""
+        if self._match_index is None:
+            with self._match_index_lock:
+                if self._match_index is None:
+                    from lut_match_index import LutMatchIndex
+                    self._match_index = LutMatchIndex(self.lut_lab)
+        return self._match_index
+
+
+class LutCache:
+    """
+    线程安全的 LRU 缓存，总大小受 max_bytes 限制。
+    同一个键同时只会构建一次，其余请求等待构建结果。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+
+    def get_or_build(self, key, build_fn):
+        """
+        获取缓存条目，不存在时调用 build_fn() 构建
+
+        Args:
+            key: 可哈希的缓存键
+            build_fn: 无参函数，返回 LutBundle
+
+        Returns:
+            LutBundle: 缓存条目
+        """
+        while True:
+            with self._lock:
+                bundle = self._entries.get(key)
+                if bundle is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return bundle
+                event = self._building.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._building[key] = event
+                    self.misses += 1
+                    break
+            # 其他线程正在构建同一个键，等待后重新查询
+            event.wait()
+
+        try:
+            bundle = build_fn()
+            with self._lock:
+                self._insert(key, bundle)
+            return bundle
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            event.set()
+
+    def _insert(self, key, bundle):
+        if bundle.nbytes > self.max_bytes:
+            return   # 单个条目超出预算，不缓存
+        self._entries[key] = bundle
+        self.current_bytes += bundle.nbytes
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        获取缓存统计
+
+        Returns:
+            dict: 命中/未命中次数、条目数和内存占用
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+lut_cache = LutCache(Config.LUT_CACHE_MAX_BYTES)
+
+
+def get_lut_bundle(filaments_list, total_layers, layer_height, sparse=None):
+    """
+    获取一组耗材的 LUT、Lab LUT 和 cKDTree
+
+    Args:
+        filaments_list (list): 有序的耗材参数列表
+        total_layers (int): 混色层数
+        layer_height (float): 层高 (mm)
+        sparse (dict): 稀疏 LUT 参数，None 表示完整 LUT
+
+    Returns:
+        LutBundle: 缓存的 LUT 条目
+    """
+    from lut_store import lut_key, load_lut, normalize_sparse_options
+
+    sparse = normalize_sparse_options(sparse)
+    key = (
+        tuple(f['Name'] for f in filaments_list),
+        lut_key(filaments_list, total_layers, layer_height, sparse=sparse),
+        int(total_layers),
+        float(layer_height),
+    )
+
+    def build():
+        lut_rgb, lut_lab, lut_codes = load_lut(filaments_list, total_layers, layer_height, sparse=sparse)
+        # leafsize 与 scipy.spatial.KDTree 默认值一致，颜色并列时选出相同的层叠
+        return LutBundle(lut_rgb, lut_lab, lut_codes, cKDTree(lut_lab, leafsize=10), key=key)
+
+    return lut_cache.get_or_build(key, build)
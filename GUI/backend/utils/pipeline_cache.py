@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内流水线缓存
+
+所有 /preview、/generate 任务共用一个 ChromaStackPipeline (pipeline.py): 各阶段输出按内容哈希缓存，
+只调整 scale / sigma 时从分割阶段开始重新计算，预览之后生成模型时直接从网格阶段开始。
+"""
+
+import threading
+
+from ..config import Config
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """
+    获取进程内共用的流水线 (首次使用时创建)
+
+    Returns:
+        ChromaStackPipeline: 流水线
+    """
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                from pipeline import ChromaStackPipeline
+                _pipeline = ChromaStackPipeline(Config.PIPELINE_CACHE_MAX_BYTES)
+    return _pipeline
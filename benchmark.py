@@ -0,0 +1,403 @@
+"""
+图片 -> 3MF 流水线基准测试 (无界面)
+
+用固定随机种子生成合成图片 (纯色标志、渐变、类照片噪声、大面积透明的像素画)，按 尺寸 x 耗材数 的组合
+逐阶段运行 ChromaStackStudio 的流程 (LUT、色域图、缩放/分割/匹配、几何清理与网格生成、3MF 导出)
+和 AutoSelector 的耗材组合搜索，结果写成 JSON，可以在不同提交 (或依赖升级前后) 之间对比:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json --threshold 0.15
+
+阶段名与 GUI 后端 /metrics 相同 (instrumentation.stage)。每个用例重复 --repeat 次取中位数，
+每次都使用新的流水线和临时 LUT 存储 (不命中任何缓存，另有一次不计入结果的预热)；网格默认在当前进程中生成 (--workers 1)，
+避免进程调度的波动。JSON 中同时记录输出摘要 (LUT 大小、区域数、三角形数、推荐组合)，
+对比时输出变化单独列出，耗时超过阈值的阶段视为性能回退 (返回码 1)。
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import matplotlib
+matplotlib.use("Agg")   # 色域图只写文件，不打开窗口
+
+import numpy as np
+from PIL import Image
+
+import instrumentation
+
+IMAGE_KINDS = ("logo", "gradient", "photo", "sprite")
+DEFAULT_SIZES = (200, 400)
+DEFAULT_FILAMENT_COUNTS = (3, 4, 5)
+DEFAULT_INVENTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "my_filament_example.json")
+# 结果中记录版本号的依赖 (requirements.txt 中影响流水线速度的部分)
+TRACKED_PACKAGES = ("numpy", "scipy", "scikit-image", "scikit-learn", "Shapely", "trimesh", "Pillow",
+                    "opencv-python", "mapbox_earcut", "matplotlib")
+RESULT_VERSION = 1
+
+
+# ================= 合成输入 =================
+
+def synthetic_image(kind, width, seed=0):
+    """
+    生成 (width * 3/4, width) 的 RGBA 合成图片 (同样的参数总是得到同样的图片)
+
+        logo      白底上的几个纯色圆形/矩形 (大块区域、锐利边缘)
+        gradient  色相横向渐变、亮度纵向渐变 (颜色连续变化)
+        photo     多尺度平滑噪声 + 细噪声 (类似照片的纹理)
+        sprite    放大的像素画，大部分透明，边缘半透明 (透明度阈值)
+    """
+    from scipy.ndimage import gaussian_filter
+
+    height = width * 3 // 4
+    rng = np.random.default_rng([seed, IMAGE_KINDS.index(kind), width])
+    yy, xx = np.mgrid[:height, :width] / width
+    alpha = np.full((height, width), 255, dtype=np.uint8)
+
+    if kind == "logo":
+        palette = rng.integers(0, 256, (6, 3))
+        rgb = np.full((height, width, 3), 255.0)
+        for i in range(8):
+            cx, cy, r = rng.uniform(0.1, 0.9), rng.uniform(0.1, 0.65), rng.uniform(0.05, 0.2)
+            if i % 2:
+                shape = (xx - cx) ** 2 + (yy - cy) ** 2 < r ** 2
+            else:
+                shape = (abs(xx - cx) < r) & (abs(yy - cy) < r / 2)
+            rgb[shape] = palette[i % len(palette)]
+    elif kind == "gradient":
+        import colorsys
+        hue = xx.ravel()
+        value = 1.0 - 0.8 * (yy.ravel() * width / height)
+        rgb = np.array([colorsys.hsv_to_rgb(h, 0.8, v) for h, v in zip(hue, value)]).reshape(height, width, 3) * 255
+    elif kind == "photo":
+        rgb = np.zeros((height, width, 3))
+        for sigma, weight in ((width / 8, 120.0), (width / 32, 60.0), (1.0, 20.0)):
+            rgb += weight * gaussian_filter(rng.standard_normal((height, width, 3)), (sigma, sigma, 0))
+        rgb = 128 + rgb / rgb.std() * 50
+    elif kind == "sprite":
+        cell = max(2, width // 40)
+        small = rng.integers(0, 256, ((height + cell - 1) // cell, (width + cell - 1) // cell, 3))
+        rgb = np.kron(small, np.ones((cell, cell, 1)))[:height, :width]
+        # 中间的不规则块不透明，四周透明，交界处为半透明渐变
+        blob = gaussian_filter(rng.standard_normal((height, width)), width / 10)
+        blob = 0.15 * blob / np.abs(blob).max() - np.hypot(xx - 0.5, (yy - 0.375) * 1.2)
+        alpha = (np.clip((blob + 0.3) * 8, 0, 1) * 255).astype(np.uint8)
+    else:
+        raise ValueError(f"未知的图片类型 '{kind}' (可选 {', '.join(IMAGE_KINDS)})")
+
+    rgb = np.clip(np.round(rgb), 0, 255).astype(np.uint8)
+    return np.dstack([rgb, alpha])
+
+
+# ================= 单个用例 =================
+
+def _summary(samples):
+    """多次运行的阶段统计 -> 中位数"""
+    stages = {}
+    for name in dict.fromkeys(name for sample in samples for name in sample):
+        runs = [sample[name] for sample in samples if name in sample]
+        peaks = [run[3] for run in runs if run[3] is not None]
+        stages[name] = {
+            "count": runs[0][0],
+            "wall_s": round(statistics.median(run[1] for run in runs), 6),
+            "cpu_s": round(statistics.median(run[2] for run in runs), 6),
+            "peak_bytes": max(peaks) if peaks else None,
+        }
+    return stages
+
+
+def run_case(kind, width, num_filaments, inventory, args, workdir):
+    """
+    运行一个用例一次
+
+    Returns:
+        tuple: (阶段统计 {名称: [次数, 墙钟秒, CPU 秒, 峰值字节]}, 总耗时, 输出摘要)
+    """
+    import matplotlib.pyplot as plt
+    import ChromaStackStudio as studio
+    import lut_store
+    from AutoSelector import evaluate_combination, extract_image_features
+    from color_science import rgb_to_lab
+    from geometry_cleanup import min_island_area
+    from model_export import write_3mf
+    from pipeline import ChromaStackPipeline, MatchLut, file_digest, load_image_rgba
+
+    filaments = inventory[:num_filaments]
+    layers, layer_height = args.layers, studio.LAYER_HEIGHT
+    pixel_size = studio.PIXEL_SIZE
+    case_dir = tempfile.mkdtemp(dir=workdir)
+    # 评估耗材组合时 load_lut 使用默认存储，指向空的临时目录，每次运行都重新计算 LUT
+    lut_store._default_store = lut_store.LutStore(os.path.join(case_dir, "lut"))
+
+    # 输入图片按 2 倍尺寸保存为 PNG，缩放阶段包含解码和 LANCZOS 缩放
+    image_path = os.path.join(case_dir, f"{kind}.png")
+    Image.fromarray(synthetic_image(kind, width * 2, args.seed), "RGBA").save(image_path)
+    np.random.seed(args.seed)   # visualize_gamut 点数过多时随机采样
+
+    output = {}
+    start = time.perf_counter()
+    with instrumentation.recording(args.trace_memory) as recorder:
+        engine = studio.VirtualPhysics()
+        with instrumentation.stage("lut"):
+            lut_rgb, lut_codes = lut_store.build_lut(engine, filaments, layers, layer_height)
+            lut_lab = rgb_to_lab(lut_rgb)
+        with instrumentation.stage("index"):
+            lut = MatchLut(lut_lab, lut_codes, lut_store.lut_key(filaments, layers, layer_height))
+        if not args.skip_gamut:
+            with instrumentation.stage("gamut"), contextlib.chdir(case_dir), warnings.catch_warnings():
+                warnings.simplefilter("ignore")   # Agg 后端下 plt.pause 的提示
+                studio.visualize_gamut(lut_rgb)
+            plt.close("all")
+
+        pipeline = ChromaStackPipeline()
+        matched = pipeline.match_image(
+            file_digest(image_path), width, lambda w: load_image_rgba(image_path, w), lut,
+            alpha_threshold=studio.ALPHA_THRESHOLD, matching_mode=args.matching_mode,
+            min_pixel_size=5, scale=10, sigma=0.5
+        )
+        region_map = matched.value.region_map
+        codec = studio.StackCodec(num_filaments, layers)
+        meshed = pipeline.mesh(
+            matched.key, region_map, codec, layer_height, studio.BASE_HEIGHT, pixel_size,
+            mesher=args.mesher, min_island_mm2=min_island_area(args.min_island_area, studio.NOZZLE_WIDTH),
+            simplify_tolerance_mm=args.simplify_tolerance, workers=args.workers
+        )
+        names = [f["Name"].replace(" ", "_") for f in filaments]
+        colors = [f.get("Color", "#808080") for f in filaments]
+        with instrumentation.stage("export"):
+            export_stats = write_3mf(os.path.join(case_dir, "model.3mf"), meshed.value.slot_parts, names, colors)
+
+        # AutoSelector: 提取特征色后评估库存中所有 num_filaments 色组合 (与 /colorize 相同)
+        if not args.skip_search:
+            with instrumentation.stage("features"):
+                centers_lab, weights = extract_image_features(image_path, n_colors=args.feature_colors)
+            scores = []
+            for combo in itertools.combinations(inventory, num_filaments):
+                with instrumentation.stage("evaluate"):
+                    scores.append((evaluate_combination(engine, list(combo), centers_lab, weights),
+                                   [f["Name"] for f in combo]))
+            best_score, best_combo = min(scores, key=lambda item: item[0])
+            output["search"] = {"combinations": len(scores), "best": best_combo,
+                                "best_score": round(float(best_score), 4)}
+    seconds = time.perf_counter() - start
+
+    output.update({
+        "lut_size": int(len(lut_codes)),
+        "image_size": list(matched.value.lut_idx_matrix.shape[::-1]),
+        "regions": len(region_map),
+        "parts": export_stats["parts"],
+        "triangles": export_stats["triangles"],
+    })
+    return {name: list(entry) for name, entry in recorder.stages.items()}, seconds, output
+
+
+def run_benchmark(args):
+    """
+    运行全部用例
+
+    Returns:
+        dict: 写入 JSON 的结果 (meta + cases)
+    """
+    from ChromaStackStudio import load_inventory
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        inventory = load_inventory(args.inventory)
+    inventory = [f for f in inventory if "FILAMENT_K" in f and "FILAMENT_S" in f]
+    if max(args.filaments) > len(inventory):
+        raise ValueError(f"耗材库只有 {len(inventory)} 种可用耗材，无法测试 {max(args.filaments)} 色")
+
+    cases = {}
+    with tempfile.TemporaryDirectory(prefix="chromastack-bench-") as workdir:
+        # 预热: 首次运行包含模块导入等一次性开销，不计入结果
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            run_case(args.kinds[0], min(args.sizes), min(args.filaments), inventory, args, workdir)
+        for kind, width, num_filaments in itertools.product(args.kinds, args.sizes, args.filaments):
+            case_id = f"{kind}-{width}px-{num_filaments}f"
+            samples, totals, outputs = [], [], []
+            for _ in range(args.repeat):
+                # 流水线各模块的进度输出很多，--verbose 时才显示
+                with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                    stages, seconds, output = run_case(kind, width, num_filaments, inventory, args, workdir)
+                samples.append(stages)
+                totals.append(seconds)
+                outputs.append(output)
+            if any(output != outputs[0] for output in outputs):
+                print(f"⚠️ {case_id}: 多次运行的输出不一致")
+            cases[case_id] = {
+                "params": {"kind": kind, "width": width, "filaments": num_filaments},
+                "total_s": round(statistics.median(totals), 6),
+                "stages": _summary(samples),
+                "output": outputs[0],
+            }
+            print(f"  {case_id:24s} {cases[case_id]['total_s']:8.2f} s  "
+                  f"{outputs[0]['regions']:>6} 区域  {outputs[0]['triangles']:>9,} 三角面")
+
+    return {"meta": environment_info(args), "cases": cases}
+
+
+def _git(*command):
+    try:
+        return subprocess.run(("git",) + command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment_info(args):
+    """提交、Python/依赖版本、机器和运行参数 (对比时环境不同会给出提示)"""
+    from importlib import metadata
+
+    versions = {}
+    for package in TRACKED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "version": RESULT_VERSION,
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+        "settings": {key: getattr(args, key) for key in (
+            "kinds", "sizes", "filaments", "layers", "repeat", "seed", "mesher", "matching_mode", "min_island_area",
+            "simplify_tolerance", "workers", "feature_colors", "skip_gamut", "skip_search", "trace_memory")},
+    }
+
+
+# ================= 对比 =================
+
+def compare_results(baseline, current, threshold=0.1, min_seconds=0.01):
+    """
+    对比两次结果
+
+    墙钟时间增加超过 threshold (比例) 且超过 min_seconds 的阶段记为回退，减少同样幅度记为改进；
+    输出摘要不同的用例单独列出。
+
+    Returns:
+        dict: regressions / improvements ([用例, 阶段, 基准秒, 当前秒, 比例])、output_changes、
+              missing (只在一侧出现的用例)、environment (不同的环境项)
+    """
+    report = {"regressions": [], "improvements": [], "output_changes": [], "missing": [], "environment": []}
+    base_meta, meta = baseline.get("meta", {}), current.get("meta", {})
+    for key in ("python", "machine", "cpu_count"):
+        if base_meta.get(key) != meta.get(key):
+            report["environment"].append((key, base_meta.get(key), meta.get(key)))
+    base_settings, settings = base_meta.get("settings", {}), meta.get("settings", {})
+    for key in sorted(set(base_settings) | set(settings)):
+        if base_settings.get(key) != settings.get(key):
+            report["environment"].append((f"--{key.replace('_', '-')}", base_settings.get(key), settings.get(key)))
+    base_packages, packages = base_meta.get("packages", {}), meta.get("packages", {})
+    for package in sorted(set(base_packages) | set(packages)):
+        if base_packages.get(package) != packages.get(package):
+            report["environment"].append((package, base_packages.get(package), packages.get(package)))
+
+    base_cases, cases = baseline.get("cases", {}), current.get("cases", {})
+    report["missing"] = sorted(set(base_cases) ^ set(cases))
+    for case_id in [case_id for case_id in cases if case_id in base_cases]:
+        old, new = base_cases[case_id], cases[case_id]
+        if old.get("output") != new.get("output"):
+            report["output_changes"].append((case_id, old.get("output"), new.get("output")))
+        timings = [("total", old["total_s"], new["total_s"])]
+        timings += [(name, old["stages"][name]["wall_s"], stage["wall_s"])
+                    for name, stage in new["stages"].items() if name in old["stages"]]
+        for name, before, after in timings:
+            if abs(after - before) < min_seconds:
+                continue
+            ratio = after / before if before > 0 else float("inf")
+            if ratio > 1 + threshold:
+                report["regressions"].append((case_id, name, before, after, ratio))
+            elif ratio < 1 / (1 + threshold):
+                report["improvements"].append((case_id, name, before, after, ratio))
+    return report
+
+
+def print_report(report, threshold):
+    """打印对比结果"""
+    if report["environment"]:
+        print("\n⚠️ 运行环境不同 (耗时差异可能来自环境):")
+        for key, before, after in report["environment"]:
+            print(f"  {key}: {before} -> {after}")
+    if report["missing"]:
+        print(f"\n⚠️ 只在一侧出现的用例: {', '.join(report['missing'])}")
+    if report["output_changes"]:
+        print("\n⚠️ 输出变化:")
+        for case_id, before, after in report["output_changes"]:
+            changed = {key: (before.get(key), after.get(key))
+                       for key in sorted(set(before) | set(after)) if before.get(key) != after.get(key)}
+            print(f"  {case_id}: " + ", ".join(f"{key} {old} -> {new}" for key, (old, new) in changed.items()))
+    for title, rows in (("🐢 性能回退", report["regressions"]), ("🚀 性能改进", report["improvements"])):
+        if rows:
+            print(f"\n{title} (阈值 {threshold:.0%}):")
+            for case_id, name, before, after, ratio in sorted(rows, key=lambda row: -abs(np.log(row[4]))):
+                print(f"  {case_id:24s} {name:10s} {before:8.3f} s -> {after:8.3f} s  ({ratio:.2f}x)")
+    if not report["regressions"]:
+        print(f"\n✅ 没有超过阈值 ({threshold:.0%}) 的性能回退")
+
+
+# ================= 命令行 =================
+
+def main(argv=None):
+    from ChromaStackStudio import TOTAL_LAYERS
+
+    parser = argparse.ArgumentParser(description="ChromaStack 流水线基准测试 (合成图片，无界面)")
+    parser.add_argument("--output", default=os.path.join("debug_output", "benchmark.json"), help="结果 JSON 路径")
+    parser.add_argument("--compare", default=None, help="与之对比的基准结果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="回退阈值 (耗时增加的比例)")
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="忽略小于该值的耗时差异 (秒)")
+    parser.add_argument("--kinds", nargs='+', default=list(IMAGE_KINDS), choices=IMAGE_KINDS, help="合成图片类型")
+    parser.add_argument("--sizes", type=int, nargs='+', default=list(DEFAULT_SIZES), help="图片宽度 (像素)")
+    parser.add_argument("--filaments", type=int, nargs='+', default=list(DEFAULT_FILAMENT_COUNTS), help="耗材数量")
+    parser.add_argument("--layers", type=int, default=TOTAL_LAYERS, help="混色层数")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例的运行次数 (取中位数)")
+    parser.add_argument("--seed", type=int, default=0, help="合成图片的随机种子")
+    parser.add_argument("--inventory", default=DEFAULT_INVENTORY, help="耗材库 JSON 路径 (按顺序取前 N 种)")
+    parser.add_argument("--mesher", default="contour", choices=("contour", "greedy"), help="网格生成方式")
+    parser.add_argument("--matching-mode", default="region", choices=("region", "pixel"), help="颜色匹配方式")
+    parser.add_argument("--min-island-area", default=0.0, help="几何清理的最小孤岛面积 (mm² 或 auto)")
+    parser.add_argument("--simplify-tolerance", type=float, default=0.0, help="轮廓简化容差 (mm)")
+    parser.add_argument("--workers", type=int, default=1, help="网格生成的工作进程数 (0 表示按 CPU 核数)")
+    parser.add_argument("--feature-colors", type=int, default=100, help="AutoSelector 提取的特征色数量")
+    parser.add_argument("--skip-gamut", action="store_true", help="不生成色域图")
+    parser.add_argument("--skip-search", action="store_true", help="不运行 AutoSelector 组合搜索")
+    parser.add_argument("--trace-memory", action="store_true", help="记录各阶段的 tracemalloc 峰值 (会变慢)")
+    parser.add_argument("--verbose", action="store_true", help="显示流水线各模块的输出")
+    args = parser.parse_args(argv)
+    if args.min_island_area != "auto":
+        args.min_island_area = float(args.min_island_area)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"🏁 基准测试: {len(args.kinds) * len(args.sizes) * len(args.filaments)} 个用例 x {args.repeat} 次")
+    result = run_benchmark(args)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    print(f"💾 结果已保存: {args.output} (提交 {result['meta']['commit']})")
+
+    if baseline is None:
+        return 0
+    report = compare_results(baseline, result, args.threshold, args.min_seconds)
+    print_report(report, args.threshold)
+    return 1 if report["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
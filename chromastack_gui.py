@@ -5,6 +5,7 @@ ChromaStack GUI入口文件
 基于Pywebview的GUI应用，用于加载Vue3前端界面
 """
 
+import multiprocessing
 import webview
 import sys
 import threading
@@ -78,4 +79,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # 打包后的可执行文件中，网格生成的工作进程 (spawn) 从这里进入
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
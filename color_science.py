@@ -0,0 +1,166 @@
+"""
+颜色转换工具 (sRGB / 线性 RGB / CIELAB D65)
+
+全部使用 float32，按块处理并复用临时缓冲区，调用方可以通过 out= 传入预分配的结果数组。
+uint8 输入的 sRGB -> 线性 RGB 通过 256 项查找表完成，不再逐像素做幂运算。
+"""
+
+import numpy as np
+
+CHUNK_PIXELS = 1 << 18  # 每块处理的像素数 (控制临时缓冲区大小)
+
+# D65 白点归一化后的 线性 RGB -> XYZ 矩阵 (行: X/Xn, Y/Yn, Z/Zn)
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+_XYZ_WHITE = np.array([0.95047, 1.00000, 1.08883])
+_RGB_TO_XYZN_T = np.ascontiguousarray((_RGB_TO_XYZ / _XYZ_WHITE[:, None]).T, dtype=np.float32)
+
+_LAB_EPSILON = 0.008856
+_LAB_KAPPA = 7.787
+
+
+def _srgb_to_linear_float64(v):
+    return np.where(v > 0.04045, ((v + 0.055) / 1.055) ** 2.4, v / 12.92)
+
+
+# uint8 sRGB -> 线性 RGB 查找表
+SRGB_U8_TO_LINEAR = _srgb_to_linear_float64(np.arange(256) / 255.0).astype(np.float32)
+
+
+def srgb_to_linear(rgb, out=None):
+    """
+    sRGB -> 线性 RGB (float32, 0-1)
+    rgb: uint8 (0-255，查表) 或浮点 (0-255)
+    """
+    rgb = np.asarray(rgb)
+    if out is None:
+        out = np.empty(rgb.shape, dtype=np.float32)
+    if rgb.dtype == np.uint8:
+        np.take(SRGB_U8_TO_LINEAR, rgb, out=out)
+        return out
+
+    np.divide(rgb, 255.0, out=out, casting='unsafe')
+    low = out <= 0.04045
+    low_values = out[low] / 12.92
+    out += 0.055
+    out /= 1.055
+    np.power(out, 2.4, out=out)
+    out[low] = low_values
+    return out
+
+
+def linear_to_srgb(linear, out=None):
+    """线性 RGB -> sRGB (0-1)，先截断到 [0, 1]，保持输入的浮点精度"""
+    linear = np.asarray(linear)
+    if out is None:
+        out = np.empty(linear.shape, dtype=linear.dtype if linear.dtype.kind == 'f' else np.float32)
+    np.clip(linear, 0, 1, out=out)
+    low = out <= 0.0031308
+    low_values = out[low] * 12.92
+    np.power(out, 1.0 / 2.4, out=out)
+    out *= 1.055
+    out -= 0.055
+    out[low] = low_values
+    return out
+
+
+def linear_to_srgb_bytes(linear, out=None):
+    """线性 RGB -> sRGB uint8 (截断取整)"""
+    srgb = linear_to_srgb(linear)
+    srgb *= 255
+    if out is None:
+        out = np.empty(srgb.shape, dtype=np.uint8)
+    np.copyto(out, srgb, casting='unsafe')
+    return out
+
+
+def linear_to_lab(linear, out=None, chunk_pixels=CHUNK_PIXELS):
+    """
+    线性 RGB (N, 3) -> CIELAB (N, 3) float32
+    """
+    linear = np.asarray(linear, dtype=np.float32).reshape(-1, 3)
+    n = len(linear)
+    if out is None:
+        out = np.empty((n, 3), dtype=np.float32)
+    f = np.empty((min(n, chunk_pixels), 3), dtype=np.float32)
+
+    for start in range(0, n, chunk_pixels):
+        stop = min(start + chunk_pixels, n)
+        _xyz_to_lab(linear[start:stop], f[:stop - start], out[start:stop])
+    return out
+
+
+def _xyz_to_lab(linear, f, out):
+    """单块: 线性 RGB -> 归一化 XYZ -> f(t) -> Lab，f 为临时缓冲区"""
+    np.matmul(linear, _RGB_TO_XYZN_T, out=f)
+    low = f <= _LAB_EPSILON
+    low_values = f[low] * _LAB_KAPPA + 16.0 / 116.0
+    np.cbrt(f, out=f)
+    f[low] = low_values
+
+    fx, fy, fz = f[:, 0], f[:, 1], f[:, 2]
+    np.multiply(fy, 116.0, out=out[:, 0])
+    out[:, 0] -= 16.0
+    np.subtract(fx, fy, out=out[:, 1])
+    out[:, 1] *= 500.0
+    np.subtract(fy, fz, out=out[:, 2])
+    out[:, 2] *= 200.0
+
+
+def rgb_to_lab(rgb, out=None, chunk_pixels=CHUNK_PIXELS):
+    """
+    将 sRGB (0-255) 转换为 CIELAB 颜色空间 (D65)。
+    输入: (N, 3) uint8 或浮点，范围 0-255
+    输出: (N, 3) float32 Lab 值
+    """
+    rgb = np.asarray(rgb).reshape(-1, 3)
+    n = len(rgb)
+    if out is None:
+        out = np.empty((n, 3), dtype=np.float32)
+    size = min(n, chunk_pixels)
+    linear = np.empty((size, 3), dtype=np.float32)
+    f = np.empty((size, 3), dtype=np.float32)
+
+    for start in range(0, n, chunk_pixels):
+        stop = min(start + chunk_pixels, n)
+        chunk_linear = srgb_to_linear(rgb[start:stop], out=linear[:stop - start])
+        _xyz_to_lab(chunk_linear, f[:stop - start], out[start:stop])
+    return out
+
+
+def pack_rgb(rgb):
+    """(..., 3) uint8 -> (...) uint32 颜色编号 r<<16 | g<<8 | b"""
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    return (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+
+
+def unpack_rgb(keys):
+    """(...) 颜色编号 -> (..., 3) uint8"""
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=-1).astype(np.uint8)
+
+
+def image_to_lab(img_rgb, mask=None, out=None):
+    """
+    将 (H, W, 3) uint8 图片转换为 (H, W, 3) float32 Lab。
+    插画缩放后通常只有几千种颜色: 先把像素打包成 24-bit 颜色编号去重，
+    只转换不同的颜色，再按逆索引散回像素。
+    mask 之外 (透明) 的像素不参与转换，Lab 置 0。
+    """
+    H, W = img_rgb.shape[:2]
+    keys = pack_rgb(img_rgb)
+    keys = keys[mask] if mask is not None else keys.ravel()
+
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_lab = rgb_to_lab(unpack_rgb(unique_keys))
+
+    if out is None:
+        out = np.zeros((H, W, 3), dtype=np.float32)
+    else:
+        out[...] = 0
+    if mask is not None:
+        out[mask] = unique_lab[inverse]
+    else:
+        out.reshape(-1, 3)[:] = unique_lab[inverse]
+    return out
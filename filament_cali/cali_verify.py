@@ -2,6 +2,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import trimesh
 import os
+import sys
+
+# 与主程序共用颜色转换 (color_science.py 位于仓库根目录)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from color_science import linear_to_srgb
 
 # ================= 核心配置区域 =================
 
@@ -123,8 +128,8 @@ def generate_validation_preview():
         
         # 计算颜色
         rgb_linear = calculate_composite_stack(stack)
-        # Gamma 校正用于显示
-        rgb_srgb = rgb_linear ** (1/2.2)
+        # sRGB 编码用于显示 (与 LUT 颜色一致)
+        rgb_srgb = linear_to_srgb(rgb_linear)
         
         grid_img[row, col] = rgb_srgb
         
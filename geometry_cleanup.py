@@ -0,0 +1,132 @@
+"""
+网格生成前的几何清理
+
+照片类输入匹配后常留下大量单像素的斑点: 每个斑点在每一层都会变成一个独立的拉伸实体，
+既增加 3MF 体积和切片负担，又远小于喷嘴能打印的最小面积。这里在层叠编码上做清理:
+    1. 可打印掩码    面积小于阈值的实心孤岛删除，被实心包围的小孔洞填平 (取最近实心像素的层叠)
+    2. 逐层槽位      每一层中面积小于阈值的同槽位连通区域改为最近的大区域的槽位
+                     (某槽位区域中的孔洞就是另一个槽位的孤岛，因此同样被处理)
+清理后的层叠编码可能不在 LUT 中，但每一层仍然只使用已选的耗材。
+
+阈值默认取喷嘴宽度的平方 (喷嘴能挤出的最小方块)。
+轮廓简化 (layer_mesher.ContourSimplifier) 在网格阶段进行，这里只负责统计。
+"""
+
+import numpy as np
+from scipy import ndimage
+from skimage.measure import label as label_components
+
+from layer_mesher import boundary_vertex_count, stack_volume, start_layer_runs
+
+# 每个边界顶点拉伸后约对应的三角形数 (侧壁 2 个 + 顶/底面各 1 个)
+TRIANGLES_PER_VERTEX = 4
+
+
+def min_island_area(value, nozzle_width):
+    """最小面积 (mm²): 'auto' 表示喷嘴宽度的平方，其余按数值处理"""
+    if isinstance(value, str) and value.strip().lower() == 'auto':
+        return float(nozzle_width) ** 2
+    return float(value or 0.0)
+
+
+def _small_components(labels_img, min_pixels):
+    """4 邻接连通区域中像素数小于 min_pixels 的区域 (labels_img 中 0 为背景)，返回 (像素掩码, 区域数)"""
+    components = label_components(labels_img, background=0, connectivity=1)
+    counts = np.bincount(components.ravel())
+    small = counts < min_pixels
+    small[0] = False
+    return small[components], int(np.count_nonzero(small))
+
+
+def _fill_from_nearest(values, source, targets):
+    """targets 中的像素取 source 中最近像素的值 (EDT 最近像素)"""
+    _, (iy, ix) = ndimage.distance_transform_edt(~source, return_indices=True)
+    return np.where(targets, values[iy, ix], values)
+
+
+def cull_islands(stack_codes_matrix, solid_mask_2d, codec, min_pixels):
+    """
+    删除小孤岛、填平小孔洞
+
+    Args:
+        stack_codes_matrix: (H, W) 层叠编码
+        solid_mask_2d: (H, W) 可打印像素
+        codec: StackCodec
+        min_pixels (int): 最小面积 (像素数)，小于该值的孤岛/孔洞被处理
+
+    Returns:
+        tuple: (新层叠编码, 新掩码, 统计 dict)
+    """
+    stats = {'mask_islands': 0, 'mask_holes': 0, 'slot_islands': 0, 'pixels_changed': 0}
+    if min_pixels <= 1 or not np.any(solid_mask_2d):
+        return stack_codes_matrix, solid_mask_2d, stats
+
+    codes, mask = stack_codes_matrix, solid_mask_2d.copy()
+
+    # 1. 可打印掩码: 全部都是小孤岛时保持原样
+    islands, count = _small_components(mask, min_pixels)
+    if count and np.any(mask & ~islands):
+        mask &= ~islands
+        stats['mask_islands'] = count
+    # 与图像边界相连的空白是外部，不算孔洞
+    empty = label_components(~mask, background=0, connectivity=1)
+    outside = np.unique(np.concatenate([empty[0], empty[-1], empty[:, 0], empty[:, -1]]))
+    enclosed = np.where(np.isin(empty, outside), 0, empty)
+    holes, stats['mask_holes'] = _small_components(enclosed, min_pixels)
+    if stats['mask_holes']:
+        codes = _fill_from_nearest(codes, mask, holes)
+        mask |= holes
+
+    # 2. 逐层槽位孤岛
+    volume = stack_volume(codes, mask, codec)
+    changed = volume.copy()
+    for layer_idx in range(codec.total_layers):
+        slots = changed[..., layer_idx]
+        islands, count = _small_components(slots.astype(np.int32) + 1, min_pixels)
+        large = (slots >= 0) & ~islands
+        if count == 0 or not np.any(large):
+            continue
+        changed[..., layer_idx] = _fill_from_nearest(slots, large, islands)
+        stats['slot_islands'] += count
+    if stats['slot_islands']:
+        codes = np.where(mask, codec.encode(np.maximum(changed, 0)), codes)
+
+    stats['pixels_changed'] = int(np.count_nonzero(np.any(changed != volume, axis=2)
+                                                   | (mask != solid_mask_2d)))
+    return codes, mask, stats
+
+
+def estimate_contour_triangles(stack_codes_matrix, solid_mask_2d, codec, double_sided=True):
+    """
+    不生成网格，按边界顶点数估计 contour 网格 (layer_mesher，未简化) 的三角形数:
+    每个起始层的段标签图 × 面数，加上底座
+    """
+    volume = stack_volume(stack_codes_matrix, solid_mask_2d, codec)
+    vertices = sum(boundary_vertex_count(start_layer_runs(volume, layer_idx))
+                   for layer_idx in range(codec.total_layers))
+    sides = 2 if double_sided else 1
+    base = boundary_vertex_count(np.where(solid_mask_2d, 0, -1))
+    return TRIANGLES_PER_VERTEX * (vertices * sides + base)
+
+
+def clean_geometry(stack_codes_matrix, solid_mask_2d, codec, min_area_mm2, pixel_size, double_sided=True):
+    """
+    按最小面积 (mm²) 清理层叠编码，并估计节省的三角形数
+
+    Returns:
+        tuple: (新层叠编码, 新掩码, 报告 dict)
+    """
+    min_pixels = int(np.ceil(min_area_mm2 / pixel_size ** 2 - 1e-9)) if min_area_mm2 > 0 else 0
+    codes, mask, report = cull_islands(stack_codes_matrix, solid_mask_2d, codec, min_pixels)
+    report['min_pixels'] = min_pixels
+    report['triangles_saved'] = 0
+    if report['pixels_changed']:
+        before = estimate_contour_triangles(stack_codes_matrix, solid_mask_2d, codec, double_sided)
+        after = estimate_contour_triangles(codes, mask, codec, double_sided)
+        report['triangles_saved'] = before - after
+    return codes, mask, report
+
+
+def simplified_triangles(meshes):
+    """轮廓简化节省的三角形数 (按各网格 metadata['simplified_vertices'] 统计，已放置的每个副本都计入)"""
+    return TRIANGLES_PER_VERTEX * sum(mesh.metadata.get('simplified_vertices', 0) for mesh in meshes)
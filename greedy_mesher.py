@@ -0,0 +1,505 @@
+"""
+贪心体素网格生成
+
+把整个模型 (背面彩色层 + 底座 + 正面彩色层) 看成一个 (H, W, K) 的槽位体素体，
+直接从体素体为每个槽位生成一个焊接好的封闭网格:
+    1. 面剔除      同一槽位相邻体素之间的面不生成，只保留与空气或其他槽位接触的面
+    2. 贪心合并    每个切面上同一槽位的单位正方形先沿一个方向合并成行程，
+                   再把相邻行中起止相同的行程合并成矩形
+    3. T 型接点    矩形边上落有同槽位其他矩形的角点时，把这些点插入边界，
+                   以矩形中心做扇形三角化，相邻面的边因此一一对应
+    4. 焊接        顶点按 (槽位, 网格坐标) 去重，每个槽位输出一个网格
+
+各层厚度可以不同 (底座是一整层)，Z 方向通过 z_levels 把网格坐标映射到物理高度。
+坐标约定与 layer_mesher 相同: 像素 (r, c) 的中心位于 x = c * ps, y = (H - 1 - r) * ps。
+同槽位体素只在棱或角上相接处，网格点按面连通的一侧各复制一份 (必要时在棱中点再拆分三角形)，
+输出的每个网格都是封闭、定向一致的二维流形。
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import trimesh
+
+from layer_mesher import stack_volume
+
+# 各法线轴的面内坐标轴 (e1, e2)，满足 e1 × e2 = +n
+_PLANE_AXES = ((1, 2), (2, 0), (0, 1))
+
+
+def model_volume(stack_codes_matrix, solid_mask_2d, codec, layer_height, base_height,
+                 double_sided=True, base_slot=0):
+    """
+    整个模型的槽位体素，自下而上: 背面彩色层 (倒序) + 底座 (一层) + 正面彩色层 (仅双面)
+
+    Returns:
+        tuple: (H, W, K) int16 槽位体素, (K+1,) 各层底面高度 (mm，从 0 开始)
+    """
+    L = codec.total_layers
+    parts = [stack_volume(stack_codes_matrix, solid_mask_2d, codec, reverse_layers=True)]
+    thickness = [np.full(L, layer_height)]
+    if base_height > 0:
+        parts.append(np.where(solid_mask_2d, base_slot, -1).astype(np.int16)[..., None])
+        thickness.append([base_height])
+    if double_sided:
+        parts.append(stack_volume(stack_codes_matrix, solid_mask_2d, codec))
+        thickness.append(np.full(L, layer_height))
+    z_levels = np.concatenate([[0.0], np.cumsum(np.concatenate(thickness))])
+    return np.concatenate(parts, axis=2), z_levels
+
+
+def _merge_rectangles(labels):
+    """
+    阶段 2: 贪心合并一组切面 (S, A, B) 上的同标签单元
+
+    Returns:
+        tuple: plane, a0, a1, b0, b1, label (区间左闭右开)
+    """
+    S, A, B = labels.shape
+    flat = labels.reshape(-1, B)
+
+    # 沿 B 方向的行程
+    change = np.ones(flat.shape, dtype=bool)
+    change[:, 1:] = flat[:, 1:] != flat[:, :-1]
+    row, b0 = np.nonzero(change)
+    b1 = np.empty_like(b0)
+    b1[:-1] = b0[1:]
+    row_end = np.ones(len(row), dtype=bool)
+    row_end[:-1] = row[1:] != row[:-1]
+    b1[row_end] = B
+    label = flat[row, b0]
+    keep = label >= 0
+    row, b0, b1, label = row[keep], b0[keep], b1[keep], label[keep]
+    if len(row) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return (empty,) * 6
+    plane, a = np.divmod(row, A)
+
+    # 相邻行中起止与标签都相同的行程合并成矩形
+    order = np.lexsort((a, label, b1, b0, plane))
+    plane, a, b0, b1, label = plane[order], a[order], b0[order], b1[order], label[order]
+    continues = np.zeros(len(plane), dtype=bool)
+    continues[1:] = ((plane[1:] == plane[:-1]) & (b0[1:] == b0[:-1]) & (b1[1:] == b1[:-1])
+                     & (label[1:] == label[:-1]) & (a[1:] == a[:-1] + 1))
+    first = np.flatnonzero(~continues)
+    last = np.append(first[1:], len(plane)) - 1
+    return plane[first], a[first], a[last] + 1, b0[first], b1[first], label[first]
+
+
+def _octant_components():
+    """
+    2x2x2 体素 (卦限 o = bx + 2*by + 4*bz) 的面连通分量查找表
+    [mask, o] -> o 所在分量中编号最小的卦限，mask 为同槽位卦限的位集合
+    """
+    table = np.zeros((256, 8), dtype=np.uint8)
+    count = np.zeros(256, dtype=np.uint8)
+    for mask in range(256):
+        seen = 0
+        for o in range(8):
+            if not mask >> o & 1 or seen >> o & 1:
+                continue
+            component, stack = 0, [o]
+            while stack:
+                q = stack.pop()
+                if component >> q & 1:
+                    continue
+                component |= 1 << q
+                stack.extend(q ^ bit for bit in (1, 2, 4) if mask >> (q ^ bit) & 1)
+            for q in range(8):
+                if component >> q & 1:
+                    table[mask, q] = o
+            seen |= component
+            count[mask] += 1
+    return table, count
+
+
+_OCTANT_COMPONENT, _OCTANT_COMPONENT_COUNT = _octant_components()
+_LOWEST_OCTANT = np.array([(mask & -mask).bit_length() - 1 if mask else 0 for mask in range(256)], dtype=np.uint8)
+
+
+def face_rectangles(volume):
+    """
+    阶段 1 + 2: 面剔除 + 贪心合并
+
+    volume: (X, Y, Z) 槽位体素，-1 为空
+    Returns:
+        tuple: corners (R, 4, 3) int64 网格坐标 (从外侧看逆时针), label (R,),
+               octant (R, 4) 每个角点处该矩形所属体素相对角点的卦限
+    """
+    all_corners, all_labels, all_octants = [], [], []
+    for axis, (e1, e2) in enumerate(_PLANE_AXES):
+        t = np.transpose(volume, (axis, e1, e2))
+        padded = np.pad(t, ((1, 1), (0, 0), (0, 0)), constant_values=-1)
+        below, above = padded[:-1], padded[1:]
+        differs = below != above
+        for sign, owner in ((1, below), (-1, above)):
+            plane, a0, a1, b0, b1, label = _merge_rectangles(np.where(differs & (owner >= 0), owner, -1))
+            # (e1, e2) 平面内的四个角点: 法线为 +axis 时逆时针，为 -axis 时反向
+            ea = np.stack([a0, a1, a1, a0], axis=1)
+            eb = np.stack([b0, b0, b1, b1], axis=1)
+            if sign < 0:
+                ea, eb = ea[:, ::-1], eb[:, ::-1]
+            corners = np.empty((len(plane), 4, 3), dtype=np.int64)
+            corners[:, :, axis] = plane[:, None]
+            corners[:, :, e1] = ea
+            corners[:, :, e2] = eb
+            # 所属体素在角点的哪一侧: 法线方向上 +面属于下方体素，矩形在 a0 / b0 角向正方向延伸
+            octant = ((sign < 0) << axis) | ((ea == a0[:, None]) << e1) | ((eb == b0[:, None]) << e2)
+            all_corners.append(corners)
+            all_labels.append(label)
+            all_octants.append(octant.astype(np.uint8))
+    return (np.concatenate(all_corners), np.concatenate(all_labels).astype(np.int64),
+            np.concatenate(all_octants))
+
+
+def _diagonal_edge_points(padded):
+    """
+    只在棱上相接的同槽位体素对: 单位棱周围四个体素中只有对角的两个属于同一槽位。
+    padded 为四周各补一层 -1 的 (X, Y, Z) 体素；返回这些棱两端网格点的 (槽位, 网格坐标)
+    """
+    labels, points = [], []
+    for axis, (e1, e2) in enumerate(_PLANE_AXES):
+        t = np.transpose(padded, (axis, e1, e2))[1:-1]
+        v00, v10, v01, v11 = t[:, :-1, :-1], t[:, 1:, :-1], t[:, :-1, 1:], t[:, 1:, 1:]
+        for a, b, c, d in ((v00, v11, v10, v01), (v10, v01, v00, v11)):
+            index = np.nonzero((a >= 0) & (a == b) & (c != a) & (d != a))
+            label = a[index]
+            for offset in (0, 1):
+                xyz = np.empty((len(label), 3), dtype=np.int64)
+                xyz[:, axis] = index[0] + offset
+                xyz[:, e1] = index[1]
+                xyz[:, e2] = index[2]
+                labels.append(label)
+                points.append(xyz)
+    return np.concatenate(labels).astype(np.int64), np.concatenate(points)
+
+
+def _grid_keys(label, coords, dims):
+    """(label, 坐标) -> 单个 int64 键，dims 为各坐标的取值个数，按给定的坐标顺序排序"""
+    key = label.astype(np.int64)
+    for axis, size in enumerate(dims):
+        key = key * size + coords[..., axis]
+    return key
+
+
+def _split_shared_edges(faces, doubled, vertex_label, candidate, max_rounds=4):
+    """
+    顶点复制之后仍被四个三角形共用的棱: 棱两侧的两块同槽位体素只在棱上相接，
+    但在棱的两个端点处都经由相邻层的体素连通，端点无法按侧复制。
+    这时把其中一块体素 (沿棱外第一个轴位于正侧的那块) 的两个三角形在棱中点处各拆成两个。
+
+    faces: (F, 3) 顶点编号; doubled: (V, 3) 加倍后的网格坐标; vertex_label: (V,)
+    candidate: (V,) 可能位于这类棱端点的顶点，只检查两端都是候选顶点的棱
+    """
+    for _ in range(max_rounds):
+        num_vertices = len(doubled)
+        start, end = faces.ravel(), faces[:, [1, 2, 0]].ravel()
+        entries = np.flatnonzero(candidate[start] & candidate[end])
+        keys = np.minimum(start[entries], end[entries]) * num_vertices + np.maximum(start[entries], end[entries])
+        # 稳定排序: 同一条棱的四个三角形按面顺序排列，拆分结果不受其他槽位的三角形影响
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        run_start = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        run_count = np.diff(np.r_[run_start, len(keys)])
+        shared = run_start[run_count == 4]
+        if len(shared) == 0:
+            break
+
+        entry = entries[order[shared[:, None] + np.arange(4)]]   # (B, 4) 第几个三角形的第几条边
+        face_id, k = entry // 3, entry % 3
+        u, v, w = faces[face_id, k], faces[face_id, (k + 1) % 3], faces[face_id, (k + 2) % 3]
+        p, q = u[:, 0], v[:, 0]
+        axis = np.argmax(doubled[p] != doubled[q], axis=1)
+        e = np.where(axis == 0, 1, 0)
+        f = 3 - axis - e
+        rows = np.arange(len(shared))[:, None]
+        offset = doubled[w] - doubled[u]
+        offset[rows, :, axis[:, None]] = 0
+        span = np.argmax(np.abs(offset), axis=2)
+        normal = np.cross(doubled[v] - doubled[u], offset)
+        # 正侧体素 (e 轴为正) 的两个面: 沿 e 展开且朝正方向的面 + 法线朝 -e 的面
+        positive = (((span == e[:, None]) & (np.take_along_axis(offset, e[:, None, None], axis=2)[..., 0] > 0))
+                    | ((span == f[:, None]) & (np.take_along_axis(normal, e[:, None, None], axis=2)[..., 0] < 0)))
+        ok = positive.sum(axis=1) == 2
+        # 同一个三角形本轮只拆一次，其余留到下一轮
+        chosen = face_id[ok][positive[ok]].reshape(-1, 2)
+        _, first = np.unique(chosen.ravel(), return_index=True)
+        unique_pair = np.bincount(first // 2, minlength=len(chosen)) == 2
+        if not unique_pair.any():
+            break
+        edges = np.flatnonzero(ok)[unique_pair]
+
+        midpoint = num_vertices + np.arange(len(edges))
+        doubled = np.concatenate([doubled, (doubled[p[edges]] + doubled[q[edges]]) // 2])
+        vertex_label = np.concatenate([vertex_label, vertex_label[p[edges]]])
+        candidate = np.concatenate([candidate, np.zeros(len(edges), dtype=bool)])
+        sel = positive[edges]
+        split_face = face_id[edges][sel]
+        split_u, split_v, split_w = u[edges][sel], v[edges][sel], w[edges][sel]
+        split_mid = np.repeat(midpoint, 2)
+        faces = faces.copy()
+        faces[split_face] = np.stack([split_u, split_mid, split_w], axis=1)
+        faces = np.concatenate([faces, np.stack([split_mid, split_v, split_w], axis=1)])
+    return faces, doubled, vertex_label
+
+
+def mesh_slot_volume(volume, num_slots, pixel_size, z_levels):
+    """
+    由槽位体素直接生成每个槽位一个焊接好的封闭网格
+
+    Args:
+        volume: (H, W, K) 槽位体素 (行、列与图片一致)，-1 表示不打印
+        num_slots (int): 槽位数量
+        pixel_size (float): 像素尺寸 (mm)
+        z_levels: (K+1,) 各层底面 Z 坐标 (mm)，严格递增
+
+    Returns:
+        list: 每个槽位的 trimesh.Trimesh，没有体素的槽位为 None
+    """
+    H, W, K = volume.shape
+    # 网格坐标 (X, Y, Z): X = 列，Y 向上 (Y = H - 1 - 行)，Z = 层
+    xyz_volume = volume[::-1].transpose(1, 0, 2)
+    corners, rect_label, corner_octant = face_rectangles(xyz_volume)
+    meshes = [None] * num_slots
+    if len(corners) == 0:
+        return meshes
+    R = len(corners)
+    grid_dims = np.array([W + 1, H + 1, K + 1])
+    corner_label = np.repeat(rect_label, 4)
+    corner_xyz = corners.reshape(-1, 3)
+    corner_octant = corner_octant.ravel()
+
+    # 网格点按 (槽位, 网格坐标) 去重
+    corner_keys = _grid_keys(corner_label, corner_xyz, grid_dims)
+    order = np.argsort(corner_keys)
+    is_new = np.ones(len(order), dtype=bool)
+    is_new[1:] = corner_keys[order[1:]] != corner_keys[order[:-1]]
+    corner_point = np.empty(len(order), dtype=np.int64)
+    corner_point[order] = np.cumsum(is_new) - 1
+    first = order[is_new]
+    point_label, point_xyz = corner_label[first], corner_xyz[first]
+    num_points = len(first)
+
+    # 阶段 3: 每条边上同槽位的其他网格点 (按边的走向轴分别建立有序表；沿 Z 的有序表就是去重键的顺序)
+    sorted_points, sorted_keys, axis_offset = [], [], [0]
+    for d in range(3):
+        others = [axis for axis in range(3) if axis != d] + [d]
+        keys = _grid_keys(point_label, point_xyz[:, others], grid_dims[others])
+        order = np.argsort(keys) if d < 2 else np.arange(num_points)
+        sorted_keys.append(keys[order])
+        sorted_points.append(order)
+        axis_offset.append(axis_offset[-1] + num_points)
+    sorted_points = np.concatenate(sorted_points)
+
+    # 边 i 从角点 i 走到角点 i+1；长度为 1 的边上不可能有其他网格点，不必查找
+    start = corner_xyz
+    end = corners[:, [1, 2, 3, 0]].reshape(-1, 3)
+    step_sum = (end - start).sum(axis=1)
+    lo_index = np.zeros(4 * R, dtype=np.int64)
+    hi_index = np.zeros(4 * R, dtype=np.int64)
+    long_edges = np.flatnonzero(np.abs(step_sum) > 1)
+    edge_axis = np.argmax(start[long_edges] != end[long_edges], axis=1)
+    for d in range(3):
+        edges = long_edges[edge_axis == d]
+        others = [axis for axis in range(3) if axis != d] + [d]
+        lo_keys = _grid_keys(corner_label[edges], np.minimum(start[edges], end[edges])[:, others], grid_dims[others])
+        hi_keys = lo_keys + np.abs(step_sum[edges])
+        order = np.argsort(lo_keys)     # 有序查询对缓存友好
+        edges = edges[order]
+        lo_index[edges] = axis_offset[d] + np.searchsorted(sorted_keys[d], lo_keys[order], side='right')
+        hi_index[edges] = axis_offset[d] + np.searchsorted(sorted_keys[d], hi_keys[order], side='left')
+    inserted = hi_index - lo_index
+
+    # 多边形: 每条边 = 起点角 + 边上插入的点 (按走向排序)
+    segment_offset = np.concatenate([[0], np.cumsum(1 + inserted)[:-1]])
+    poly_length = 4 + inserted.reshape(R, 4).sum(axis=1)
+    poly_offset = np.concatenate([[0], np.cumsum(poly_length)[:-1]])
+    poly_points = np.empty(poly_length.sum(), dtype=np.int64)
+    poly_octant = np.empty(len(poly_points), dtype=np.uint8)
+    poly_points[segment_offset] = corner_point
+    poly_octant[segment_offset] = corner_octant
+    edge_of_item = np.repeat(np.arange(4 * R), inserted)
+    step = np.arange(len(edge_of_item)) - np.repeat(np.cumsum(inserted) - inserted, inserted)
+    source = np.where(step_sum[edge_of_item] > 0,
+                      lo_index[edge_of_item] + step,
+                      hi_index[edge_of_item] - 1 - step)
+    item_slot = segment_offset[edge_of_item] + 1 + step
+    poly_points[item_slot] = sorted_points[source]
+    # 边上的点: 所属体素沿边取正方向一侧，其余方向与边的起点相同
+    item_axis = np.argmax(start[edge_of_item] != end[edge_of_item], axis=1).astype(np.uint8)
+    poly_octant[item_slot] = corner_octant[edge_of_item] | (1 << item_axis)
+
+    # 阶段 4 (焊接): 网格点周围 2x2x2 个体素中同槽位体素只在棱或角上相接时 (非流形点)，
+    # 每个面连通的一侧各用一份顶点，每个槽位的网格因此是封闭的二维流形
+    padded = np.pad(xyz_volume, 1, constant_values=-1)
+    octant_mask = np.zeros(num_points, dtype=np.uint8)
+    for o in range(8):
+        neighbor = padded[point_xyz[:, 0] + (o & 1), point_xyz[:, 1] + (o >> 1 & 1), point_xyz[:, 2] + (o >> 2 & 1)]
+        octant_mask |= (neighbor == point_label).astype(np.uint8) << o
+    split = np.flatnonzero(_OCTANT_COMPONENT_COUNT[octant_mask[poly_points]] > 1)
+    split_mask = octant_mask[poly_points[split]]
+    side = _OCTANT_COMPONENT[split_mask, poly_octant[split]]
+    # 最低卦限所在的一侧沿用网格点编号，其余各侧追加顶点
+    split = split[side != _LOWEST_OCTANT[split_mask]]
+    side_keys, side_index = np.unique(poly_points[split] * 8 + side[side != _LOWEST_OCTANT[split_mask]],
+                                      return_inverse=True)
+    poly_vertices = poly_points.copy()
+    poly_vertices[split] = num_points + side_index
+    vertex_point = np.concatenate([np.arange(num_points), side_keys // 8])
+    num_vertices = len(vertex_point)
+
+    # 三角化: 没有插入点的矩形直接切两个三角形，其余以中心做扇形
+    plain = poly_length == 4
+    quads = poly_vertices[poly_offset[plain][:, None] + np.arange(4)]
+    faces = [quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]]
+
+    fan_rects = np.flatnonzero(~plain)
+    fan_length = poly_length[fan_rects]
+    item_rect = np.repeat(np.arange(len(fan_rects)), fan_length)
+    local = np.arange(len(item_rect)) - np.repeat(np.cumsum(fan_length) - fan_length, fan_length)
+    here = poly_offset[fan_rects][item_rect] + local
+    after = poly_offset[fan_rects][item_rect] + (local + 1) % fan_length[item_rect]
+    faces.append(np.stack([num_vertices + item_rect, poly_vertices[here], poly_vertices[after]], axis=1))
+    faces = np.concatenate(faces)
+
+    # 网格坐标加倍，扇形中心落在半格上
+    vertex_label = np.concatenate([point_label[vertex_point], rect_label[fan_rects]])
+    doubled = np.concatenate([2 * point_xyz[vertex_point], corners[fan_rects].sum(axis=1) // 2])
+
+    # 体素只在棱上相接的地方，顶点复制之后仍可能剩下被四个三角形共用的棱，只检查这些位置附近的三角形
+    diagonal_keys = _grid_keys(*_diagonal_edge_points(padded), grid_dims)
+    point_keys = corner_keys[first]
+    candidate = np.minimum(np.searchsorted(point_keys, diagonal_keys), num_points - 1)
+    near_diagonal = np.zeros(len(doubled), dtype=bool)
+    near_diagonal[:num_vertices] = np.isin(vertex_point, candidate[point_keys[candidate] == diagonal_keys])
+    touching = near_diagonal[faces].any(axis=1)
+    if touching.any():
+        split_faces, doubled, vertex_label = _split_shared_edges(faces[touching], doubled, vertex_label, near_diagonal)
+        faces = np.concatenate([faces[~touching], split_faces])
+    face_label = vertex_label[faces[:, 0]]
+
+    # 物理坐标
+    vertices = np.empty(doubled.shape)
+    vertices[:, 0] = (doubled[:, 0] / 2 - 0.5) * pixel_size
+    vertices[:, 1] = (doubled[:, 1] / 2 - 0.5) * pixel_size
+    vertices[:, 2] = np.interp(doubled[:, 2] / 2, np.arange(K + 1), z_levels)
+
+    # 按槽位拆分 (槽位编号用 int16 排序，稳定排序走基数排序)
+    vertex_order = np.argsort(vertex_label.astype(np.int16), kind='stable')
+    vertex_rank = np.empty_like(vertex_order)
+    vertex_rank[vertex_order] = np.arange(len(vertex_order))
+    vertex_bounds = np.searchsorted(vertex_label[vertex_order], np.arange(num_slots + 1))
+    face_order = np.argsort(face_label.astype(np.int16), kind='stable')
+    face_bounds = np.searchsorted(face_label[face_order], np.arange(num_slots + 1))
+    faces = vertex_rank[faces[face_order]]
+    vertices = vertices[vertex_order]
+    for slot_id in range(num_slots):
+        f0, f1 = face_bounds[slot_id], face_bounds[slot_id + 1]
+        if f0 == f1:
+            continue
+        v0, v1 = vertex_bounds[slot_id], vertex_bounds[slot_id + 1]
+        meshes[slot_id] = trimesh.Trimesh(vertices=vertices[v0:v1], faces=faces[f0:f1] - v0, process=False)
+    return meshes
+
+
+def mesh_model(stack_codes_matrix, solid_mask_2d, codec, layer_height, base_height, pixel_size,
+               double_sided=True, base_slot=0):
+    """
+    整个模型 (背面 + 底座 + 正面) 每个槽位一个焊接网格，Z 从 0 开始
+
+    Returns:
+        list: 每个槽位的 trimesh.Trimesh，没有体素的槽位为 None
+    """
+    volume, z_levels = model_volume(stack_codes_matrix, solid_mask_2d, codec, layer_height, base_height,
+                                    double_sided=double_sided, base_slot=base_slot)
+    return mesh_slot_volume(volume, codec.num_filaments, pixel_size, z_levels)
+
+
+def _benchmark_codes(image_path, width_px, codec, seed=0):
+    """基准测试输入: 图片 (或合成图) 按默认参数分割，每个区域随机分配一个层叠编码"""
+    from PIL import Image
+    from skimage.segmentation import felzenszwalb
+
+    if image_path:
+        img = Image.open(image_path).convert('RGBA')
+        img = img.resize((width_px, max(1, round(width_px * img.height / img.width))), Image.Resampling.NEAREST)
+        rgba = np.asarray(img)
+        rgb, mask = rgba[..., :3], rgba[..., 3] >= 128
+    else:
+        # 合成图: 渐变 + 噪声 + 实心圆，左上角透明
+        rng = np.random.default_rng(seed)
+        yy, xx = np.mgrid[:width_px, :width_px]
+        rgb = np.stack([xx * 255 // width_px, yy * 255 // width_px, np.full_like(xx, 128)], axis=-1)
+        rgb[(yy - width_px // 2) ** 2 + (xx - width_px // 2) ** 2 < (width_px // 5) ** 2] = [200, 30, 40]
+        rgb = np.clip(rgb + rng.integers(-20, 20, rgb.shape), 0, 255).astype(np.uint8)
+        mask = np.ones(rgb.shape[:2], dtype=bool)
+        mask[:width_px // 20, :width_px // 10] = False
+
+    regions = felzenszwalb(rgb, scale=10, sigma=0.5, min_size=5)
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, codec.num_codes, regions.max() + 1).astype(codec.dtype)[regions]
+    return codes, mask, regions.max() + 1
+
+
+def main(argv=None):
+    """贪心体素网格与 Shapely 轮廓路径 (create_voxel_mesh_masked)、layer_mesher 的对比"""
+    parser = argparse.ArgumentParser(description="网格生成基准测试 (双面模型)")
+    parser.add_argument("images", nargs='*', help="测试图片 (PNG，透明区域不打印)；不给时使用合成图")
+    parser.add_argument("--width", type=int, default=400, help="图片缩放后的宽度 (像素)")
+    parser.add_argument("--slots", type=int, default=5, help="耗材数量")
+    parser.add_argument("--layers", type=int, default=5, help="混色层数")
+    parser.add_argument("--skip-shapely", action="store_true", help="不运行 Shapely 轮廓路径 (很慢)")
+    args = parser.parse_args(argv)
+
+    import ChromaStackStudio as studio
+    from layer_mesher import SlabCache, mesh_layer_stack, mesh_base
+
+    codec = studio.StackCodec(args.slots, args.layers)
+    lh, base_h, ps = studio.LAYER_HEIGHT, studio.BASE_HEIGHT, studio.PIXEL_SIZE
+    z_base = args.layers * lh
+
+    def shapely_path(codes, mask):
+        H, W = mask.shape
+        slots = []
+        for slot_id in range(args.slots):
+            parts = [studio.create_voxel_mesh_masked(codes, slot_id, W, H, mask, 0.0, codec=codec, reverse_layers=True),
+                     studio.create_voxel_mesh_masked(codes, slot_id, W, H, mask, z_base, is_base_layer=True, codec=codec),
+                     studio.create_voxel_mesh_masked(codes, slot_id, W, H, mask, z_base + base_h, codec=codec)]
+            slots.append([mesh for mesh in parts if mesh is not None])
+        return slots
+
+    def contour_path(codes, mask):
+        cache = SlabCache()
+        back = mesh_layer_stack(codes, mask, codec, 0.0, lh, ps, reverse_layers=True, slab_cache=cache)
+        front = mesh_layer_stack(codes, mask, codec, z_base + base_h, lh, ps, slab_cache=cache)
+        base = mesh_base(mask, base_h, z_base, ps)
+        return [back[i] + front[i] + ([base] if i == 0 and base is not None else []) for i in range(args.slots)]
+
+    def greedy_path(codes, mask):
+        return [[mesh] if mesh is not None else [] for mesh in mesh_model(codes, mask, codec, lh, base_h, ps)]
+
+    meshers = [('greedy', greedy_path), ('contour', contour_path)]
+    if not args.skip_shapely:
+        meshers.append(('shapely', shapely_path))
+
+    for image_path in args.images or [None]:
+        codes, mask, num_regions = _benchmark_codes(image_path, args.width, codec)
+        print(f"\n🖼️ {image_path or '合成图'}: {mask.shape[1]}x{mask.shape[0]} 像素, {num_regions} 个区域, "
+              f"{args.slots} 色 x {args.layers} 层")
+        for name, mesher in meshers:
+            start = time.perf_counter()
+            slots = mesher(codes, mask)
+            seconds = time.perf_counter() - start
+            merged = [trimesh.util.concatenate(parts) for parts in slots if parts]
+            faces = sum(len(mesh.faces) for mesh in merged)
+            volume = sum(mesh.volume for mesh in merged)
+            watertight = sum(mesh.is_watertight for mesh in merged)
+            print(f"  {name:8s} {seconds:8.2f} s  {faces:>10,} 三角面  体积 {volume:10.2f} mm³  "
+                  f"封闭零件 {watertight}/{len(merged)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+阶段计时与内存统计
+
+    with instrumentation.stage("segment"):
+        ...
+
+只有在 recording() 打开的记录器中才会计时 (记录器按线程，后台任务各自记录)。没有记录器时 stage()
+只查询一次线程局部变量并返回共享的空上下文，开销可以忽略。
+
+每个阶段记录墙钟时间、本线程 CPU 时间 (time.thread_time) 和 tracemalloc 峰值 (可选: tracemalloc 会使
+所有内存分配变慢，默认关闭；它统计的是整个进程，多个任务并发时峰值只是近似值)。同名阶段多次进入时累加，
+嵌套阶段各自计时 (外层包含内层)。工作进程中的阶段由任务函数用 recording() 记录，records() 随结果返回，
+主进程用 merge() 合并 (耗时为各进程之和)。
+
+StageHistograms 按 (任务类型, 阶段) 聚合为 Prometheus 直方图 (/metrics)。
+"""
+
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_local = threading.local()
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+# 直方图桶: 阶段耗时 (秒) 与峰值内存 (字节)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+BYTES_BUCKETS = tuple(float(1 << shift) for shift in range(20, 34, 2))   # 1 MB .. 8 GB
+
+
+class StageRecorder:
+    """
+    一次运行 (一个请求或任务) 的阶段统计
+
+    Attributes:
+        stages: 阶段名 -> [次数, 墙钟秒, CPU 秒, 峰值字节 (未追踪内存时为 None)]
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = OrderedDict()
+        self._open = []
+
+    def add(self, name, wall, cpu, peak_bytes=None, count=1):
+        entry = self.stages.get(name)
+        if entry is None:
+            self.stages[name] = [count, wall, cpu, peak_bytes]
+            return
+        entry[0] += count
+        entry[1] += wall
+        entry[2] += cpu
+        if peak_bytes is not None:
+            entry[3] = peak_bytes if entry[3] is None else max(entry[3], peak_bytes)
+
+    def records(self):
+        """可序列化的阶段统计 (工作进程随结果返回)"""
+        return [(name, *entry) for name, entry in self.stages.items()]
+
+    def merge(self, records):
+        """合并工作进程的阶段统计"""
+        for name, count, wall, cpu, peak_bytes in records or ():
+            self.add(name, wall, cpu, peak_bytes, count)
+
+    def to_dict(self):
+        """写入 JSON 响应: {阶段: {'count', 'wall_ms', 'cpu_ms', 'peak_bytes'}}"""
+        return {
+            name: {
+                'count': count,
+                'wall_ms': round(wall * 1000, 2),
+                'cpu_ms': round(cpu * 1000, 2),
+                'peak_bytes': peak_bytes,
+            }
+            for name, (count, wall, cpu, peak_bytes) in self.stages.items()
+        }
+
+    def server_timing(self):
+        """Server-Timing 响应头: name;dur=毫秒;desc="cpu=.. peak=.." """
+        metrics = []
+        for name, (count, wall, cpu, peak_bytes) in self.stages.items():
+            desc = f"cpu={cpu * 1000:.1f}ms"
+            if peak_bytes is not None:
+                desc += f" peak={peak_bytes / 1024 / 1024:.1f}MB"
+            if count > 1:
+                desc += f" n={count}"
+            metrics.append(f'{name};dur={wall * 1000:.1f};desc="{desc}"')
+        return ', '.join(metrics)
+
+
+class _Stage:
+    __slots__ = ('recorder', 'name', 'wall', 'cpu', 'mem_base', 'mem_peak')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        recorder = self.recorder
+        if recorder.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # 外层阶段先记下到目前为止的峰值，再为本阶段重新计峰值
+            for outer in recorder._open:
+                outer.mem_peak = max(outer.mem_peak, peak)
+            tracemalloc.reset_peak()
+            self.mem_base = self.mem_peak = current
+        recorder._open.append(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        recorder = self.recorder
+        recorder._open.pop()
+        peak_bytes = None
+        if recorder.trace_memory:
+            self.mem_peak = max(self.mem_peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = self.mem_peak - self.mem_base
+            if recorder._open:
+                recorder._open[-1].mem_peak = max(recorder._open[-1].mem_peak, self.mem_peak)
+        recorder.add(self.name, wall, cpu, peak_bytes)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """计时上下文: 当前线程没有记录器时什么也不做"""
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        return _NULL_STAGE
+    return _Stage(recorder, name)
+
+
+def current_recorder():
+    """当前线程的记录器 (没有时为 None)"""
+    return getattr(_local, 'recorder', None)
+
+
+def is_recording():
+    return getattr(_local, 'recorder', None) is not None
+
+
+def merge(records):
+    """把工作进程返回的阶段统计合并到当前线程的记录器"""
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is not None and records:
+        recorder.merge(records)
+
+
+@contextmanager
+def recording(trace_memory=False):
+    """
+    在当前线程打开记录器
+
+    Args:
+        trace_memory (bool): 记录 tracemalloc 峰值 (首个使用者启动 tracemalloc，最后一个停止)
+    """
+    global _tracing_users
+    recorder = StageRecorder(trace_memory)
+    previous = getattr(_local, 'recorder', None)
+    if trace_memory:
+        with _tracing_lock:
+            if _tracing_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _tracing_users += 1
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+        if trace_memory:
+            with _tracing_lock:
+                _tracing_users -= 1
+                if _tracing_users == 0:
+                    tracemalloc.stop()
+
+
+class _Histogram:
+    """单个标签组合的直方图 (累积桶由 render 计算)"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, num_buckets):
+        self.counts = [0] * (num_buckets + 1)   # 最后一项为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class StageHistograms:
+    """
+    按 (任务类型, 阶段) 聚合的 Prometheus 直方图 (线程安全)
+
+        chromastack_stage_wall_seconds / chromastack_stage_cpu_seconds / chromastack_stage_peak_bytes
+        chromastack_job_wall_seconds (整个任务)
+    """
+
+    METRICS = (
+        ('chromastack_stage_wall_seconds', '各阶段墙钟时间 (秒)', SECONDS_BUCKETS),
+        ('chromastack_stage_cpu_seconds', '各阶段 CPU 时间 (秒，工作进程中的阶段为各进程之和)', SECONDS_BUCKETS),
+        ('chromastack_stage_peak_bytes', '各阶段 tracemalloc 峰值 (字节，开启内存追踪时记录)', BYTES_BUCKETS),
+        ('chromastack_job_wall_seconds', '整个任务的墙钟时间 (秒)', SECONDS_BUCKETS),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {metric: {} for metric, _, _ in self.METRICS}
+        self._buckets = {metric: buckets for metric, _, buckets in self.METRICS}
+
+    def _observe(self, metric, labels, value):
+        buckets = self._buckets[metric]
+        series = self._series[metric]
+        hist = series.get(labels)
+        if hist is None:
+            hist = series[labels] = _Histogram(len(buckets))
+        index = len(buckets)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                index = i
+                break
+        hist.counts[index] += 1
+        hist.sum += value
+        hist.count += 1
+
+    def observe(self, kind, recorder, job_seconds=None):
+        """记录一次运行的全部阶段"""
+        with self._lock:
+            for name, (count, wall, cpu, peak_bytes) in recorder.stages.items():
+                labels = (('kind', kind), ('stage', name))
+                self._observe('chromastack_stage_wall_seconds', labels, wall)
+                self._observe('chromastack_stage_cpu_seconds', labels, cpu)
+                if peak_bytes is not None:
+                    self._observe('chromastack_stage_peak_bytes', labels, float(peak_bytes))
+            if job_seconds is not None:
+                self._observe('chromastack_job_wall_seconds', (('kind', kind),), job_seconds)
+
+    def render(self):
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        lines = []
+        with self._lock:
+            for metric, help_text, buckets in self.METRICS:
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for labels, hist in sorted(self._series[metric].items()):
+                    label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float('inf'),), hist.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append(f'{metric}_bucket{{{label_text},le="{le}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{label_text}}} {hist.sum!r}')
+                    lines.append(f'{metric}_count{{{label_text}}} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内的直方图 (GUI 后端 /metrics)
+histograms = StageHistograms()
@@ -0,0 +1,1123 @@
+"""
+多标签层网格生成
+
+每一层只有一张标签图 (每个像素一个耗材槽位，-1 表示不打印)。
+原来的做法是每个槽位各生成一次二值掩码再 cv2.findContours，同一张图被扫描 N 次；
+这里一次性提取所有标签的像素边界，相邻标签之间的公共边只生成一次，再串成环，
+按连通区域组装成带孔多边形后统一拉伸。
+
+流程分为四个阶段，前三个阶段可以单独复用:
+    1. extract_boundary_edges  连通区域标记 + 有向边界边 (区域在边的左侧)
+    2. trace_rings             边串成环，去掉共线顶点
+    3. assemble_polygons       环按连通区域组装成带孔多边形 (外壳 + 孔洞)
+       (可选) simplify_polygons 按公共边界弧简化，断点由整个模型的像素柱决定 (ContourSimplifier)
+    4. extrude_polygons        earcut 三角化顶/底面 + 向量化侧壁，每个标签一个网格
+
+坐标约定与原来的 cv2 轮廓一致: 像素 (r, c) 的中心位于
+    x = c * pixel_size,  y = (H - 1 - r) * pixel_size
+多边形沿像素边缘走 (角点在 ±0.5 像素处)，相邻槽位之间没有缝隙，单像素也会被保留。
+
+mesh_layer_stack 在此之上把竖直方向连续的同槽位层合并为一段 (vertical_runs)，
+标签图按起始层组织，标签 = 槽位 * L + (段长 - 1)，每种段长按自己的高度拉伸。
+输入为区域图 + 区域层叠表 (region_stack.RegionStackMap) 时，段标签在区域表上计算后查表展开
+(region_layer_slabs)，不生成 (H, W, L) 体素。
+"""
+
+import hashlib
+
+import mapbox_earcut
+import numpy as np
+import shapely
+import trimesh
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from skimage.measure import label as label_components
+
+import instrumentation
+
+# 方向编码 (y 轴向上): 0:+x  1:+y  2:-x  3:-y，对应角点网格 (行 i 向下, 列 j) 的增量
+_DIR_DI = np.array([0, -1, 0, 1])
+_DIR_DJ = np.array([1, 0, -1, 0])
+
+# 轮廓简化的最大容差 (像素)，略小于 45° 台阶角点到弦的距离 √2/2
+MAX_SIMPLIFY_TOLERANCE = 0.7
+
+
+class BoundaryEdges:
+    """
+    一张标签图的有向边界边 (struct-of-arrays)
+        components:      (H, W) 连通区域编号 (4 邻接，0 为空)
+        component_label: (C+1,) 连通区域编号 -> 标签 (第 0 项无意义)
+        start:           (E,) 起点角点编号 i * (W + 1) + j
+        direction:       (E,) 方向编码
+        component:       (E,) 边左侧的连通区域编号
+    """
+    def __init__(self, shape, components, component_label, start, direction, component):
+        self.shape = shape
+        self.components = components
+        self.component_label = component_label
+        self.start = start
+        self.direction = direction
+        self.component = component
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def end(self):
+        W = self.shape[1]
+        return self.start + _DIR_DI[self.direction] * (W + 1) + _DIR_DJ[self.direction]
+
+
+class Rings:
+    """
+    串好的边界环 (struct-of-arrays)，第 k 个环的顶点为 vertices[offsets[k]:offsets[k+1]]
+        vertices:  (V, 2) 角点坐标 (i, j)
+        offsets:   (R+1,)
+        component: (R,) 环所属的连通区域
+        area:      (R,) 带符号面积 (像素²，y 轴向上时外壳为正、孔洞为负)
+    """
+    def __init__(self, vertices, offsets, component, area):
+        self.vertices = vertices
+        self.offsets = offsets
+        self.component = component
+        self.area = area
+
+    def __len__(self):
+        return len(self.component)
+
+
+def extract_boundary_edges(label_img):
+    """
+    阶段 1: 标记 4 邻接连通区域，并生成所有区域的有向边界边
+
+    Args:
+        label_img: (H, W) 整数标签图，负数表示空
+
+    Returns:
+        BoundaryEdges
+    """
+    label_img = np.asarray(label_img)
+    H, W = label_img.shape
+    labels = label_img.astype(np.int64) + 1
+    labels[label_img < 0] = 0
+    components = label_components(labels, background=0, connectivity=1)
+    num_components = int(components.max())
+
+    component_label = np.zeros(num_components + 1, dtype=np.int64)
+    component_label[components.ravel()] = labels.ravel() - 1
+
+    padded = np.pad(components, 1)
+    center = padded[1:-1, 1:-1]
+    solid = center > 0
+    # 每个像素的四条边 (逆时针环绕像素，区域在左侧): 下、右、上、左
+    sides = (
+        (padded[2:, 1:-1], 0, (1, 0)),    # 下边: (r+1, c) -> (r+1, c+1)
+        (padded[1:-1, 2:], 1, (1, 1)),    # 右边: (r+1, c+1) -> (r, c+1)
+        (padded[:-2, 1:-1], 2, (0, 1)),   # 上边: (r, c+1) -> (r, c)
+        (padded[1:-1, :-2], 3, (0, 0)),   # 左边: (r, c) -> (r+1, c)
+    )
+    starts, directions, owners = [], [], []
+    for neighbour, direction, (di, dj) in sides:
+        r, c = np.nonzero(solid & (neighbour != center))
+        starts.append((r + di) * (W + 1) + (c + dj))
+        directions.append(np.full(len(r), direction, dtype=np.int8))
+        owners.append(center[r, c])
+
+    return BoundaryEdges(
+        (H, W), components, component_label,
+        np.concatenate(starts).astype(np.int64),
+        np.concatenate(directions),
+        np.concatenate(owners).astype(np.int64),
+    )
+
+
+def _ring_order(next_edge):
+    """
+    由后继关系 (一个置换) 求每条边所在的环与环内序号
+
+    Returns:
+        ring: (E,) 环编号 (按环内最小边编号排序)
+        rank: (E,) 从环内最小编号的边开始走的步数
+    """
+    n = len(next_edge)
+    graph = sparse.csr_matrix((np.ones(n, dtype=np.int8), (np.arange(n), next_edge)), shape=(n, n))
+    _, ring = connected_components(graph, directed=True, connection='weak')
+    head = np.full(ring.max() + 1, n, dtype=np.int64)
+    np.minimum.at(head, ring, np.arange(n))
+    # 环按最小边编号排序，使结果与标记顺序无关
+    ring = np.argsort(np.argsort(head))[ring]
+    head = np.sort(head)
+
+    # 链表排名: 沿前驱指针倍增，环头指向自身
+    prev_edge = np.empty(n, dtype=np.int64)
+    prev_edge[next_edge] = np.arange(n)
+    is_head = np.zeros(n, dtype=bool)
+    is_head[head] = True
+    jump = np.where(is_head, np.arange(n), prev_edge)
+    rank = (~is_head).astype(np.int64)
+    while not np.all(is_head[jump]):
+        rank += rank[jump]
+        jump = jump[jump]
+    return ring, rank
+
+
+def trace_rings(edges, keep_corners=None):
+    """
+    阶段 2: 把有向边串成环
+
+    同一连通区域在某个角点对角接触自身时 (该角点有两条出边)，选择左转的出边，
+    使环紧贴当前像素，得到的环互不自交，只会在角点处相切。
+    keep_corners ((H+1)*(W+1) bool) 中的角点即使共线也保留 (轮廓简化的断点)。
+
+    Returns:
+        Rings
+    """
+    n = len(edges)
+    if n == 0:
+        return Rings(np.empty((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64),
+                     np.empty(0, dtype=np.int64), np.empty(0))
+
+    H, W = edges.shape
+    num_vertices = (H + 1) * (W + 1)
+    direction = edges.direction.astype(np.int64)
+
+    # 1. 后继边: 与本边终点相同起点、同一连通区域的边
+    start_key = edges.component * num_vertices + edges.start
+    order = np.argsort(start_key, kind='stable')
+    sorted_keys = start_key[order]
+    end_key = edges.component * num_vertices + edges.end
+    lo = np.searchsorted(sorted_keys, end_key, side='left')
+    hi = np.searchsorted(sorted_keys, end_key, side='right')
+    next_edge = order[lo]
+    pinch = np.flatnonzero(hi - lo > 1)
+    if len(pinch):
+        second = order[lo[pinch] + 1]
+        take_second = direction[second] == (direction[pinch] + 1) % 4
+        next_edge[pinch[take_second]] = second[take_second]
+
+    # 2. 环编号与环内序号
+    ring, rank = _ring_order(next_edge)
+    prev_edge = np.empty(n, dtype=np.int64)
+    prev_edge[next_edge] = np.arange(n)
+    order = np.lexsort((rank, ring))
+
+    # 3. 去掉共线顶点 (方向不变的角点)
+    keep = direction != direction[prev_edge]
+    if keep_corners is not None:
+        keep |= keep_corners[edges.start]
+    order = order[keep[order]]
+    ring_ids, offsets = np.unique(ring[order], return_index=True)
+    offsets = np.append(offsets, len(order)).astype(np.int64)
+    ring_component = edges.component[order[offsets[:-1]]]
+
+    start = edges.start[order]
+    vertices = np.stack([start // (W + 1), start % (W + 1)], axis=1)
+
+    # 4. 带符号面积 (y 向上: x = j, y = -i)
+    x = vertices[:, 1].astype(np.float64)
+    y = -vertices[:, 0].astype(np.float64)
+    ring_of_vertex = np.repeat(np.arange(len(ring_ids)), np.diff(offsets))
+    next_vertex = np.arange(len(order)) + 1
+    next_vertex[offsets[1:] - 1] = offsets[:-1]
+    cross = x * y[next_vertex] - x[next_vertex] * y
+    area = 0.5 * np.bincount(ring_of_vertex, weights=cross, minlength=len(ring_ids))
+
+    return Rings(vertices, offsets, ring_component, area)
+
+
+class PolygonSet:
+    """
+    带孔多边形集合 (struct-of-arrays)，角点坐标为整数网格 (i, j)
+        vertices:     (V, 2) 角点坐标
+        ring_offsets: (R+1,) 第 k 个环为 vertices[ring_offsets[k]:ring_offsets[k+1]]
+        poly_offsets: (P+1,) 第 p 个多边形为环 poly_offsets[p]..poly_offsets[p+1]-1，第一个环为外壳
+        poly_label:   (P,) 多边形的标签
+        shape:        标签图尺寸 (H, W)
+    外壳逆时针、孔洞顺时针 (y 轴向上)。
+    """
+    def __init__(self, vertices, ring_offsets, poly_offsets, poly_label, shape):
+        self.vertices = vertices
+        self.ring_offsets = ring_offsets
+        self.poly_offsets = poly_offsets
+        self.poly_label = poly_label
+        self.shape = shape
+
+    def __len__(self):
+        return len(self.poly_label)
+
+    def physical_vertices(self, pixel_size):
+        """角点 -> 物理坐标 (mm)，像素中心与原 cv2 轮廓坐标一致"""
+        H = self.shape[0]
+        x = (self.vertices[:, 1] - 0.5) * pixel_size
+        y = (H - 0.5 - self.vertices[:, 0]) * pixel_size
+        return np.stack([x, y], axis=1)
+
+
+def _ring_areas(vertices, offsets):
+    """每个环的带符号面积 (y 向上: x = j, y = -i)"""
+    if len(offsets) < 2:
+        return np.empty(0)
+    x = vertices[:, 1].astype(np.float64)
+    y = -vertices[:, 0].astype(np.float64)
+    ring_of_vertex = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    next_vertex = np.arange(len(vertices)) + 1
+    next_vertex[offsets[1:] - 1] = offsets[:-1]
+    cross = x * y[next_vertex] - x[next_vertex] * y
+    return 0.5 * np.bincount(ring_of_vertex, weights=cross, minlength=len(offsets) - 1)
+
+
+def _split_at_repeated_vertices(ring):
+    """把在角点处自相切的环拆成若干简单环"""
+    loops, stack, position = [], [], {}
+    for vertex in map(tuple, ring):
+        if vertex in position:
+            k = position[vertex]
+            loops.append(stack[k:])
+            for v in stack[k + 1:]:
+                del position[v]
+            stack = stack[:k + 1]
+        else:
+            position[vertex] = len(stack)
+            stack.append(vertex)
+    loops.append(stack)
+    return [np.array(loop, dtype=np.int64) for loop in loops if len(loop) >= 3]
+
+
+def assemble_polygons(edges, rings):
+    """
+    阶段 3: 把环按连通区域组装成带孔多边形
+
+    左转规则下，区域的外环可能在对角接触处经过同一角点两次 (自相切)，
+    先在重复角点处拆开: 拆出的负面积环即为与外壳点接触的孔洞。
+
+    Returns:
+        PolygonSet
+    """
+    H, W = edges.shape
+    vertices, offsets, component = rings.vertices, rings.offsets, rings.component
+
+    # 1. 拆分自相切的环
+    vertex_key = np.repeat(np.arange(len(rings)), np.diff(offsets)) * ((H + 1) * (W + 1)) \
+        + vertices[:, 0] * (W + 1) + vertices[:, 1]
+    sorted_key = np.sort(vertex_key)
+    repeated = sorted_key[1:][sorted_key[1:] == sorted_key[:-1]] // ((H + 1) * (W + 1))
+    if len(repeated):
+        bad = np.zeros(len(rings), dtype=bool)
+        bad[repeated] = True
+        new_rings, new_component = [], []
+        for r in range(len(rings)):
+            ring = vertices[offsets[r]:offsets[r + 1]]
+            parts = _split_at_repeated_vertices(ring) if bad[r] else [ring]
+            new_rings.extend(parts)
+            new_component.extend([component[r]] * len(parts))
+        vertices = np.concatenate(new_rings)
+        offsets = np.concatenate([[0], np.cumsum([len(ring) for ring in new_rings])]).astype(np.int64)
+        component = np.array(new_component, dtype=np.int64)
+    area = _ring_areas(vertices, offsets)
+
+    # 2. 每个连通区域: 外壳在前，孔洞在后
+    is_hole = area < 0
+    ring_order = np.lexsort((is_hole, component))
+    shells_per_component = np.bincount(component[~is_hole], minlength=int(component.max()) + 1 if len(component) else 1)
+    single = shells_per_component[component[ring_order]] == 1
+
+    simple_order = ring_order[single]
+    simple_component = component[simple_order]
+    sequences = [simple_order]
+    poly_starts = [np.flatnonzero(np.r_[True, simple_component[1:] != simple_component[:-1]])
+                   if len(simple_order) else np.empty(0, dtype=np.int64)]
+
+    # 一个连通区域有多个外壳 (拆分后出现) 时，按包含关系分配孔洞
+    multi_order = ring_order[~single]
+    count = len(simple_order)
+    for comp in np.unique(component[multi_order]):
+        ids = multi_order[component[multi_order] == comp]
+        shells = [r for r in ids if not is_hole[r]]
+        holes = [r for r in ids if is_hole[r]]
+        shell_geoms = [shapely.Polygon(vertices[offsets[r]:offsets[r + 1]][:, ::-1]) for r in shells]
+        groups = [[r] for r in shells]
+        for hole in holes:
+            probe = shapely.Polygon(vertices[offsets[hole]:offsets[hole + 1]][:, ::-1]).representative_point()
+            owner = next((k for k, geom in enumerate(shell_geoms) if geom.covers(probe)), 0)
+            groups[owner].append(hole)
+        for group in groups:
+            sequences.append(np.array(group, dtype=np.int64))
+            poly_starts.append(np.array([count], dtype=np.int64))
+            count += len(group)
+
+    # 3. 按多边形顺序重排环
+    ring_sequence = np.concatenate(sequences).astype(np.int64)
+    poly_offsets = np.append(np.concatenate(poly_starts), len(ring_sequence)).astype(np.int64)
+    poly_component = component[ring_sequence[poly_offsets[:-1]]]
+    lengths = np.diff(offsets)[ring_sequence]
+    gather = np.repeat(offsets[:-1][ring_sequence] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) \
+        + np.arange(lengths.sum())
+    return PolygonSet(
+        vertices[gather],
+        np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        poly_offsets,
+        edges.component_label[poly_component],
+        (H, W),
+    )
+
+
+def to_shapely(polygon_set, pixel_size):
+    """
+    PolygonSet -> shapely Polygon 数组 (物理坐标，单位 mm)
+
+    Returns:
+        dict: 标签 -> Polygon 列表
+    """
+    coords = polygon_set.physical_vertices(pixel_size)
+    ring_index = np.repeat(np.arange(len(polygon_set.ring_offsets) - 1), np.diff(polygon_set.ring_offsets))
+    rings = shapely.linearrings(coords, indices=ring_index)
+    poly_index = np.repeat(np.arange(len(polygon_set)), np.diff(polygon_set.poly_offsets))
+    polygons = shapely.polygons(rings, indices=poly_index)
+    result = {}
+    for label in np.unique(polygon_set.poly_label):
+        result[int(label)] = list(polygons[polygon_set.poly_label == label])
+    return result
+
+
+def label_polygons(label_img, keep_corners=None):
+    """阶段 1-3 的组合: 标签图 -> PolygonSet"""
+    edges = extract_boundary_edges(label_img)
+    return assemble_polygons(edges, trace_rings(edges, keep_corners))
+
+
+def boundary_vertex_count(label_img):
+    """
+    不追踪边界，直接按角点统计 label_polygons 产生的顶点数 (不简化时)
+    角点周围 4 个像素中，某标签占 1 或 3 个象限时其边界在此转折一次，占对角 2 个象限时转折两次。
+    拉伸后每个顶点约对应 4 个三角形 (侧壁 2 个 + 顶/底面各 1 个)。
+    """
+    padded = np.pad(np.asarray(label_img), 1, constant_values=-1)
+    quadrants = (padded[:-1, :-1], padded[:-1, 1:], padded[1:, 1:], padded[1:, :-1])   # 顺时针
+    total = 0
+    for k, q in enumerate(quadrants):
+        same = [q == other for other in quadrants]
+        count = sum(same[m].astype(np.int8) for m in range(4))
+        adjacent = same[(k + 1) % 4] | same[(k + 3) % 4]
+        # 每个象限的份额 (乘 3 取整): 单独 1 -> 3，L 形 3 个 -> 各 1，对角 2 个 -> 各 3
+        share = np.where(count == 1, 3, 0) + np.where(count == 3, 1, 0) + np.where((count == 2) & ~adjacent, 3, 0)
+        total += int(share[q >= 0].sum())
+    return total // 3
+
+
+def fixed_corners(columns):
+    """
+    轮廓简化的断点: 周围 4 个像素中至少 3 条像素边两侧不同的角点 (3 种以上像素柱相交或对角接触)
+
+    columns 为 (H, W) 或 (H, W, L) 的像素柱标识，整柱相同即视为相同，-1 表示空。
+    任意一张由像素柱决定的标签图中，相邻两个断点之间的边界两侧像素柱不变，
+    因此按断点切成的边界弧在所有层、所有槽位之间一致，每段弧只会被简化成同一种形状。
+
+    Returns:
+        (H+1, W+1) bool
+    """
+    columns = np.asarray(columns)
+    pad = [(1, 1), (1, 1)] + [(0, 0)] * (columns.ndim - 2)
+    padded = np.pad(columns, pad, constant_values=-1)
+
+    def differs(a, b):
+        diff = a != b
+        return diff.any(axis=tuple(range(2, diff.ndim))) if diff.ndim > 2 else diff
+
+    tl, tr, br, bl = padded[:-1, :-1], padded[:-1, 1:], padded[1:, 1:], padded[1:, :-1]
+    sides = (differs(tl, tr).astype(np.int8) + differs(tr, br) + differs(br, bl) + differs(bl, tl))
+    return sides >= 3
+
+
+def _turn_cross(coords, ring_offsets):
+    """每个顶点处前后两条边的叉积 (与环的朝向同号时为凸角)"""
+    first, last = ring_offsets[:-1], ring_offsets[1:] - 1
+    nonempty = last >= first
+    first, last = first[nonempty], last[nonempty]
+    prev = np.arange(len(coords)) - 1
+    prev[first] = last
+    nxt = np.arange(len(coords)) + 1
+    nxt[last] = first
+    a, b = coords - coords[prev], coords[nxt] - coords
+    return a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+
+
+def simplify_polygons(polygon_set, fixed, tolerance):
+    """
+    按公共边界弧做 Douglas-Peucker 简化 (只删除顶点，保留的顶点仍在整数网格上)
+
+    每个环在断点处切成弧 (没有断点的环取编号最小的角点)，弧统一成规范方向后再简化，
+    同一段弧在相邻两个区域 (以及其他层的标签图) 中得到相同的结果，区域之间不会产生缝隙。
+    闭合弧先在离起点最远的顶点处切开；简化后不足 3 个顶点的环保持原样。
+
+    Args:
+        polygon_set: PolygonSet (label_polygons 需传入 keep_corners=fixed)
+        fixed: (H+1, W+1) bool 断点
+        tolerance (float): 允许偏离原边界的距离 (像素)
+
+    Returns:
+        tuple: (简化后的 PolygonSet, (V,) bool 被删除的原顶点)
+    """
+    vertices, ring_offsets = polygon_set.vertices, polygon_set.ring_offsets
+    V, R = len(vertices), len(ring_offsets) - 1
+    removed = np.zeros(V, dtype=bool)
+    if V == 0 or tolerance <= 0:
+        return polygon_set, removed
+
+    W1 = polygon_set.shape[1] + 1
+    key = vertices[:, 0] * W1 + vertices[:, 1]
+    ring_len = np.diff(ring_offsets)
+    ring_of = np.repeat(np.arange(R), ring_len)
+    pos = np.arange(V) - ring_offsets[ring_of]
+
+    # 1. 断点: 固定角点；没有断点的环取编号最小的角点
+    brk = fixed.ravel()[key]
+    no_break = np.add.reduceat(brk.astype(np.int64), ring_offsets[:-1]) == 0
+    if np.any(no_break):
+        order = np.lexsort((key, ring_of))
+        ring_first = order[np.r_[True, ring_of[order][1:] != ring_of[order][:-1]]]
+        brk[ring_first[no_break[ring_of[ring_first]]]] = True
+
+    # 2. 每个环旋转到以断点开头，按断点切成弧 (弧的点 = 自身顶点 + 下一个断点)
+    first_break = np.full(R, V, dtype=np.int64)
+    np.minimum.at(first_break, ring_of[brk], pos[brk])
+    seq = ring_offsets[ring_of] + (pos + first_break[ring_of]) % ring_len[ring_of]
+    arc_start = np.flatnonzero(brk[seq])
+    arc_len = np.diff(np.append(arc_start, V))
+    arc_ring = ring_of[arc_start]
+    last_in_ring = np.r_[arc_ring[1:] != arc_ring[:-1], True]
+    end_index = np.where(last_in_ring, ring_offsets[arc_ring], np.append(arc_start[1:], 0))
+
+    A = len(arc_start)
+    n = arc_len + 1
+    offs = np.concatenate([[0], np.cumsum(n)])
+    arc_of = np.repeat(np.arange(A), n)
+    local = np.arange(offs[-1]) - offs[arc_of]
+    points = np.where(local < arc_len[arc_of], seq[np.minimum(arc_start[arc_of] + local, V - 1)],
+                      seq[end_index[arc_of]])
+
+    # 3. 规范方向: 起点编号小于终点；闭合弧比较第二个点与倒数第二个点
+    k_first, k_last = key[points[offs[:-1]]], key[points[offs[1:] - 1]]
+    loop = k_first == k_last
+    second = key[points[offs[:-1] + np.minimum(1, n - 1)]]
+    second_last = key[points[np.maximum(offs[1:] - 2, offs[:-1])]]
+    reverse = np.where(loop, second > second_last, k_first > k_last)
+    canon = points[offs[arc_of] + np.where(reverse[arc_of], n[arc_of] - 1 - local, local)]
+
+    # 4. Douglas-Peucker (所有弧同时迭代)
+    xy = vertices[canon].astype(np.float64)
+    kept = np.zeros(len(canon), dtype=bool)
+    kept[offs[:-1]] = True
+    kept[offs[1:] - 1] = True
+    index = np.arange(len(canon))
+    if np.any(loop):
+        d = np.hypot(*(xy - xy[offs[arc_of]]).T)
+        d[~loop[arc_of]] = -1
+        far = np.lexsort((index, -d, arc_of))
+        far = far[np.r_[True, arc_of[far][1:] != arc_of[far][:-1]]]
+        kept[far[loop[arc_of[far]]]] = True
+    while True:
+        prev_kept = np.maximum.accumulate(np.where(kept, index, 0))
+        next_kept = np.minimum.accumulate(np.where(kept, index, len(index) - 1)[::-1])[::-1]
+        a, b = xy[prev_kept], xy[next_kept]
+        ab = b - a
+        length = np.hypot(ab[:, 0], ab[:, 1])
+        cross = np.abs(ab[:, 0] * (xy[:, 1] - a[:, 1]) - ab[:, 1] * (xy[:, 0] - a[:, 0]))
+        dist = np.where(length > 0, cross / np.maximum(length, 1e-12), np.hypot(*(xy - a).T))
+        candidate = np.flatnonzero(~kept & (dist > tolerance))
+        if len(candidate) == 0:
+            break
+        order = candidate[np.lexsort((candidate, -dist[candidate], prev_kept[candidate]))]
+        first = np.r_[True, prev_kept[order][1:] != prev_kept[order][:-1]]
+        kept[order[first]] = True
+
+    # 5. 映射回原顶点，去掉共线的断点 (earcut 会丢弃共线点，留着会使顶/底面与侧壁对不上)；
+    #    简化后不足 3 个顶点的环保持原样
+    keep_vertex = brk.copy()
+    keep_vertex[canon[kept]] = True
+    for _ in range(4):
+        ids = np.flatnonzero(keep_vertex)
+        kept_offsets = np.concatenate([[0], np.cumsum(np.bincount(ring_of[ids], minlength=R))])
+        collinear = _turn_cross(vertices[ids], kept_offsets) == 0
+        if not np.any(collinear):
+            break
+        keep_vertex[ids[collinear]] = False
+    degenerate = np.bincount(ring_of[keep_vertex], minlength=R) < 3
+    keep_vertex |= degenerate[ring_of]
+    new_len = np.bincount(ring_of[keep_vertex], minlength=R)
+    simplified = PolygonSet(
+        vertices[keep_vertex],
+        np.concatenate([[0], np.cumsum(new_len)]).astype(np.int64),
+        polygon_set.poly_offsets,
+        polygon_set.poly_label,
+        polygon_set.shape,
+    )
+    return simplified, ~keep_vertex
+
+
+class ContourSimplifier:
+    """
+    轮廓简化参数: 断点 (由整个模型的像素柱决定) + 容差 (像素)
+    同一个模型的所有标签图 (各起始层、底座) 共用一个实例，简化结果在层与层、槽位与槽位之间一致。
+    容差不超过 MAX_SIMPLIFY_TOLERANCE: 更大时 45° 台阶也会被拉直，相距一个像素的相邻弧可能交叉。
+    """
+
+    def __init__(self, columns, tolerance):
+        self.fixed = fixed_corners(columns)
+        self.tolerance = min(float(tolerance), MAX_SIMPLIFY_TOLERANCE)
+        digest = hashlib.blake2b(np.packbits(self.fixed).tobytes(), digest_size=16)
+        digest.update(repr((self.fixed.shape, self.tolerance)).encode())
+        self.key = digest.hexdigest()
+
+    def polygons(self, label_img, num_labels):
+        """
+        标签图 -> 简化后的 PolygonSet
+
+        Returns:
+            tuple: (PolygonSet, (num_labels,) 每个标签比不简化时少的顶点数)
+        """
+        polygon_set = label_polygons(label_img, keep_corners=self.fixed.ravel())
+        simplified, _ = simplify_polygons(polygon_set, self.fixed, self.tolerance)
+        # 共线的断点在不简化时本来就不存在，不计入原顶点数
+        turning = _turn_cross(polygon_set.vertices, polygon_set.ring_offsets) != 0
+        before = np.bincount(_vertex_labels(polygon_set)[turning], minlength=num_labels)
+        after = np.bincount(_vertex_labels(simplified), minlength=num_labels)
+        return simplified, (before - after)[:num_labels]
+
+
+def _vertex_labels(polygon_set):
+    """每个顶点所属多边形的标签"""
+    ring_label = np.repeat(polygon_set.poly_label, np.diff(polygon_set.poly_offsets))
+    return np.repeat(ring_label, np.diff(polygon_set.ring_offsets))
+
+
+def _cap_triangles(polygon_set):
+    """
+    顶/底面三角形 (全局顶点编号，逆时针)
+    无孔的四边形 (单像素、矩形色块) 直接拆成两个三角形，其余多边形调用 earcut
+    """
+    ring_offsets, poly_offsets = polygon_set.ring_offsets, polygon_set.poly_offsets
+    first_ring = poly_offsets[:-1]
+    ring_count = np.diff(poly_offsets)
+    start = ring_offsets[first_ring]
+    vertex_count = ring_offsets[poly_offsets[1:]] - start
+
+    quad = (ring_count == 1) & (vertex_count == 4)
+    grid = np.stack([polygon_set.vertices[:, 1], -polygon_set.vertices[:, 0]], axis=1).astype(np.int64)
+    if np.any(quad):
+        # 简化后的四边形可能是凹的，只有凸四边形走快速路径
+        turn = _turn_cross(grid, ring_offsets)
+        corner = start[quad][:, None] + np.arange(4)
+        quad[quad] = np.all(turn[corner] > 0, axis=1)
+    q = start[quad]
+    triangles = [np.stack([q, q + 1, q + 2], axis=1), np.stack([q, q + 2, q + 3], axis=1)]
+
+    for p in np.flatnonzero(~quad):
+        v0, v1 = start[p], start[p] + vertex_count[p]
+        ring_ends = ring_offsets[first_ring[p] + 1:poly_offsets[p + 1] + 1] - v0
+        local = mapbox_earcut.triangulate_int64(grid[v0:v1], ring_ends.astype(np.uint32))
+        triangles.append(local.reshape(-1, 3).astype(np.int64) + v0)
+
+    triangles = np.concatenate(triangles) if triangles else np.empty((0, 3), dtype=np.int64)
+    # earcut 不保证朝向，统一为逆时针
+    a, b, c = grid[triangles[:, 0]], grid[triangles[:, 1]], grid[triangles[:, 2]]
+    cross = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    flip = cross < 0
+    triangles[flip] = triangles[flip][:, ::-1]
+    return _split_t_junctions(polygon_set, grid, triangles[cross != 0])
+
+
+def _ring_neighbours(ring_offsets, n):
+    """每个顶点在环内的前一个、后一个顶点"""
+    prev_vertex = np.arange(n) - 1
+    next_vertex = np.arange(n) + 1
+    prev_vertex[ring_offsets[:-1]] = ring_offsets[1:] - 1
+    next_vertex[ring_offsets[1:] - 1] = ring_offsets[:-1]
+    return prev_vertex, next_vertex
+
+
+def _coincident_copies(polygon_set, grid):
+    """
+    同一多边形中坐标相同的顶点拷贝 (环在角点处相切时出现)
+
+    Returns:
+        tuple: (group_of (V,) 拷贝组编号, order (V,) 按组连续排列的顶点, group_size 每组的拷贝数)
+    """
+    ring_offsets, poly_offsets = polygon_set.ring_offsets, polygon_set.poly_offsets
+    poly_of_vertex = np.repeat(np.repeat(np.arange(len(polygon_set)), np.diff(poly_offsets)), np.diff(ring_offsets))
+    order = np.lexsort((grid[:, 1], grid[:, 0], poly_of_vertex))
+    same = np.all(grid[order[1:]] == grid[order[:-1]], axis=1) & (poly_of_vertex[order[1:]] == poly_of_vertex[order[:-1]])
+    group_of = np.empty(len(grid), dtype=np.int64)
+    group_of[order] = np.cumsum(np.r_[True, ~same]) - 1
+    return group_of, order, np.bincount(group_of)
+
+
+def _expand_pairs(group, group_start, group_size):
+    """每个元素 x 所在组的每个成员: (元素序号, 成员在按组排列的数组中的位置)"""
+    size = group_size[group]
+    owner = np.repeat(np.arange(len(group)), size)
+    local = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+    return owner, group_start[group][owner] + local
+
+
+def _sorted_contains(sorted_keys, query):
+    """query 中的每个值是否出现在升序数组 sorted_keys 中"""
+    index = np.minimum(np.searchsorted(sorted_keys, query), max(len(sorted_keys) - 1, 0))
+    return (sorted_keys[index] == query) if len(sorted_keys) else np.zeros(np.shape(query), dtype=bool)
+
+
+def _split_t_junctions(polygon_set, grid, triangles):
+    """
+    孔洞的桥接线与边界共线时，earcut 可能让某个顶点落在三角形边的中间 (T 型接点)，
+    顶/底面的边与侧壁、与相邻三角形对不上。在这些顶点处把三角形一分为二，
+    直到每条边界边都是某个三角形的边、每条内部边都被两个三角形共用。
+    """
+    n = len(grid)
+    if len(triangles) == 0:
+        return triangles
+    group_of, order, group_size = _coincident_copies(polygon_set, grid)
+    first_copy = order[np.r_[0, np.cumsum(group_size)[:-1]]]
+    canon = first_copy[group_of]
+    _, next_vertex = _ring_neighbours(polygon_set.ring_offsets, n)
+    boundary_key = np.unique(canon * n + canon[next_vertex])
+    poly_of_vertex = np.repeat(np.repeat(np.arange(len(polygon_set)), np.diff(polygon_set.poly_offsets)),
+                               np.diff(polygon_set.ring_offsets))
+
+    def unmatched_edges(tris, boundary):
+        u, v = canon[tris], canon[np.roll(tris, -1, axis=1)]
+        cap_key = np.sort((u * n + v).ravel())
+        matched = _sorted_contains(boundary, u * n + v) | _sorted_contains(cap_key, v * n + u)
+        return u, v, ~matched, boundary[~_sorted_contains(cap_key, boundary)]
+
+    u, v, unmatched, open_boundary = unmatched_edges(triangles, boundary_key)
+    if not np.any(unmatched):
+        return triangles
+    # 只在出现 T 型接点的多边形内迭代
+    affected = np.zeros(len(polygon_set), dtype=bool)
+    affected[poly_of_vertex[triangles[np.any(unmatched, axis=1), 0]]] = True
+    affected[poly_of_vertex[open_boundary // n]] = True
+    local = affected[poly_of_vertex[triangles[:, 0]]]
+    done, triangles = triangles[~local], triangles[local]
+    boundary_key = boundary_key[affected[poly_of_vertex[boundary_key // n]]]
+
+    while True:
+        u, v, unmatched, open_boundary = unmatched_edges(triangles, boundary_key)
+        if not np.any(unmatched):
+            break
+
+        # T 型接点必然是同一直线上另一条没对上的三角形边或边界边的端点:
+        # 所有没对上的线段按 (多边形, 所在直线) 分组，端点按沿直线的位置排序后二分查找
+        tri, k = np.nonzero(unmatched)
+        seg_a = np.concatenate([u[tri, k], open_boundary // n])
+        seg_b = np.concatenate([v[tri, k], open_boundary % n])
+        d = grid[seg_b] - grid[seg_a]
+        d //= np.gcd(d[:, 0], d[:, 1])[:, None]
+        d[(d[:, 0] < 0) | ((d[:, 0] == 0) & (d[:, 1] < 0))] *= -1
+        offset = d[:, 0] * grid[seg_a, 1] - d[:, 1] * grid[seg_a, 0]
+        _, line = np.unique(np.stack([poly_of_vertex[seg_a], d[:, 0], d[:, 1], offset], axis=1),
+                            axis=0, return_inverse=True)
+        line = line.ravel()
+        reach = int(np.abs(grid).sum(axis=1).max() * np.abs(d).max())
+        pos_a = (grid[seg_a] * d).sum(axis=1) + reach
+        pos_b = (grid[seg_b] * d).sum(axis=1) + reach
+        span = 2 * reach + 1
+        point_key = np.concatenate([line * span + pos_a, line * span + pos_b])
+        point_vertex = np.concatenate([seg_a, seg_b])
+        point_order = np.argsort(point_key, kind='stable')
+        point_key, point_vertex = point_key[point_order], point_vertex[point_order]
+        distinct = np.r_[True, point_key[1:] != point_key[:-1]]
+        point_key, point_vertex = point_key[distinct], point_vertex[distinct]
+
+        edge_line = line[:len(tri)]
+        forward = pos_a[:len(tri)] < pos_b[:len(tri)]
+        lo = edge_line * span + np.minimum(pos_a, pos_b)[:len(tri)]
+        hi = edge_line * span + np.maximum(pos_a, pos_b)[:len(tri)]
+        inner = np.searchsorted(point_key, lo, side='right')
+        count = np.searchsorted(point_key, hi, side='left') - inner
+        hit = np.flatnonzero(count > 0)
+        if len(hit) == 0:
+            break
+        # 每个三角形每轮只拆一条边: 边上的全部接点与对角顶点连成扇形
+        hit = hit[np.unique(tri[hit], return_index=True)[1]]
+        t, corner, count = tri[hit], k[hit], count[hit]
+        first = triangles[t, corner]
+        second = triangles[t, (corner + 1) % 3]
+        third = triangles[t, (corner + 2) % 3]
+        fan = np.repeat(np.arange(len(hit)), count + 1)
+        step = np.arange(len(fan)) - np.repeat(np.cumsum(count + 1) - (count + 1), count + 1)
+        inner, count, forward = inner[hit][fan], count[fan], forward[hit][fan]
+
+        def junction(j):
+            """沿边方向的第 j 个接点 (1..count)"""
+            index = np.where(forward, inner + j - 1, inner + count - j)
+            return point_vertex[np.clip(index, 0, len(point_vertex) - 1)]
+
+        start = np.where(step == 0, first[fan], junction(step))
+        end = np.where(step == count, second[fan], junction(step + 1))
+        keep = np.ones(len(triangles), dtype=bool)
+        keep[t] = False
+        triangles = np.concatenate([triangles[keep], np.stack([start, end, third[fan]], axis=1)])
+    return np.concatenate([done, triangles])
+
+
+def _pinch_wedges(polygon_set, caps):
+    """
+    环在角点处相切 (孔洞与外壳、孔洞与孔洞点接触) 时，同一多边形在该角点有多份顶点拷贝，
+    每份拷贝只属于自己的环，而区域在该角点被分成几个扇区，每个扇区由一个环的出边和另一个环的入边围成。
+    这里改为每个扇区一份拷贝: 出边的起点保持不变，入边的终点改用逆时针方向紧邻的那条出边的拷贝，
+    顶/底面三角形按重心方向所在的扇区选用拷贝，侧壁的竖直边与顶/底面的每条边都恰好被两个面共用。
+
+    Args:
+        polygon_set: PolygonSet
+        caps: (T, 3) _cap_triangles 的结果
+
+    Returns:
+        tuple: (修正后的 caps, (V,) 以该顶点为终点的边应使用的拷贝，不相切的角点为自身)
+    """
+    n = len(polygon_set.vertices)
+    in_copy = np.arange(n)
+    grid = np.stack([polygon_set.vertices[:, 1], -polygon_set.vertices[:, 0]], axis=1).astype(np.int64)
+    group_of, order, group_size = _coincident_copies(polygon_set, grid)
+    if np.all(group_size == 1):
+        return caps, in_copy
+
+    # 1. 相切角点的拷贝 (按组连续排列)
+    pinch = group_size[group_of[order]] > 1
+    members = order[pinch]
+    member_group = group_of[members]
+    starts = np.flatnonzero(np.r_[True, member_group[1:] != member_group[:-1]])
+    group_start = np.full(len(group_size), -1, dtype=np.int64)
+    group_start[member_group[starts]] = starts
+    prev_vertex, next_vertex = _ring_neighbours(polygon_set.ring_offsets, n)
+    d_out = grid[next_vertex] - grid
+    d_in = grid[prev_vertex] - grid
+
+    # 2. 扇区: 从拷贝 b 的出边逆时针转到的第一条入边 (反向) 属于拷贝 closer[b]
+    owner, position = _expand_pairs(member_group, group_start, group_size)
+    b, other = members[owner], members[position]
+    out_angle = np.arctan2(d_out[b, 1], d_out[b, 0])
+    in_angle = np.arctan2(d_in[other, 1], d_in[other, 0])
+    sweep = np.mod(in_angle - out_angle, 2 * np.pi)
+    first = np.lexsort((sweep, owner))
+    first = first[np.r_[True, owner[first][1:] != owner[first][:-1]]]
+    closer = np.arange(n)
+    closer[b[first]] = other[first]
+    in_copy[closer[members]] = members
+
+    # 3. 顶/底面: 重心方向落在扇区 (出边, 入边) 内的拷贝
+    corner = np.flatnonzero(group_size[group_of[caps.ravel()]] > 1)
+    if len(corner):
+        tri, slot = corner // 3, corner % 3
+        owner, position = _expand_pairs(group_of[caps[tri, slot]], group_start, group_size)
+        copy = members[position]
+        d = grid[caps[tri[owner]]].sum(axis=1) - 3 * grid[copy]
+        lo, hi = d_out[copy], d_in[closer[copy]]
+
+        def cross(p, q):
+            return p[:, 0] * q[:, 1] - p[:, 1] * q[:, 0]
+
+        after_out, before_in = cross(lo, d) > 0, cross(d, hi) > 0
+        inside = np.where(cross(lo, hi) > 0, after_out & before_in, after_out | before_in)
+        hit = np.flatnonzero(inside)
+        hit = hit[np.r_[True, owner[hit][1:] != owner[hit][:-1]]]
+        caps = caps.copy()
+        caps[tri[owner[hit]], slot[owner[hit]]] = copy[hit]
+    return caps, in_copy
+
+
+def extrude_polygons(polygon_set, num_labels, height, z_start, pixel_size):
+    """
+    阶段 4: 拉伸全部多边形，每个标签生成一个网格
+    每个多边形的顶/底面与侧壁共用顶点；环在角点处相切时该角点按扇区各用一份拷贝 (_pinch_wedges)，
+    earcut 产生的 T 型接点先被拆开 (_split_t_junctions)，每条边恰好被两个面共用，每个网格都是封闭的。
+    height 可以是标量，也可以是长度为 num_labels 的数组 (每个标签各自的拉伸高度)。
+
+    Returns:
+        list: 每个标签的 trimesh.Trimesh，没有区域的标签为 None
+    """
+    meshes = [None] * num_labels
+    if len(polygon_set) == 0:
+        return meshes
+
+    ring_offsets = polygon_set.ring_offsets
+    poly_of_vertex = np.repeat(np.repeat(np.arange(len(polygon_set)), np.diff(polygon_set.poly_offsets)),
+                               np.diff(ring_offsets))
+    vertex_label = polygon_set.poly_label[poly_of_vertex]
+
+    xy = polygon_set.physical_vertices(pixel_size)
+    n = len(xy)
+    height = np.asarray(height, dtype=np.float64)
+    vertices = np.empty((2 * n, 3))
+    vertices[:n, :2] = xy
+    vertices[:n, 2] = z_start
+    vertices[n:, :2] = xy
+    vertices[n:, 2] = z_start + (height[np.clip(vertex_label, 0, num_labels - 1)] if height.ndim else height)
+
+    # 侧壁: 区域在边的左侧，外法线朝右
+    a = np.arange(n)
+    b = a + 1
+    b[ring_offsets[1:] - 1] = ring_offsets[:-1]
+    caps, in_copy = _pinch_wedges(polygon_set, _cap_triangles(polygon_set))
+    b = in_copy[b]
+    walls = np.concatenate([np.stack([a, b, b + n], axis=1), np.stack([a, b + n, a + n], axis=1)])
+
+    faces = np.concatenate([caps + n, caps[:, ::-1], walls])
+
+    # 按标签拆分
+    face_label = vertex_label[faces[:, 0] % n]
+    for label in np.unique(vertex_label):
+        if not 0 <= label < num_labels:
+            continue
+        keep = np.flatnonzero(vertex_label == label)
+        remap = np.full(2 * n, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        remap[keep + n] = np.arange(len(keep)) + len(keep)
+        label_vertices = np.concatenate([vertices[keep], vertices[keep + n]])
+        label_faces = remap[faces[face_label == label]]
+        meshes[label] = trimesh.Trimesh(vertices=label_vertices, faces=label_faces, process=False)
+    return meshes
+
+
+def extrude_label_image(label_img, num_labels, height, z_start, pixel_size, simplifier=None):
+    """
+    一次性拉伸一张标签图中所有标签的区域
+
+    Args:
+        label_img: (H, W) 整数标签图，负数表示空
+        num_labels (int): 标签数量 (0 .. num_labels-1)
+        height (float | array): 拉伸高度 (mm)，或每个标签的高度
+        z_start (float): 底面 Z 坐标 (mm)
+        pixel_size (float): 像素尺寸 (mm)
+        simplifier (ContourSimplifier): 轮廓简化，None 表示保留像素台阶；
+            简化时每个网格的 metadata['simplified_vertices'] 记录删除的顶点数
+
+    Returns:
+        list: 每个标签的 trimesh.Trimesh，没有区域的标签为 None
+    """
+    with instrumentation.stage('contour'):
+        if simplifier is None:
+            polygon_set, removed = label_polygons(label_img), None
+        else:
+            polygon_set, removed = simplifier.polygons(label_img, num_labels)
+    with instrumentation.stage('extrude'):
+        meshes = extrude_polygons(polygon_set, num_labels, height, z_start, pixel_size)
+    if removed is None:
+        return meshes
+    for label, mesh in enumerate(meshes):
+        if mesh is not None:
+            mesh.metadata['simplified_vertices'] = int(removed[label])
+    return meshes
+
+
+def slab_key(label_img, num_labels, height, pixel_size):
+    """切片缓存键: 标签图内容哈希 + 拉伸参数 (与 Z 位置无关)"""
+    label_img = np.ascontiguousarray(label_img)
+    digest = hashlib.blake2b(label_img.tobytes(), digest_size=16)
+    digest.update(repr((label_img.shape, label_img.dtype.str)).encode())
+    digest.update(np.asarray(height, dtype=np.float64).tobytes())
+    return digest.hexdigest(), int(num_labels), float(pixel_size)
+
+
+def translate_slab(mesh, dz):
+    """
+    平移得到切片的一个副本，面索引数组直接共用；metadata (轮廓简化统计) 随副本复制
+    """
+    placed = trimesh.Trimesh(vertices=mesh.vertices + [0.0, 0.0, dz], faces=mesh.faces, process=False)
+    placed.metadata.update(mesh.metadata)
+    return placed
+
+
+class SlabCache:
+    """
+    拉伸切片缓存: 按 (标签图哈希, 拉伸高度) 缓存 z=0 处的网格，重复出现的层只做平移。
+    双面模型的背面与正面由相同的标签图组成，两面共用一个缓存时背面几乎不再计算。
+    simplifier 不为 None 时所有切片都经过轮廓简化 (一个缓存只对应一种简化参数)。
+    """
+
+    def __init__(self, simplifier=None):
+        self._slabs = {}
+        self.simplifier = simplifier
+        self.hits = 0
+        self.misses = 0
+
+    def slabs(self, label_img, num_labels, height, pixel_size):
+        """底面位于 z=0 的各标签网格 (缓存中的原件，调用方不要修改)"""
+        key = slab_key(label_img, num_labels, height, pixel_size)
+        slabs = self._slabs.get(key)
+        if slabs is None:
+            self.misses += 1
+            slabs = extrude_label_image(label_img, num_labels, height, 0.0, pixel_size, self.simplifier)
+            self._slabs[key] = slabs
+        else:
+            self.hits += 1
+        return slabs
+
+    def extrude(self, label_img, num_labels, height, z_start, pixel_size):
+        """与 extrude_label_image 相同，命中缓存时只平移"""
+        return [None if mesh is None else translate_slab(mesh, z_start)
+                for mesh in self.slabs(label_img, num_labels, height, pixel_size)]
+
+
+def stack_volume(stack_codes_matrix, solid_mask_2d, codec, reverse_layers=False):
+    """层叠编码 -> (H, W, L) int16 槽位体素，-1 表示不打印；reverse_layers 为背面的倒序层"""
+    L = codec.total_layers
+    volume = np.empty(solid_mask_2d.shape + (L,), dtype=np.int16)
+    for layer_idx in range(L):
+        source_layer = L - 1 - layer_idx if reverse_layers else layer_idx
+        volume[..., layer_idx] = codec.layer_slots(stack_codes_matrix, source_layer)
+    volume[~solid_mask_2d] = -1
+    return volume
+
+
+def start_layer_runs(volume, start_layer):
+    """
+    在 start_layer 开始的竖直同色段
+
+    同一像素连续若干层使用同一槽位时合并为一段，整段只拉伸一次。
+    在该层开始一段的像素标签为 slot * L + (段长 - 1)，其余为 -1。
+
+    Args:
+        volume: (H, W, L) 槽位体素 (stack_volume，-1 表示不打印)
+        start_layer (int): 起始层
+
+    Returns:
+        (H, W) int32 标签图
+    """
+    L = volume.shape[2]
+    slots = volume[..., start_layer].astype(np.int32)
+    starts = slots >= 0
+    if start_layer > 0:
+        starts &= volume[..., start_layer - 1] != slots
+    # 向上累计段长，所有段都结束后提前退出
+    run_length = np.zeros(slots.shape, dtype=np.int32)
+    same = starts.copy()
+    for layer_idx in range(start_layer + 1, L):
+        same &= volume[..., layer_idx] == slots
+        if not same.any():
+            break
+        run_length += same
+    return np.where(starts, slots * L + run_length, -1)
+
+
+def vertical_runs(stack_codes_matrix, solid_mask_2d, codec):
+    """
+    按起始层拆分的竖直同色段 (见 start_layer_runs)
+    标签图只取决于层叠编码本身，与正反面无关。
+
+    Returns:
+        list: L 张 (H, W) int32 标签图
+    """
+    volume = stack_volume(stack_codes_matrix, solid_mask_2d, codec)
+    return [start_layer_runs(volume, layer_idx) for layer_idx in range(codec.total_layers)]
+
+
+def run_heights(codec, layer_height):
+    """段标签 slot * L + (段长 - 1) 对应的拉伸高度"""
+    L = codec.total_layers
+    return (np.arange(codec.num_filaments * L) % L + 1) * layer_height
+
+
+def layer_slabs(stack_codes_matrix, solid_mask_2d, codec, layer_height, pixel_size, slab_cache=None):
+    """
+    每个起始层的段切片 (底面位于 z=0，与正反面无关)
+
+    每个起始层只提取一次边界，所有段长、所有槽位一起拉伸。
+    需要轮廓简化时传入 SlabCache(simplifier)。
+
+    Returns:
+        list: L 个列表，每个为 slot * L + (段长 - 1) 标签下标的 trimesh (或 None)
+    """
+    if slab_cache is None:
+        slab_cache = SlabCache()
+    num_labels = codec.num_filaments * codec.total_layers
+    heights = run_heights(codec, layer_height)
+    return [slab_cache.slabs(run_labels, num_labels, heights, pixel_size)
+            for run_labels in vertical_runs(stack_codes_matrix, solid_mask_2d, codec)]
+
+
+def region_start_layer_runs(region_map, codec, start_layer, slot_table=None):
+    """
+    与 start_layer_runs 相同，但在区域层叠表上计算 (每个区域一行)，再按区域图查表展开
+
+    Args:
+        region_map: region_stack.RegionStackMap
+        slot_table: region_map.slot_table(codec)，多次调用时传入避免重复解码
+
+    Returns:
+        (H, W) int32 标签图
+    """
+    if slot_table is None:
+        slot_table = region_map.slot_table(codec)
+    return start_layer_runs(slot_table[:, None, :], start_layer)[:, 0][region_map.labels]
+
+
+def region_layer_slabs(region_map, codec, layer_height, pixel_size, slab_cache=None):
+    """
+    与 layer_slabs 相同，输入为区域图 + 区域层叠表: 段标签由区域表得到，不生成 (H, W, L) 体素
+
+    Returns:
+        list: L 个列表，每个为 slot * L + (段长 - 1) 标签下标的 trimesh (或 None)
+    """
+    if slab_cache is None:
+        slab_cache = SlabCache()
+    num_labels = codec.num_filaments * codec.total_layers
+    heights = run_heights(codec, layer_height)
+    slot_table = region_map.slot_table(codec)
+    return [slab_cache.slabs(region_start_layer_runs(region_map, codec, layer_idx, slot_table),
+                             num_labels, heights, pixel_size)
+            for layer_idx in range(codec.total_layers)]
+
+
+def place_slabs(slabs_per_layer, codec, z_offset, layer_height, reverse_layers=False):
+    """
+    把 layer_slabs 的段切片平移到一面 (正面或背面) 的位置，按槽位分组
+
+    Args:
+        slabs_per_layer (list): layer_slabs 的结果
+        codec: StackCodec
+        z_offset (float): 第一层底面 Z 坐标 (mm)
+        layer_height (float): 层高 (mm)
+        reverse_layers (bool): 按倒序取层 (双面模型的背面)
+
+    Returns:
+        list: 每个槽位的 trimesh 列表 (每个起始层、每种段长一个)
+    """
+    L = codec.total_layers
+    meshes = [[] for _ in range(codec.num_filaments)]
+    for start_layer, slabs in enumerate(slabs_per_layer):
+        for label, mesh in enumerate(slabs):
+            if mesh is None:
+                continue
+            slot_id, run_length = divmod(label, L)
+            run_length += 1
+            # 背面层序倒置: 源层 [s, s+len) 落在输出层 [L-s-len, L-s)
+            out_layer = L - start_layer - run_length if reverse_layers else start_layer
+            meshes[slot_id].append(translate_slab(mesh, z_offset + out_layer * layer_height))
+    return meshes
+
+
+def mesh_layer_stack(stack_codes_matrix, solid_mask_2d, codec, z_offset, layer_height, pixel_size,
+                     reverse_layers=False, slab_cache=None):
+    """
+    生成一面 (正面或背面) 所有彩色层、所有槽位的网格 (layer_slabs + place_slabs)
+
+    Args:
+        stack_codes_matrix: (H, W) 层叠编码
+        solid_mask_2d: (H, W) 可打印像素
+        codec: StackCodec
+        z_offset (float): 第一层底面 Z 坐标 (mm)
+        layer_height (float): 层高 (mm)
+        pixel_size (float): 像素尺寸 (mm)
+        reverse_layers (bool): 按倒序取层 (双面模型的背面)
+        slab_cache (SlabCache): 切片缓存，正反两面传入同一个缓存即可复用几何
+
+    Returns:
+        list: 每个槽位的 trimesh 列表 (每个起始层、每种段长一个)
+    """
+    slabs = layer_slabs(stack_codes_matrix, solid_mask_2d, codec, layer_height, pixel_size, slab_cache)
+    return place_slabs(slabs, codec, z_offset, layer_height, reverse_layers=reverse_layers)
+
+
+def mesh_base(solid_mask_2d, base_height, z_offset, pixel_size, simplifier=None):
+    """底座: 整个可打印区域拉伸为一个网格，没有可打印像素时返回 None"""
+    return extrude_label_image(np.where(solid_mask_2d, 0, -1), 1, base_height, z_offset, pixel_size, simplifier)[0]
@@ -0,0 +1,116 @@
+"""
+LUT 最近颜色索引
+
+图片像素是 8-bit sRGB，颜色总数只有 2^24 种，因此把 "sRGB 颜色 -> 最近 LUT 条目"
+直接记成一张按 24-bit 颜色编号寻址的表: 第一次遇到的颜色用 KDTree 精确查找，
+结果写回表中，之后同一颜色的查询只是一次数组 gather。
+表按 256 色一块按需分配，内存只与实际出现过的颜色分布有关；超过 max_bytes 时整表清空重建。
+
+(固定边长的 Lab/sRGB 网格 + 边界精确修正在这里不可行: LUT 颜色间距约 1-2 ΔE，
+ 2 ΔE 的格子有 99% 以上落在 Voronoi 边界附近，几乎全部需要回退查找。)
+"""
+
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from color_science import rgb_to_lab, pack_rgb, unpack_rgb
+
+BLOCK_BITS = 8
+BLOCK_SIZE = 1 << BLOCK_BITS
+NUM_BLOCKS = 1 << (24 - BLOCK_BITS)
+MAX_TABLE_BYTES = 32 * 1024 * 1024
+
+
+class LutMatchIndex:
+    def __init__(self, lut_lab, max_bytes=MAX_TABLE_BYTES):
+        self.lut_lab = np.asarray(lut_lab, dtype=np.float64)
+
+        # LUT 中常有完全相同的颜色，去重后统一映射到编号最小的 LUT 条目，结果与查询顺序无关
+        unique_lab, first_index = np.unique(self.lut_lab, axis=0, return_index=True)
+        self.unique_to_lut = first_index.astype(np.int64)
+        self.tree = cKDTree(unique_lab)
+
+        # 表项: LUT 索引，全 1 表示尚未查询过
+        self._dtype = np.uint16 if len(self.lut_lab) < np.iinfo(np.uint16).max else np.uint32
+        self._empty = np.iinfo(self._dtype).max
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._block_of = np.full(NUM_BLOCKS, -1, dtype=np.int32)
+        self._blocks = np.empty((0, BLOCK_SIZE), dtype=self._dtype)
+        self._num_blocks = 0
+        self.colors_resolved = 0
+        self.resets = 0
+
+    @property
+    def nbytes(self):
+        return (self._blocks.nbytes + self._block_of.nbytes + self.tree.data.nbytes
+                + self.tree.indices.nbytes + self.unique_to_lut.nbytes)
+
+    def query(self, points):
+        """
+        Lab 坐标精确最近邻，接口与 scipy KDTree.query 相同
+
+        points: (..., 3) Lab
+        返回: (dists, indices)，形状为 points.shape[:-1]
+        """
+        points = np.asarray(points, dtype=np.float64)
+        dists, nearest = self.tree.query(points.reshape(-1, 3))
+        shape = points.shape[:-1]
+        return dists.reshape(shape), self.unique_to_lut[nearest].reshape(shape)
+
+    def _allocate_blocks(self, block_ids):
+        """为尚未分配的块分配存储 (调用方持有锁)"""
+        new_ids = block_ids[self._block_of[block_ids] < 0]
+        if len(new_ids) == 0:
+            return
+        needed = self._num_blocks + len(new_ids)
+        block_bytes = BLOCK_SIZE * np.dtype(self._dtype).itemsize
+        if needed * block_bytes > self.max_bytes and self._num_blocks > 0:
+            # 超出内存上限: 丢弃已缓存的全部颜色，只保留本次需要的块
+            self._block_of[:] = -1
+            self._blocks = np.empty((0, BLOCK_SIZE), dtype=self._dtype)
+            self._num_blocks = 0
+            self.resets += 1
+            new_ids = block_ids
+            needed = len(new_ids)
+        if needed > len(self._blocks):
+            capacity = max(needed, min(2 * len(self._blocks), self.max_bytes // block_bytes), 16)
+            grown = np.full((capacity, BLOCK_SIZE), self._empty, dtype=self._dtype)
+            grown[:self._num_blocks] = self._blocks[:self._num_blocks]
+            self._blocks = grown
+        self._block_of[new_ids] = np.arange(self._num_blocks, needed, dtype=np.int32)
+        self._num_blocks = needed
+
+    def query_rgb(self, rgb):
+        """
+        sRGB 颜色的最近 LUT 条目 (精确)
+
+        rgb: (..., 3) uint8
+        返回: (...) int64 LUT 索引
+        """
+        keys = pack_rgb(rgb).ravel()
+        hi = (keys >> BLOCK_BITS).astype(np.int64)
+        lo = (keys & (BLOCK_SIZE - 1)).astype(np.int64)
+
+        with self._lock:
+            self._allocate_blocks(np.unique(hi))
+            result = self._blocks[self._block_of[hi], lo].astype(np.int64)
+
+        missing = result == self._empty
+        if np.any(missing):
+            # 只对未见过的颜色做一次 Lab 转换 + KDTree 查询
+            new_keys, inverse = np.unique(keys[missing], return_inverse=True)
+            _, nearest = self.tree.query(rgb_to_lab(unpack_rgb(new_keys)))
+            new_values = self.unique_to_lut[nearest]
+            with self._lock:
+                new_hi = (new_keys >> BLOCK_BITS).astype(np.int64)
+                new_lo = (new_keys & (BLOCK_SIZE - 1)).astype(np.int64)
+                # 查询期间其他线程可能清空过表
+                self._allocate_blocks(np.unique(new_hi))
+                self._blocks[self._block_of[new_hi], new_lo] = new_values
+                self.colors_resolved += len(new_keys)
+            result[missing] = new_values[inverse]
+
+        return result.reshape(np.shape(rgb)[:-1])
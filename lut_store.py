@@ -0,0 +1,312 @@
+"""
+LUT 持久化存储 (按内容寻址)
+
+LUT 只取决于耗材 K/S 向量 (有序)、层数、层高、底座反射率和计算方式 (稀疏约束，或完整 LUT 实际使用的
+prefix / mitm 引擎: 两者的浮点舍入不同，sRGB 可能相差 1 级)，因此以这些输入的哈希作为键，把 sRGB LUT、Lab LUT 和层叠编码保存为 .npy，
+读取时使用内存映射 (mmap)，多个后端进程可共享同一份页缓存。
+
+命令行预热:
+    python lut_store.py --inventory my_filament.json --slots 5
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from ChromaStackStudio import (
+    VirtualPhysics, load_inventory, resolve_lut_method,
+    BACKING_REFLECTANCE, TOTAL_LAYERS, LAYER_HEIGHT, LUT_METHOD,
+)
+from color_science import rgb_to_lab
+
+# ================= 配置区域 =================
+LUT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "lut")
+LUT_STORE_MAX_BYTES = 1024 * 1024 * 1024   # 存储上限 (1 GB)，超出后按最近访问时间淘汰
+STORE_VERSION = 3                          # LUT 算法或文件格式变化时递增，使旧条目失效
+
+_ARRAY_FILES = ("lut_rgb", "lut_lab", "lut_codes")
+_SPARSE_KEYS = ("max_distinct", "max_changes", "base_slot", "merge_delta_e")
+
+
+def normalize_sparse_options(sparse):
+    """
+    规范化稀疏 LUT 参数: 去掉未设置的键并统一类型；没有任何约束时返回 None (完整 LUT)
+    """
+    if not sparse:
+        return None
+    options = {}
+    for name in _SPARSE_KEYS:
+        value = sparse.get(name)
+        if value is None or value == '':
+            continue
+        options[name] = float(value) if name == "merge_delta_e" else int(value)
+    if not options.get("merge_delta_e"):
+        options.pop("merge_delta_e", None)
+    return options or None
+
+
+def lut_method(total_layers, sparse=None, method=LUT_METHOD):
+    """LUT 的计算方式: 稀疏 LUT 为 sparse，完整 LUT 为解析 auto 之后的引擎 (prefix / mitm)"""
+    if normalize_sparse_options(sparse):
+        return "sparse"
+    return resolve_lut_method(total_layers, method)
+
+
+def lut_key(filaments_list, total_layers=TOTAL_LAYERS, layer_height=LAYER_HEIGHT, backing=BACKING_REFLECTANCE, sparse=None,
+            method=LUT_METHOD):
+    """由 LUT 的全部输入 (含实际使用的引擎) 计算内容哈希 (sha256 十六进制)"""
+    sparse = normalize_sparse_options(sparse)
+    Ks = np.asarray([f['FILAMENT_K'] for f in filaments_list], dtype='<f8')
+    Ss = np.asarray([f['FILAMENT_S'] for f in filaments_list], dtype='<f8')
+    h = hashlib.sha256()
+    h.update(f"v{STORE_VERSION}|L={int(total_layers)}|h={float(layer_height)!r}|N={len(filaments_list)}|"
+             f"m={lut_method(total_layers, sparse, method)}|".encode())
+    h.update(np.ascontiguousarray(Ks).tobytes())
+    h.update(np.ascontiguousarray(Ss).tobytes())
+    h.update(np.ascontiguousarray(np.asarray(backing, dtype='<f8')).tobytes())
+    if sparse:
+        h.update(("|sparse=" + json.dumps(sparse, sort_keys=True)).encode())
+    return h.hexdigest()
+
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+class LutStore:
+    """
+    磁盘 LUT 存储。
+    每个条目是 root/<key>/ 目录，包含 lut_rgb.npy、lut_lab.npy、lut_codes.npy 和 meta.json
+    (耗材、层数、层高、稀疏参数、计算方式)。
+    写入先落到临时目录再整体重命名，读者永远不会看到写了一半的条目。
+    """
+
+    def __init__(self, root=LUT_STORE_DIR, max_bytes=LUT_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._approx_bytes = None   # 首次写入时扫描一次，之后增量累计
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """读取条目，返回 (lut_rgb, lut_lab, lut_codes) 只读内存映射；不存在时返回 None"""
+        entry = self._entry_dir(key)
+        try:
+            arrays = tuple(np.load(os.path.join(entry, name + ".npy"), mmap_mode='r') for name in _ARRAY_FILES)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            os.utime(os.path.join(entry, "meta.json"))   # 记录访问时间，供淘汰使用
+        except OSError:
+            pass
+        return arrays
+
+    def put(self, key, lut_rgb, lut_lab, lut_codes, meta=None):
+        """写入条目 (原子重命名)；已存在时直接返回"""
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = os.path.join(self.root, f".tmp-{key[:16]}-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            for name, arr in zip(_ARRAY_FILES, (lut_rgb, lut_lab, lut_codes)):
+                np.save(os.path.join(tmp_dir, name + ".npy"), np.ascontiguousarray(arr))
+            info = dict(meta or {}, key=key, version=STORE_VERSION, created=time.time())
+            with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+                json.dump(info, f, ensure_ascii=False, indent=2)
+            size = _dir_size(tmp_dir)
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # 其他进程已写入同一条目 (或磁盘错误)，丢弃临时目录即可
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self.total_bytes()
+            else:
+                self._approx_bytes += size
+            over_budget = self._approx_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def entries(self):
+        """列出全部条目: [(key, 字节数, 最近访问时间)]"""
+        result = []
+        if not os.path.isdir(self.root):
+            return result
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            try:
+                atime = os.stat(os.path.join(entry.path, "meta.json")).st_mtime
+                result.append((entry.name, _dir_size(entry.path), atime))
+            except OSError:
+                continue
+        return result
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        """按最近访问时间从旧到新删除条目，直到总大小不超过上限；返回删除的条目数"""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for key, size, _ in entries:
+            if total <= limit:
+                break
+            try:
+                shutil.rmtree(self._entry_dir(key))
+            except OSError:
+                # Windows 下仍被其他进程映射的文件无法删除，跳过
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._approx_bytes = total
+        return removed
+
+    def get_or_build(self, filaments_list, total_layers=TOTAL_LAYERS, layer_height=LAYER_HEIGHT, engine=None, sparse=None,
+                     method=LUT_METHOD):
+        """命中时直接映射读取，否则计算 LUT + Lab 转换并写入存储"""
+        sparse = normalize_sparse_options(sparse)
+        key = lut_key(filaments_list, total_layers, layer_height, sparse=sparse, method=method)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        engine = engine or VirtualPhysics()
+        lut_rgb, lut_codes = build_lut(engine, filaments_list, total_layers, layer_height, sparse, method)
+        lut_lab = rgb_to_lab(lut_rgb)
+        meta = {
+            'filaments': [f.get('Name') for f in filaments_list],
+            'total_layers': int(total_layers),
+            'layer_height': float(layer_height),
+            'sparse': sparse,
+            'method': lut_method(total_layers, sparse, method),
+        }
+        try:
+            self.put(key, lut_rgb, lut_lab, lut_codes, meta)
+        except OSError as e:
+            print(f"  [!] LUT 缓存写入失败: {e}")
+        return lut_rgb, lut_lab, lut_codes
+
+
+def build_lut(engine, filaments_list, total_layers, layer_height, sparse=None, method=LUT_METHOD):
+    """按参数选择完整 LUT (method 指定引擎) 或稀疏 LUT，返回 (lut_rgb, lut_codes)"""
+    if sparse:
+        return engine.generate_lut_sparse(filaments_list, total_layers, layer_height, **sparse)
+    return engine.generate_lut_km(filaments_list, total_layers, layer_height, method=method)
+
+
+_default_store = None
+
+
+def get_default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = LutStore()
+    return _default_store
+
+
+def load_lut(filaments_list, total_layers=TOTAL_LAYERS, layer_height=LAYER_HEIGHT, engine=None, store=None, sparse=None,
+             method=LUT_METHOD):
+    """
+    获取 LUT: 返回 (lut_rgb, lut_lab, lut_codes)。
+    sparse 为稀疏 LUT 参数 (见 ChromaStackStudio.SPARSE_LUT)，None 表示完整 LUT；
+    method 为完整 LUT 的引擎 (见 ChromaStackStudio.LUT_METHOD)。
+    命中磁盘存储时数组为只读内存映射，调用方不得原地修改。
+    """
+    store = store or get_default_store()
+    return store.get_or_build(filaments_list, total_layers, layer_height, engine=engine, sparse=sparse, method=method)
+
+
+# ================= 命令行: 预热 =================
+
+def iter_filament_sets(inventory, slots, base_name=None):
+    """枚举耗材组合: 指定底座时为 [底座] + 其余 slots-1 种的组合，否则为全部 slots 种组合"""
+    if base_name:
+        base = next((f for f in inventory if f['Name'] == base_name), None)
+        if base is None:
+            raise ValueError(f"库存中找不到底座材料 '{base_name}'")
+        candidates = [f for f in inventory if f['Name'] != base_name]
+        for combo in itertools.combinations(candidates, slots - 1):
+            yield [base] + list(combo)
+    else:
+        for combo in itertools.combinations(inventory, slots):
+            yield list(combo)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="预热 ChromaStack LUT 磁盘缓存")
+    parser.add_argument("--inventory", default="my_filament.json", help="耗材库 JSON 路径")
+    parser.add_argument("--slots", type=int, nargs='+', default=[4], help="每组耗材数量 (可给多个)")
+    parser.add_argument("--base", default=None, help="固定为第 1 槽的底座耗材名称")
+    parser.add_argument("--layers", type=int, default=TOTAL_LAYERS, help="混色层数")
+    parser.add_argument("--layer-height", type=float, default=LAYER_HEIGHT, help="层高 (mm)")
+    parser.add_argument("--method", choices=("auto", "prefix", "mitm"), default=LUT_METHOD, help="完整 LUT 的计算引擎")
+    parser.add_argument("--max-distinct", type=int, default=None, help="稀疏 LUT: 每柱最多耗材种类")
+    parser.add_argument("--max-changes", type=int, default=None, help="稀疏 LUT: 最多换色次数")
+    parser.add_argument("--base-slot", type=int, default=None, help="稀疏 LUT: 第 0 层必须使用的槽位")
+    parser.add_argument("--merge-delta-e", type=float, default=None, help="稀疏 LUT: 合并色差阈值")
+    parser.add_argument("--store", default=LUT_STORE_DIR, help="缓存目录")
+    parser.add_argument("--max-bytes", type=int, default=LUT_STORE_MAX_BYTES, help="缓存容量上限 (字节)")
+    args = parser.parse_args(argv)
+
+    inventory = load_inventory(args.inventory)
+    if not inventory:
+        return 1
+    inventory = [f for f in inventory if "FILAMENT_K" in f and "FILAMENT_S" in f]
+
+    sparse = normalize_sparse_options({
+        'max_distinct': args.max_distinct,
+        'max_changes': args.max_changes,
+        'base_slot': args.base_slot,
+        'merge_delta_e': args.merge_delta_e,
+    })
+    store = LutStore(args.store, args.max_bytes)
+    engine = VirtualPhysics()
+    built = hits = 0
+    start = time.time()
+    for slots in args.slots:
+        for filament_set in iter_filament_sets(inventory, slots, args.base):
+            key = lut_key(filament_set, args.layers, args.layer_height, sparse=sparse, method=args.method)
+            if store.get(key) is not None:
+                hits += 1
+                continue
+            lut_rgb, lut_codes = build_lut(engine, filament_set, args.layers, args.layer_height, sparse, args.method)
+            meta = {
+                'filaments': [f['Name'] for f in filament_set],
+                'total_layers': args.layers,
+                'layer_height': args.layer_height,
+                'sparse': sparse,
+                'method': lut_method(args.layers, sparse, args.method),
+            }
+            store.put(key, lut_rgb, rgb_to_lab(lut_rgb), lut_codes, meta)
+            built += 1
+
+    print(f"✅ 预热完成: 新建 {built} 个，已存在 {hits} 个，用时 {time.time() - start:.1f}s")
+    print(f"   缓存目录: {store.root} ({store.total_bytes() / 1024 / 1024:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
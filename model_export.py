@@ -0,0 +1,328 @@
+"""
+流式 3MF 导出
+
+trimesh 的 scene.export 先在内存里拼出完整的模型 XML，大尺寸双面模型会占用数 GB 内存。
+这里直接把每个槽位的顶点/三角形分块格式化后写进 zip 条目，峰值内存只与单个分块有关:
+    - 所有槽位组成一个多零件对象 (每个槽位一个零件)，零件名为耗材名
+    - 颜色写入 basematerials (3MF 核心规范的元素，取耗材的 Color 字段)，零件通过 pid/pindex 引用
+    - Metadata/model_settings.config 记录零件 -> 挤出机 (耗材槽位) 的对应关系，
+      Bambu Studio / Orca Slicer 打开后每个零件自动分配到对应耗材
+每个槽位的多个网格 (各段切片、底座) 在写出时依次追加，不再 concatenate 成一个大网格。
+
+另外两种导出:
+    - 每个槽位一个二进制 STL: 按结构化 dtype 一次性填充法向/顶点，分块写出，没有逐三角形的 Python 循环
+    - 层叠图 (.npz): 掩码 + 实心像素的紧凑层叠编码 + 像素尺寸/层高，
+      之后可以不重新做颜色匹配直接生成网格 (匹配与网格可以在不同机器上完成，也便于归档)
+"""
+
+import math
+import os
+import re
+import zipfile
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+CORE_NS = "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"
+MODEL_PATH = "3D/3dmodel.model"
+SETTINGS_PATH = "Metadata/model_settings.config"
+
+CHUNK_ROWS = 1 << 16   # 每次格式化的顶点/三角形行数
+
+EXPORT_FORMATS = ('3mf', 'stl', 'npz')
+STACK_MAP_VERSION = 1
+# 读取层叠图 (可能来自上传) 时的上限: 像素数、耗材数、层数
+STACK_MAP_MAX_PIXELS = 64 * 1024 * 1024
+STACK_MAP_MAX_FILAMENTS = 16
+STACK_MAP_MAX_LAYERS = 16
+
+# 二进制 STL 的三角形记录: 法向、三个顶点 (float32)、属性字 (50 字节)
+STL_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+_VERTEX_ROW = '<vertex x="%.9g" y="%.9g" z="%.9g"/>'
+_TRIANGLE_ROW = '<triangle v1="%d" v2="%d" v3="%d"/>'
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+ <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+ <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+ <Default Extension="config" ContentType="text/xml"/>
+</Types>
+"""
+
+RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+ <Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+
+def _write_rows(stream, template, rows, offset=0):
+    """按行模板分块格式化 (一次 % 运算格式化一整块)，逐块编码写入；offset 加到每个值上"""
+    for start in range(0, len(rows), CHUNK_ROWS):
+        chunk = rows[start:start + CHUNK_ROWS] + offset
+        text = (template * len(chunk)) % tuple(chunk.ravel().tolist())
+        stream.write(text.encode('utf-8'))
+
+
+def display_color(hex_color, default='#808080'):
+    """'#RRGGBB' -> 3MF displaycolor '#RRGGBBFF'，格式不对时使用默认灰色"""
+    value = (hex_color or default).strip().lstrip('#')
+    if len(value) not in (6, 8) or any(ch not in '0123456789abcdefABCDEF' for ch in value):
+        value = default.lstrip('#')
+    return '#' + value[:6].upper() + (value[6:8].upper() or 'FF')
+
+
+def _write_part(stream, object_id, name, material_index, meshes):
+    """一个零件对象: 依次写出各网格的顶点，再写出按顶点偏移修正后的三角形"""
+    stream.write((f'<object id="{object_id}" name={quoteattr(name)} type="model" '
+                  f'pid="1" pindex="{material_index}"><mesh><vertices>').encode('utf-8'))
+    for mesh in meshes:
+        _write_rows(stream, _VERTEX_ROW, np.asarray(mesh.vertices, dtype=np.float64))
+    stream.write(b'</vertices><triangles>')
+    offset = 0
+    for mesh in meshes:
+        _write_rows(stream, _TRIANGLE_ROW, np.asarray(mesh.faces, dtype=np.int64), offset)
+        offset += len(mesh.vertices)
+    stream.write(b'</triangles></mesh></object>\n')
+    return offset, sum(len(mesh.faces) for mesh in meshes)
+
+
+def _model_settings(assembly_id, assembly_name, parts):
+    """Bambu Studio / Orca Slicer 的零件 -> 挤出机映射"""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<config>', f' <object id="{assembly_id}">',
+             f'  <metadata key="name" value={quoteattr(assembly_name)}/>',
+             f'  <metadata key="extruder" value="{parts[0]["extruder"] if parts else 1}"/>']
+    for part in parts:
+        lines += [f'  <part id="{part["object_id"]}" subtype="normal_part">',
+                  f'   <metadata key="name" value={quoteattr(part["name"])}/>',
+                  f'   <metadata key="extruder" value="{part["extruder"]}"/>',
+                  '  </part>']
+    lines += [' </object>', '</config>', '']
+    return '\n'.join(lines)
+
+
+def write_3mf(path, slot_parts, names, colors=None, model_name='ChromaStack', on_part=None):
+    """
+    把每个槽位的网格流式写入 3MF
+
+    Args:
+        path: 输出文件路径
+        slot_parts (list): 每个槽位的 trimesh 列表 (空列表表示该槽位没有零件)
+        names (list): 每个槽位的零件名 (耗材名)
+        colors (list): 每个槽位的 '#RRGGBB' 颜色，None 时为灰色
+        model_name (str): 多零件对象的名称
+        on_part: 每写完一个零件调用 on_part(已写零件数, 零件总数) (进度汇报 / 取消检查)
+
+    Returns:
+        dict: parts (写出的零件数)、vertices、triangles；没有任何零件时不写文件，parts 为 0
+    """
+    colors = colors or [None] * len(names)
+    used = [slot for slot, meshes in enumerate(slot_parts) if meshes]
+    stats = {'parts': len(used), 'vertices': 0, 'triangles': 0}
+    if not used:
+        return stats
+
+    # 中途出错 (或任务被取消) 时删除写了一半的文件
+    try:
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+            archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+            archive.writestr('_rels/.rels', RELS)
+
+            parts = []
+            with archive.open(MODEL_PATH, 'w', force_zip64=True) as stream:
+                stream.write((f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                              f'<model unit="millimeter" xml:lang="en-US" xmlns="{CORE_NS}">\n'
+                              f'<metadata name="Application">ChromaStack</metadata>\n'
+                              f'<resources>\n<basematerials id="1">').encode('utf-8'))
+                for slot in range(len(names)):
+                    stream.write(f'<base name={quoteattr(names[slot])} '
+                                 f'displaycolor="{display_color(colors[slot])}"/>'.encode('utf-8'))
+                stream.write(b'</basematerials>\n')
+
+                # 零件对象 id 从 2 开始 (1 为 basematerials)
+                for object_id, slot in enumerate(used, start=2):
+                    vertices, triangles = _write_part(stream, object_id, names[slot], slot, slot_parts[slot])
+                    stats['vertices'] += vertices
+                    stats['triangles'] += triangles
+                    parts.append({'object_id': object_id, 'name': names[slot], 'extruder': slot + 1})
+                    if on_part is not None:
+                        on_part(len(parts), len(used))
+
+                assembly_id = len(used) + 2
+                stream.write(f'<object id="{assembly_id}" name={quoteattr(model_name)} type="model"><components>'
+                             .encode('utf-8'))
+                for part in parts:
+                    stream.write(f'<component objectid="{part["object_id"]}"/>'.encode('utf-8'))
+                stream.write((f'</components></object>\n</resources>\n'
+                              f'<build><item objectid="{assembly_id}"/></build>\n</model>\n').encode('utf-8'))
+
+            archive.writestr(SETTINGS_PATH, _model_settings(assembly_id, model_name, parts))
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return stats
+
+
+def parse_export_formats(value):
+    """'3mf,stl' 或列表 -> 去重后的格式元组；出现未知格式时抛出 ValueError"""
+    if isinstance(value, str):
+        value = value.split(',')
+    formats = tuple(dict.fromkeys(str(item).strip().lower() for item in value or () if str(item).strip()))
+    unknown = [item for item in formats if item not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"未知的导出格式: {', '.join(unknown)} (可选: {', '.join(EXPORT_FORMATS)})")
+    return formats or ('3mf',)
+
+
+def part_name(name, default='Part'):
+    """耗材名 -> 零件名 (同时用作 STL 文件名的一部分): 空白和路径/文件名中不允许的字符替换为 '_'"""
+    name = re.sub(r'[\s/\\:*?"<>|\x00-\x1f]', '_', str(name)).strip('._')[:64]
+    return name or default
+
+
+def _stl_records(vertices, faces):
+    """一块三角形 -> STL_DTYPE 记录 (法向由顶点叉积计算，退化三角形的法向为 0)"""
+    records = np.zeros(len(faces), dtype=STL_DTYPE)
+    triangles = vertices[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    records['normal'] = normals
+    records['vertices'] = triangles
+    return records
+
+
+def write_stl(path, meshes, name=''):
+    """
+    把多个网格写成一个二进制 STL (不合并网格，按 CHUNK_ROWS 个三角形分块写出)
+
+    Returns:
+        int: 三角形数
+    """
+    triangles = sum(len(mesh.faces) for mesh in meshes)
+    header = f'ChromaStack {name}'.encode('utf-8')[:80].ljust(80, b' ')
+    try:
+        with open(path, 'wb') as stream:
+            stream.write(header)
+            stream.write(np.uint32(triangles).tobytes())
+            for mesh in meshes:
+                vertices = np.asarray(mesh.vertices, dtype=np.float64)
+                faces = np.asarray(mesh.faces, dtype=np.int64)
+                for start in range(0, len(faces), CHUNK_ROWS):
+                    stream.write(_stl_records(vertices, faces[start:start + CHUNK_ROWS]).tobytes())
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return triangles
+
+
+def write_stl_parts(directory, stem, slot_parts, names, on_part=None):
+    """
+    每个有网格的槽位写出一个 '<stem>_<槽位号>_<耗材名>.stl'
+    on_part: 每写完一个文件调用 on_part(已写文件数, 文件总数)
+
+    Returns:
+        list: [(文件名, 三角形数), ...]，按槽位顺序
+    """
+    written = []
+    used = [slot for slot, meshes in enumerate(slot_parts) if meshes]
+    for slot in used:
+        filename = f'{stem}_{slot + 1}_{part_name(names[slot])}.stl'
+        written.append((filename, write_stl(os.path.join(directory, filename), slot_parts[slot], names[slot])))
+        if on_part is not None:
+            on_part(len(written), len(used))
+    return written
+
+
+def save_stack_map(path, stack_codes_matrix, solid_mask_2d, codec, pixel_size, layer_height, names=(), colors=()):
+    """
+    保存层叠图 (.npz，压缩): 按位打包的掩码 + 实心像素的层叠编码 (codec.dtype) + 重建网格所需的参数
+
+    Args:
+        stack_codes_matrix: (H, W) 颜色匹配得到的层叠编码 (图片方向，未镜像、未清理)
+        solid_mask_2d: (H, W) 可打印像素
+        codec: StackCodec
+        names / colors: 每个槽位的耗材名与 '#RRGGBB' 颜色 (重建时作为零件名和颜色)
+    """
+    mask = np.asarray(solid_mask_2d, dtype=bool)
+    np.savez_compressed(
+        path,
+        version=np.int32(STACK_MAP_VERSION),
+        shape=np.asarray(mask.shape, dtype=np.int64),
+        mask=np.packbits(mask, axis=None),
+        codes=np.asarray(stack_codes_matrix)[mask].astype(codec.dtype),
+        num_filaments=np.int32(codec.num_filaments),
+        total_layers=np.int32(codec.total_layers),
+        pixel_size=np.float64(pixel_size),
+        layer_height=np.float64(layer_height),
+        names=np.asarray(list(names), dtype=str),
+        colors=np.asarray([display_color(color)[:7] for color in colors], dtype=str),
+    )
+
+
+def load_stack_map(path, max_pixels=STACK_MAP_MAX_PIXELS):
+    """
+    读取 save_stack_map 写出的层叠图
+
+    文件可能来自上传，解压和分配内存之前先检查: 各条目解压后的大小、像素数不超过 max_pixels、
+    掩码长度与形状一致、编码数等于实心像素数且都小于 num_filaments ** total_layers、
+    耗材数/层数/名称数在范围内、像素尺寸和层高为正数。
+
+    Returns:
+        dict: codes ((H, W)，掩码外为 0)、mask、num_filaments、total_layers、pixel_size、layer_height、
+              names、colors (列表)；用 StackCodec(num_filaments, total_layers) 解码
+
+    Raises:
+        ValueError: 文件不是有效的层叠图或超出上限
+    """
+    with np.load(path, allow_pickle=False) as data:
+        # 解压前按 zip 目录中记录的原始大小拒绝过大的条目 (编码最多 8 字节/像素)
+        limit = max_pixels * 8 + (1 << 20)
+        for info in data.zip.infolist():
+            if info.file_size > limit:
+                raise ValueError(f"层叠图条目过大: {info.filename} ({info.file_size} 字节)")
+
+        if int(data['version']) != STACK_MAP_VERSION:
+            raise ValueError(f"不支持的层叠图版本: {int(data['version'])}")
+        shape = tuple(int(n) for n in np.ravel(data['shape']))
+        if len(shape) != 2 or min(shape) < 1:
+            raise ValueError(f"层叠图尺寸无效: {shape}")
+        pixels = shape[0] * shape[1]
+        if pixels > max_pixels:
+            raise ValueError(f"层叠图过大: {shape[1]}x{shape[0]} 像素 (上限 {max_pixels} 像素)")
+        num_filaments, total_layers = int(data['num_filaments']), int(data['total_layers'])
+        if not 1 <= num_filaments <= STACK_MAP_MAX_FILAMENTS or not 1 <= total_layers <= STACK_MAP_MAX_LAYERS:
+            raise ValueError(f"层叠图参数超出范围: {num_filaments} 种耗材, {total_layers} 层")
+        pixel_size, layer_height = float(data['pixel_size']), float(data['layer_height'])
+        if not (math.isfinite(pixel_size) and pixel_size > 0 and math.isfinite(layer_height) and layer_height > 0):
+            raise ValueError(f"像素尺寸或层高无效: {pixel_size}, {layer_height}")
+        names, colors = data['names'].tolist(), data['colors'].tolist()
+        if len(names) not in (0, num_filaments) or len(colors) not in (0, num_filaments):
+            raise ValueError(f"耗材名称/颜色数量与耗材数 ({num_filaments}) 不一致")
+
+        packed_mask = data['mask']
+        if packed_mask.dtype != np.uint8 or packed_mask.ndim != 1 or len(packed_mask) != (pixels + 7) // 8:
+            raise ValueError("层叠图掩码与尺寸不一致")
+        mask = np.unpackbits(packed_mask, count=pixels).astype(bool).reshape(shape)
+        packed = data['codes']
+        if packed.dtype.kind != 'u' or packed.ndim != 1:
+            raise ValueError(f"层叠编码类型无效: {packed.dtype} {packed.shape}")
+        if len(packed) != int(mask.sum()):
+            raise ValueError("层叠编码数量与实心像素数不一致")
+        if len(packed) and int(packed.max()) >= num_filaments ** total_layers:
+            raise ValueError(f"层叠编码超出范围 ({num_filaments} 种耗材, {total_layers} 层)")
+        codes = np.zeros(shape, dtype=packed.dtype)
+        codes[mask] = packed
+        return {
+            'codes': codes,
+            'mask': mask,
+            'num_filaments': num_filaments,
+            'total_layers': total_layers,
+            'pixel_size': pixel_size,
+            'layer_height': layer_height,
+            'names': [part_name(name, f'Slot_{i + 1}') for i, name in enumerate(names)],
+            'colors': colors,
+        }
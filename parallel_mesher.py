@@ -0,0 +1,241 @@
+"""
+多进程网格生成
+
+网格阶段按任务拆分后交给进程池:
+    contour  每个起始层一个任务: 提取该层所有槽位、所有段长的边界并拉伸 (layer_mesher)
+    greedy   每个槽位一个任务: 只保留该槽位的体素做面剔除、合并和焊接 (greedy_mesher)
+
+解码后的槽位体素放在 multiprocessing.shared_memory 中，工作进程按名字映射同一块内存，
+不需要序列化整张矩阵；任务结果按提交顺序收集，输出与单进程完全一致 (顶点、三角形的顺序也相同:
+greedy 单独计算一个槽位时，其他槽位视为空气不改变该槽位的面合并与拆分，见 tests/test_parallel_mesher.py)。
+正反两面由相同的段切片组成，contour 的任务只计算一次切片，两面都在主进程里平移得到。
+输入为区域图 + 区域层叠表时 (parallel_region_slabs) 共享的是 (H, W) 区域图，
+每个起始层的段标签在主进程的区域表上算好 (每个区域一项) 随任务发送。
+主进程正在记录阶段统计时 (instrumentation)，contour 任务在工作进程中记录轮廓提取与拉伸的耗时，随结果返回后合并。
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import trimesh
+
+import instrumentation
+from layer_mesher import (ContourSimplifier, SlabCache, layer_slabs, region_layer_slabs, run_heights, stack_volume,
+                          start_layer_runs)
+from greedy_mesher import mesh_slot_volume, model_volume
+
+# 体素数少于该值时直接在当前进程计算 (进程间往返的开销大于收益)
+PARALLEL_MIN_VOXELS = 1 << 21
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def resolve_workers(workers):
+    """工作进程数: None / 0 表示按 CPU 核数"""
+    return max(1, int(workers) if workers else (os.cpu_count() or 1))
+
+
+def get_pool(workers):
+    """
+    进程共享的进程池 (spawn: 不继承 Flask 线程和锁)，首次使用时按 resolve_workers(workers) 创建
+
+    多个任务线程可能同时向进程池提交任务，因此这里从不关闭或重建进程池 (之后请求的进程数不同时
+    仍使用已有的进程池)；每次调用的并行度由它提交的任务数 (层数 / 槽位数) 限制。
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            _pool_workers = resolve_workers(workers)
+            _pool = ProcessPoolExecutor(max_workers=_pool_workers, mp_context=get_context('spawn'))
+        return _pool
+
+
+def shutdown_pool():
+    """关闭进程池 (进程退出前或测试中调用)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool, _pool_workers = None, 0
+
+
+class SharedVolume:
+    """
+    放在共享内存中的只读数组。主进程 with 块结束时释放；
+    工作进程用 (name, shape, dtype) 通过 attach 映射同一块内存。
+    """
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shape, self.dtype = array.shape, array.dtype.str
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)[...] = array
+
+    @property
+    def handle(self):
+        return self._shm.name, self.shape, self.dtype
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._shm.close()
+        self._shm.unlink()
+
+    @staticmethod
+    def attach(handle):
+        """工作进程中映射共享数组，返回 (数组, SharedMemory)；用完后调用 close()"""
+        name, shape, dtype = handle
+        shm = shared_memory.SharedMemory(name=name)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def _mesh_arrays(mesh):
+    return None if mesh is None else (mesh.vertices, mesh.faces, dict(mesh.metadata))
+
+
+def _from_arrays(arrays):
+    if arrays is None:
+        return None
+    vertices, faces, metadata = arrays
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    mesh.metadata.update(metadata)
+    return mesh
+
+
+def _recorded_slabs(run_labels, num_labels, heights, pixel_size, simplifier, record):
+    """工作进程: 拉伸一个起始层的段标签图，返回 (顶点/面数组列表, 阶段统计 (record 为 False 时为 None))"""
+    if not record:
+        slabs = SlabCache(simplifier).slabs(run_labels, num_labels, heights, pixel_size)
+        return [_mesh_arrays(mesh) for mesh in slabs], None
+    with instrumentation.recording() as recorder:
+        slabs = SlabCache(simplifier).slabs(run_labels, num_labels, heights, pixel_size)
+    return [_mesh_arrays(mesh) for mesh in slabs], recorder.records()
+
+
+def _collect_slabs(futures):
+    """收集起始层任务的结果，阶段统计合并到主进程的记录器"""
+    results = []
+    for future in futures:
+        arrays, records = future.result()
+        instrumentation.merge(records)
+        results.append([_from_arrays(mesh_arrays) for mesh_arrays in arrays])
+    return results
+
+
+def _start_layer_task(handle, start_layer, num_labels, heights, pixel_size, tolerance, record=False):
+    """工作进程: 一个起始层的段切片 (只传回顶点/面数组)；tolerance > 0 时按整个体素的像素柱简化轮廓"""
+    volume, shm = SharedVolume.attach(handle)
+    try:
+        run_labels = start_layer_runs(volume, start_layer)
+        simplifier = ContourSimplifier(volume, tolerance) if tolerance > 0 else None
+    finally:
+        del volume
+        shm.close()
+    return _recorded_slabs(run_labels, num_labels, heights, pixel_size, simplifier, record)
+
+
+def _region_start_layer_task(handle, region_runs, num_labels, heights, pixel_size, code_columns, tolerance,
+                             record=False):
+    """工作进程: 按区域图查表得到一个起始层的段标签图后拉伸；code_columns 为区域 ID -> 编码 (背景 -1) 的表"""
+    labels, shm = SharedVolume.attach(handle)
+    try:
+        run_labels = region_runs[labels]
+        simplifier = ContourSimplifier(code_columns[labels], tolerance) if tolerance > 0 else None
+    finally:
+        del labels
+        shm.close()
+    return _recorded_slabs(run_labels, num_labels, heights, pixel_size, simplifier, record)
+
+
+def _slot_task(handle, slot_id, num_slots, pixel_size, z_levels):
+    """工作进程: 一个槽位的焊接网格 (其他槽位视为空气，结果与整体计算相同)"""
+    volume, shm = SharedVolume.attach(handle)
+    try:
+        slot_volume = np.where(volume == slot_id, slot_id, -1).astype(np.int16)
+    finally:
+        del volume
+        shm.close()
+    return _mesh_arrays(mesh_slot_volume(slot_volume, num_slots, pixel_size, z_levels)[slot_id])
+
+
+def parallel_layer_slabs(stack_codes_matrix, solid_mask_2d, codec, layer_height, pixel_size, workers=None,
+                         simplifier=None):
+    """
+    与 layer_mesher.layer_slabs 相同，按起始层分给进程池
+    simplifier (ContourSimplifier) 不为 None 时简化轮廓；工作进程由共享体素重新计算断点，结果相同。
+
+    Returns:
+        list: L 个列表，每个为段标签下标的 trimesh (或 None)，底面位于 z=0
+    """
+    workers = resolve_workers(workers)
+    L = codec.total_layers
+    if min(workers, L) <= 1 or solid_mask_2d.size * L < PARALLEL_MIN_VOXELS:
+        return layer_slabs(stack_codes_matrix, solid_mask_2d, codec, layer_height, pixel_size,
+                           SlabCache(simplifier))
+
+    num_labels = codec.num_filaments * L
+    heights = run_heights(codec, layer_height)
+    tolerance = simplifier.tolerance if simplifier is not None else 0.0
+    pool = get_pool(workers)
+    with SharedVolume(stack_volume(stack_codes_matrix, solid_mask_2d, codec)) as shared:
+        futures = [pool.submit(_start_layer_task, shared.handle, start_layer, num_labels, heights, pixel_size,
+                               tolerance, instrumentation.is_recording())
+                   for start_layer in range(L)]
+        return _collect_slabs(futures)
+
+
+def parallel_region_slabs(region_map, codec, layer_height, pixel_size, workers=None, simplifier=None):
+    """
+    与 layer_mesher.region_layer_slabs 相同，按起始层分给进程池
+
+    Returns:
+        list: L 个列表，每个为段标签下标的 trimesh (或 None)，底面位于 z=0
+    """
+    workers = resolve_workers(workers)
+    L = codec.total_layers
+    if min(workers, L) <= 1 or region_map.labels.size * L < PARALLEL_MIN_VOXELS:
+        return region_layer_slabs(region_map, codec, layer_height, pixel_size, SlabCache(simplifier))
+
+    num_labels = codec.num_filaments * L
+    heights = run_heights(codec, layer_height)
+    tolerance = simplifier.tolerance if simplifier is not None else 0.0
+    slot_table = region_map.slot_table(codec)
+    code_columns = region_map.codes.astype(np.int64)
+    code_columns[0] = -1
+    pool = get_pool(workers)
+    with SharedVolume(region_map.labels) as shared:
+        futures = [pool.submit(_region_start_layer_task, shared.handle,
+                               start_layer_runs(slot_table[:, None, :], start_layer)[:, 0], num_labels, heights,
+                               pixel_size, code_columns, tolerance, instrumentation.is_recording())
+                   for start_layer in range(L)]
+        return _collect_slabs(futures)
+
+
+def parallel_mesh_model(stack_codes_matrix, solid_mask_2d, codec, layer_height, base_height, pixel_size,
+                        double_sided=True, base_slot=0, workers=None):
+    """
+    与 greedy_mesher.mesh_model 相同，按槽位分给进程池
+
+    Returns:
+        list: 每个槽位的 trimesh.Trimesh，没有体素的槽位为 None
+    """
+    num_slots = codec.num_filaments
+    workers = resolve_workers(workers)
+    volume, z_levels = model_volume(stack_codes_matrix, solid_mask_2d, codec, layer_height, base_height,
+                                    double_sided=double_sided, base_slot=base_slot)
+    if min(workers, num_slots) <= 1 or volume.size < PARALLEL_MIN_VOXELS:
+        return mesh_slot_volume(volume, num_slots, pixel_size, z_levels)
+
+    pool = get_pool(workers)
+    with SharedVolume(volume) as shared:
+        del volume
+        futures = [pool.submit(_slot_task, shared.handle, slot_id, num_slots, pixel_size, z_levels)
+                   for slot_id in range(num_slots)]
+        results = [future.result() for future in futures]
+    return [_from_arrays(arrays) for arrays in results]
@@ -0,0 +1,381 @@
+"""
+分阶段流水线 (命令行与 GUI 后端共用)
+
+    resize   解码并 LANCZOS 缩放到目标宽度 (RGBA)
+    mask     透明度阈值 -> 可打印掩码
+    lab      不透明像素转 Lab (仅区域模式)
+    segment  Felzenszwalb 分割 (仅区域模式)
+    match    区域重匹配 / 逐像素匹配 -> 区域图 + 区域层叠表、LUT 索引矩阵
+    mesh     几何清理 + 网格生成 (contour / greedy) -> 每个槽位的零件列表
+
+每个阶段的输出按 "上游阶段的键 + 本阶段参数" 的哈希缓存 (所有阶段共用一个 LRU，总大小受限)，
+修改 scale 只重新执行 segment 及之后的阶段；预览之后生成模型时直接从 mesh 开始。
+缓存的数组设为只读，下游阶段不能原地修改。stats() 给出各阶段的命中/未命中次数和耗时，
+trace 参数记录单次运行中每个阶段是否命中及耗时；未命中时的计算同时计入 instrumentation 的阶段统计。
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import trimesh
+from PIL import Image
+from scipy.spatial import cKDTree
+
+import instrumentation
+
+STAGES = ("resize", "mask", "lab", "segment", "match", "mesh")
+PIPELINE_CACHE_MAX_BYTES = 512 * 1024 * 1024   # 命令行默认的缓存上限
+
+# 阶段输出: key 为本阶段的内容哈希 (下游阶段的输入之一)，value 为输出
+StageResult = namedtuple("StageResult", ["key", "value"])
+# match 阶段的输出
+MatchResult = namedtuple("MatchResult", ["region_map", "lut_idx_matrix"])
+# mesh 阶段的输出: 每个槽位的零件列表与几何清理统计
+MeshResult = namedtuple("MeshResult", ["slot_parts", "cleanup"])
+
+
+def stage_key(stage, *inputs):
+    """由阶段名、上游阶段的键和参数计算内容哈希"""
+    return hashlib.sha256(repr((stage,) + inputs).encode()).hexdigest()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """文件内容的 sha256 (命令行中作为图片的键)"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_image_rgba(path, target_width):
+    """解码并缩放为 (target_width * 宽高比) x target_width 的 RGBA 数组"""
+    with Image.open(path) as img:
+        target_height = int(target_width * img.height / img.width)
+        return np.array(img.convert("RGBA").resize((target_width, target_height), Image.LANCZOS))
+
+
+def _nbytes(value):
+    """缓存条目的内存占用 (数组、网格、区域图及其组合)"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, trimesh.Trimesh):
+        return value.vertices.nbytes + value.faces.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    if hasattr(value, "labels") and hasattr(value, "codes"):
+        return value.labels.nbytes + value.codes.nbytes
+    return 0
+
+
+def _freeze(value):
+    """缓存的数组设为只读"""
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _freeze(item)
+    elif hasattr(value, "labels") and hasattr(value, "codes"):
+        _freeze(value.labels)
+        _freeze(value.codes)
+    return value
+
+
+class MatchLut:
+    """
+    颜色匹配用的 LUT (命令行使用；GUI 后端直接使用 LutCache 中的 LutBundle，接口相同)
+
+    Attributes:
+        key: LUT 的内容哈希 (lut_store.lut_key)
+        tree: Lab 空间的 cKDTree (区域模式)
+        lut_codes: 层叠编码
+        match_index: 逐像素匹配的颜色索引 (首次使用时构建)
+    """
+
+    def __init__(self, lut_lab, lut_codes, key):
+        self.lut_lab = lut_lab
+        self.lut_codes = lut_codes
+        self.key = key
+        self.tree = cKDTree(lut_lab, leafsize=10)
+        self._match_index = None
+
+    @property
+    def match_index(self):
+        if self._match_index is None:
+            from lut_match_index import LutMatchIndex
+            self._match_index = LutMatchIndex(self.lut_lab)
+        return self._match_index
+
+
+def build_slot_parts(region_map, codec, layer_height, base_height, pixel_size, mesher="contour", double_sided=True,
+                     min_island_mm2=0.0, simplify_tolerance_mm=0.0, workers=0, report=None):
+    """
+    由区域图 + 区域层叠表 (图片方向) 生成每个槽位的零件
+
+    正面 (Top) 与背面 (Bottom) 共用水平镜像后的区域图；背面的 Z 轴倒序由 reverse_layers=True
+    在放置切片时完成。report(stage, percent, **partial) 在各阶段和每个槽位之后调用。
+
+    Returns:
+        MeshResult: (每个槽位的网格列表, 几何清理统计)
+    """
+    from geometry_cleanup import clean_geometry, simplified_triangles
+    from layer_mesher import ContourSimplifier, place_slabs, mesh_base
+    from parallel_mesher import parallel_region_slabs, parallel_mesh_model
+    from region_stack import RegionStackMap
+
+    report = report or (lambda *args, **kwargs: None)
+    cleanup = {"triangles_saved": 0, "simplified_triangles_saved": 0}
+
+    # 计算尺寸
+    h_color_stack = codec.total_layers * layer_height
+    z_back_start = 0.0
+    z_base_start = h_color_stack
+    z_front_start = h_color_stack + base_height
+
+    # 翻转区域图 (形状与像素位置镜像) - axis=1 是水平方向，区域层叠表不变
+    # 底面和原图一致，顶面水平翻转，PEI纹理板打出来更好看
+    region_map = region_map.flip(axis=1)
+
+    # 几何清理: 删除小于最小可打印面积的孤岛/孔洞 (逐像素进行，清理后重新划分区域)
+    if min_island_mm2 > 0:
+        report("cleanup", 25)
+        with instrumentation.stage("cleanup"):
+            cleaned_codes, cleaned_mask, culled = clean_geometry(
+                region_map.code_matrix(), region_map.mask, codec, min_island_mm2, pixel_size,
+                double_sided=double_sided)
+        if culled["pixels_changed"]:
+            region_map = RegionStackMap.from_code_matrix(cleaned_codes, cleaned_mask)
+        cleanup.update(culled)
+        print(f"✂️ 几何清理 (< {culled['min_pixels']} 像素): 孤岛 {culled['mask_islands']} 个，"
+              f"孔洞 {culled['mask_holes']} 个，层内小区域 {culled['slot_islands']} 个，"
+              f"约节省 {culled['triangles_saved']} 个三角形")
+    mask_common = region_map.mask
+    num_slots = codec.num_filaments
+    report("meshing", 30, geometry_cleanup=dict(cleanup))
+
+    if mesher == "greedy":
+        # 背面 + 底座 + 正面整体体素化，每个槽位直接得到一个焊接网格 (按槽位分给进程池)
+        with instrumentation.stage("greedy"):
+            slot_parts = [[mesh] if mesh is not None else []
+                          for mesh in parallel_mesh_model(region_map.code_matrix(), mask_common, codec, layer_height,
+                                                          base_height, pixel_size, double_sided=double_sided,
+                                                          workers=workers)]
+        return MeshResult(slot_parts, cleanup)
+
+    # 轮廓简化的断点由整个模型的像素柱决定，所有层、底座共用
+    simplifier = None
+    if simplify_tolerance_mm > 0:
+        simplifier = ContourSimplifier(region_map.code_columns(), simplify_tolerance_mm / pixel_size)
+    # 连续同槽位的层合并为一段，每个起始层一张标签图 (在区域表上计算后查表)，一次提取所有槽位的边界
+    # 正反两面由相同的段切片组成: 切片只计算一次，两面各自平移 (背面倒序)
+    slabs = parallel_region_slabs(region_map, codec, layer_height, pixel_size, workers=workers,
+                                  simplifier=simplifier)
+    base_part = mesh_base(mask_common, base_height, z_base_start, pixel_size, simplifier)
+
+    # 切片平移到正反两面并按槽位组装零件 (原先的 trimesh 合并，现在由 3MF 流式写出各零件)
+    slot_parts = []
+    with instrumentation.stage("assemble"):
+        back_parts = place_slabs(slabs, codec, z_back_start, layer_height, reverse_layers=True)
+        # 正面 (Top Layer) - 仅在双面模式下生成
+        front_parts = place_slabs(slabs, codec, z_front_start, layer_height) if double_sided else None
+        for i in range(num_slots):
+            report(percent=60 + 10 * i / num_slots)
+            # 1. 背面 (Bottom Layer - 贴床面)
+            parts = list(back_parts[i])
+            # 2. 中间 (仅限 Slot 1 - 白色底座)
+            if i == 0 and base_part is not None:
+                parts.append(base_part)
+            # 3. 正面 (Top Layer)
+            if front_parts is not None:
+                parts.extend(front_parts[i])
+            slot_parts.append(parts)
+    if simplifier is not None:
+        cleanup["simplified_triangles_saved"] = simplified_triangles(mesh for parts in slot_parts for mesh in parts)
+        print(f"📐 轮廓简化 (容差 {simplifier.tolerance * pixel_size:.3f} mm): "
+              f"节省 {cleanup['simplified_triangles_saved']} 个三角形")
+    return MeshResult(slot_parts, cleanup)
+
+
+class ChromaStackPipeline:
+    """
+    各阶段输出按内容哈希缓存的流水线 (线程安全，同一个键同时只会构建一次)
+
+    Args:
+        max_bytes (int): 所有阶段缓存的总内存上限，超出后按最近使用淘汰
+    """
+
+    def __init__(self, max_bytes=PIPELINE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+        self.current_bytes = 0
+        self.evictions = 0
+        self._stage_stats = {stage: {"hits": 0, "misses": 0, "seconds": 0.0} for stage in STAGES}
+
+    def run_stage(self, stage, key, build_fn, trace=None):
+        """
+        获取阶段输出，未缓存时调用 build_fn() 计算
+
+        Args:
+            stage (str): 阶段名
+            key (str): stage_key(...) 计算的内容哈希
+            trace (dict): 记录 {阶段: {'hit': 是否命中, 'seconds': 耗时}}
+
+        Returns:
+            StageResult: (key, 输出)
+        """
+        start = time.perf_counter()
+        cache_key = (stage, key)
+        while True:
+            with self._lock:
+                value = self._entries.get(cache_key)
+                if value is not None:
+                    self._entries.move_to_end(cache_key)
+                    self._stage_stats[stage]["hits"] += 1
+                    hit = True
+                    break
+                event = self._building.get(cache_key)
+                if event is None:
+                    event = threading.Event()
+                    self._building[cache_key] = event
+                    self._stage_stats[stage]["misses"] += 1
+                    hit = False
+                    break
+            # 其他线程正在计算同一个阶段，等待后重新查询
+            event.wait()
+
+        if not hit:
+            try:
+                with instrumentation.stage(stage):
+                    value = _freeze(build_fn())
+                with self._lock:
+                    self._stage_stats[stage]["seconds"] += time.perf_counter() - start
+                    self._insert(cache_key, value)
+            finally:
+                with self._lock:
+                    self._building.pop(cache_key, None)
+                event.set()
+        if trace is not None:
+            trace[stage] = {"hit": hit, "seconds": round(time.perf_counter() - start, 4)}
+        return StageResult(key, value)
+
+    def _insert(self, cache_key, value):
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return   # 单个条目超出预算，不缓存
+        self._entries[cache_key] = value
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= _nbytes(evicted)
+            self.evictions += 1
+
+    # ---------- 各阶段 ----------
+
+    def resize(self, image_key, target_width, load_fn, trace=None):
+        """load_fn(target_width) -> (H, W, 4) uint8 RGBA；image_key 为图片内容的哈希"""
+        key = stage_key("resize", image_key, int(target_width))
+        return self.run_stage("resize", key, lambda: load_fn(int(target_width)), trace)
+
+    def mask(self, image, alpha_threshold, trace=None):
+        key = stage_key("mask", image.key, int(alpha_threshold))
+        return self.run_stage("mask", key, lambda: image.value[..., 3] > alpha_threshold, trace)
+
+    def lab(self, image, mask, trace=None):
+        from color_science import image_to_lab
+
+        # Lab 转换只针对不透明像素中的不同颜色
+        key = stage_key("lab", image.key, mask.key)
+        return self.run_stage("lab", key, lambda: image_to_lab(image.value[..., :3], mask=mask.value), trace)
+
+    def segment(self, image, mask, min_pixel_size, scale, sigma, trace=None):
+        from ChromaStackStudio import generate_regions_felzenszwalb
+
+        key = stage_key("segment", image.key, mask.key, int(min_pixel_size), float(scale), float(sigma))
+        return self.run_stage("segment", key, lambda: generate_regions_felzenszwalb(
+            image.value[..., :3], min_pixel_size=min_pixel_size, scale=scale, sigma=sigma, mask=mask.value
+        ), trace)
+
+    def match_image(self, image_key, target_width, load_fn, lut, alpha_threshold=128, matching_mode="region",
+                    min_pixel_size=5, scale=10, sigma=0.5, min_region_pixels=0, trace=None):
+        """
+        resize -> mask -> (lab, segment) -> match
+
+        Args:
+            lut: MatchLut 或 LutBundle (key / tree / lut_codes / match_index)
+
+        Returns:
+            StageResult: match 阶段输出 MatchResult(区域图 + 区域层叠表, LUT 索引矩阵)
+        """
+        from ChromaStackStudio import region_based_rematching, pixel_based_matching
+
+        image = self.resize(image_key, target_width, load_fn, trace)
+        mask = self.mask(image, alpha_threshold, trace)
+
+        if matching_mode == "pixel":
+            # 逐像素匹配 (颜色索引中重复出现的颜色直接查表)
+            key = stage_key("match", lut.key, image.key, mask.key, "pixel")
+            return self.run_stage("match", key, lambda: MatchResult(*pixel_based_matching(
+                image.value[..., :3], lut.match_index, lut.lut_codes, mask=mask.value, as_region_map=True
+            )), trace)
+
+        lab = self.lab(image, mask, trace)
+        regions = self.segment(image, mask, min_pixel_size, scale, sigma, trace)
+        key = stage_key("match", lut.key, lab.key, regions.key, "region", int(min_region_pixels))
+        return self.run_stage("match", key, lambda: MatchResult(*region_based_rematching(
+            lab.value, regions.value, lut.tree, lut.lut_codes, mask=mask.value,
+            min_region_pixels=min_region_pixels, as_region_map=True
+        )), trace)
+
+    def mesh(self, source_key, region_map, codec, layer_height, base_height, pixel_size, mesher="contour",
+             double_sided=True, min_island_mm2=0.0, simplify_tolerance_mm=0.0, workers=0, report=None, trace=None):
+        """
+        几何清理 + 网格生成 (参数见 build_slot_parts)；source_key 为区域图的键 (match 阶段或层叠图文件的哈希)
+        工作进程数不影响输出，不计入键
+        """
+        key = stage_key("mesh", source_key, codec.num_filaments, codec.total_layers, float(layer_height),
+                        float(base_height), float(pixel_size), mesher, bool(double_sided), float(min_island_mm2),
+                        float(simplify_tolerance_mm))
+        return self.run_stage("mesh", key, lambda: build_slot_parts(
+            region_map, codec, layer_height, base_height, pixel_size, mesher=mesher, double_sided=double_sided,
+            min_island_mm2=min_island_mm2, simplify_tolerance_mm=simplify_tolerance_mm, workers=workers,
+            report=report
+        ), trace)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        获取各阶段的缓存统计
+
+        Returns:
+            dict: 每个阶段的命中/未命中次数、命中率、累计与平均计算耗时，以及缓存条目数和内存占用
+        """
+        with self._lock:
+            stages = {}
+            for stage, s in self._stage_stats.items():
+                total = s["hits"] + s["misses"]
+                stages[stage] = {
+                    "hits": s["hits"],
+                    "misses": s["misses"],
+                    "hit_rate": s["hits"] / total if total else 0.0,
+                    "seconds": round(s["seconds"], 3),
+                    "avg_seconds": round(s["seconds"] / s["misses"], 4) if s["misses"] else 0.0,
+                    "entries": sum(1 for stage_name, _ in self._entries if stage_name == stage),
+                }
+            return {
+                "stages": stages,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,131 @@
+"""
+区域级层叠表示
+
+区域匹配的结果本来就是 "每个区域一个层叠": 把它广播成 (H, W) 编码矩阵后，网格阶段再解码成
+(H, W, L) 体素、逐层逐像素比较，做的都是区域表上早已确定的事。这里保留区域图 + 区域层叠表作为
+规范产物:
+    labels   (H, W) 区域 ID (0 为不打印)
+    codes    (R+1,) 每个区域的层叠编码 (第 0 项为背景，不使用)
+相邻且层叠相同的区域通过区域邻接图 (RAG) 合并为一个区域，区域数通常远小于分割得到的数量。
+网格阶段每层的段标签先在区域表上计算 (R+1 行)，再按区域图查表得到 (见 layer_mesher.region_layer_slabs)，
+不再生成整张体素。需要逐像素编码的步骤 (几何清理、贪心体素网格、层叠图导出) 用 code_matrix() 展开。
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from skimage.measure import label as label_components
+
+
+def _adjacent_pairs(labels):
+    """4 邻接、ID 不同且都不是背景的相邻区域对 (a, b)"""
+    pairs = []
+    for a, b in ((labels[:, :-1], labels[:, 1:]), (labels[:-1, :], labels[1:, :])):
+        edge = (a != b) & (a > 0) & (b > 0)
+        pairs.append(np.stack([a[edge], b[edge]], axis=1))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def merge_same_stack_regions(labels, codes):
+    """
+    区域邻接图上合并层叠相同的相邻区域
+
+    Args:
+        labels: (H, W) 区域 ID，0 为背景
+        codes: (max_id+1,) 区域 ID -> 层叠编码
+
+    Returns:
+        tuple: (新区域图 (H, W) int32，ID 连续从 1 开始, 新层叠表 (R+1,))
+    """
+    num_ids = len(codes)
+    pairs = _adjacent_pairs(labels)
+    pairs = pairs[codes[pairs[:, 0]] == codes[pairs[:, 1]]]
+    graph = sparse.coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+                              shape=(num_ids, num_ids))
+    _, component = connected_components(graph, directed=False)
+
+    # 只给实际出现的区域编号 (背景固定为 0)
+    present = np.zeros(num_ids, dtype=bool)
+    present[np.unique(labels)] = True
+    present[0] = False
+    used, first = np.unique(component[present], return_index=True)
+    remap = np.zeros(component.max() + 1, dtype=np.int32)
+    remap[used] = np.arange(1, len(used) + 1, dtype=np.int32)
+    id_map = np.where(present, remap[component], 0).astype(np.int32)
+
+    merged_codes = np.zeros(len(used) + 1, dtype=codes.dtype)
+    merged_codes[1:] = codes[np.flatnonzero(present)[first]]
+    return id_map[labels], merged_codes
+
+
+class RegionStackMap:
+    """
+    区域图 + 区域层叠表
+
+    Attributes:
+        labels: (H, W) int32 区域 ID，0 为不打印
+        codes: (R+1,) 区域层叠编码，codes[0] 不使用
+    """
+
+    def __init__(self, labels, codes):
+        self.labels = labels
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes) - 1
+
+    @property
+    def shape(self):
+        return self.labels.shape
+
+    @property
+    def mask(self):
+        """(H, W) 可打印像素"""
+        return self.labels > 0
+
+    @classmethod
+    def from_regions(cls, regions, region_codes, mask=None, merge=True):
+        """
+        由分割区域图与区域 ID -> 层叠编码的映射表构建 (mask 之外的像素记为背景)
+        merge 为 True 时合并层叠相同的相邻区域
+        """
+        labels = np.where(regions > 0 if mask is None else mask & (regions > 0), regions, 0).astype(np.int32)
+        codes = np.asarray(region_codes)
+        if merge:
+            return cls(*merge_same_stack_regions(labels, codes))
+        return cls(labels, codes)
+
+    @classmethod
+    def from_code_matrix(cls, stack_codes_matrix, solid_mask_2d):
+        """由逐像素层叠编码构建: 每个 4 邻接的同编码连通区域为一个区域 (逐像素匹配、层叠图导入)"""
+        codes = np.asarray(stack_codes_matrix)
+        # 编码 + 1 使编码 0 不被当作背景
+        labels = label_components(np.where(solid_mask_2d, codes.astype(np.int64) + 1, 0),
+                                  background=0, connectivity=1).astype(np.int32)
+        table = np.zeros(int(labels.max()) + 1, dtype=codes.dtype)
+        table[labels[solid_mask_2d]] = codes[solid_mask_2d]
+        return cls(labels, table)
+
+    def code_matrix(self):
+        """展开为 (H, W) 层叠编码矩阵 (背景为 0)"""
+        table = self.codes.copy()
+        table[0] = 0
+        return table[self.labels]
+
+    def code_columns(self):
+        """(H, W) int64 层叠编码，背景为 -1 (ContourSimplifier 的像素柱)"""
+        table = self.codes.astype(np.int64)
+        table[0] = -1
+        return table[self.labels]
+
+    def flip(self, axis=1):
+        """区域图镜像 (层叠表不变)"""
+        return RegionStackMap(np.flip(self.labels, axis=axis), self.codes)
+
+    def slot_table(self, codec, reverse_layers=False):
+        """(R+1, L) int16 区域各层槽位，第 0 行 (背景) 为 -1"""
+        table = codec.decode(self.codes).astype(np.int16)
+        if reverse_layers:
+            table = table[:, ::-1]
+        table[0] = -1
+        return table
@@ -0,0 +1,70 @@
+"""greedy_mesher: 每个槽位的网格封闭、定向一致，体积与体素数一致 (含只在棱/角上相接的体素)"""
+
+import numpy as np
+import pytest
+
+from ChromaStackStudio import StackCodec
+from greedy_mesher import mesh_model, mesh_slot_volume, model_volume
+
+PIXEL_SIZE = 0.2
+
+
+def expected_volumes(volume, num_slots, z_levels, pixel_size=PIXEL_SIZE):
+    """每个槽位的体素体积之和"""
+    thickness = np.diff(z_levels)
+    return [float((volume == slot).sum(axis=(0, 1)) @ thickness) * pixel_size ** 2 for slot in range(num_slots)]
+
+
+def assert_closed_parts(volume, num_slots, z_levels, meshes):
+    assert len(meshes) == num_slots
+    for slot, (mesh, expected) in enumerate(zip(meshes, expected_volumes(volume, num_slots, z_levels))):
+        if expected == 0:
+            assert mesh is None
+            continue
+        assert mesh.is_watertight, f"槽位 {slot} 不封闭"
+        assert mesh.is_winding_consistent, f"槽位 {slot} 定向不一致"
+        assert mesh.volume == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("double_sided", [True, False])
+def test_random_model_volume(seed, double_sided):
+    rng = np.random.default_rng(seed)
+    codec = StackCodec(int(rng.integers(2, 5)), int(rng.integers(2, 5)))
+    H, W = rng.integers(4, 14, size=2)
+    codes = rng.integers(0, codec.num_codes, (H, W)).astype(codec.dtype)
+    # 随机掩码: 孤立像素、孔洞以及只在角上相接的实心像素
+    mask = rng.random((H, W)) > 0.3
+    volume, z_levels = model_volume(codes, mask, codec, 0.08, 0.8, double_sided=double_sided)
+    meshes = mesh_model(codes, mask, codec, 0.08, 0.8, PIXEL_SIZE, double_sided=double_sided)
+    assert_closed_parts(volume, codec.num_filaments, z_levels, meshes)
+
+
+def test_checkerboard_diagonal_contacts():
+    """三维棋盘: 同槽位的体素两两只在棱或角上相接"""
+    idx = np.indices((5, 6, 4)).sum(axis=0)
+    volume = (idx % 2).astype(np.int16)
+    z_levels = np.array([0.0, 0.08, 0.16, 0.96, 1.04])
+    assert_closed_parts(volume, 2, z_levels, mesh_slot_volume(volume, 2, PIXEL_SIZE, z_levels))
+
+
+@pytest.mark.parametrize("offset", [(1, 1, 0), (1, 0, 1), (0, 1, 1), (1, 1, 1)])
+def test_edge_and_corner_contact(offset):
+    """两个同槽位体素只共享一条棱或一个顶点，其余为空气"""
+    volume = np.full((2, 2, 2), -1, dtype=np.int16)
+    volume[0, 0, 0] = 0
+    volume[offset] = 0
+    z_levels = np.array([0.0, 0.08, 0.16])
+    assert_closed_parts(volume, 1, z_levels, mesh_slot_volume(volume, 1, PIXEL_SIZE, z_levels))
+
+
+@pytest.mark.parametrize("seed", range(320))
+def test_random_sparse_volume(seed):
+    """稀疏随机体素 (大量空气): 棱/角接触、T 型接点和孔洞同时出现, 部分种子需要沿共享棱拆分面片才能封闭"""
+    rng = np.random.default_rng(seed)
+    shape = tuple(int(n) for n in rng.integers(3, 10, 3))
+    num_slots = int(rng.integers(1, 4))
+    volume = rng.integers(-1, num_slots, shape).astype(np.int16)
+    volume[rng.random(shape) < rng.uniform(0.2, 0.7)] = -1
+    z_levels = np.concatenate([[0.0], np.cumsum(rng.choice([0.08, 0.8], size=shape[2]))])
+    assert_closed_parts(volume, num_slots, z_levels, mesh_slot_volume(volume, num_slots, PIXEL_SIZE, z_levels))
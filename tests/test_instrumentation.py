@@ -0,0 +1,175 @@
+"""instrumentation: 阶段累加与嵌套、工作进程记录的合并、Prometheus 直方图、没有记录器时的空上下文"""
+
+import pickle
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import instrumentation
+from instrumentation import SECONDS_BUCKETS, StageHistograms, StageRecorder
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def parse_metrics(text):
+    """Prometheus 文本 -> {'名称{标签}': 值}"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_nested_and_repeated_stages():
+    with instrumentation.recording() as recorder:
+        assert instrumentation.current_recorder() is recorder
+        with instrumentation.stage('outer'):
+            for _ in range(3):
+                with instrumentation.stage('inner'):
+                    busy(0.005)
+        with instrumentation.stage('inner'):
+            busy(0.005)
+    assert instrumentation.current_recorder() is None
+
+    assert list(recorder.stages) == ['inner', 'outer']   # 按首次结束的顺序
+    inner_count, inner_wall, inner_cpu, inner_peak = recorder.stages['inner']
+    outer_count, outer_wall, _, outer_peak = recorder.stages['outer']
+    assert (inner_count, outer_count) == (4, 1)
+    assert inner_wall >= 0.02 and inner_cpu > 0
+    # 外层包含其中三次内层
+    assert outer_wall >= 3 * 0.005
+    assert inner_peak is None and outer_peak is None
+
+    info = recorder.to_dict()
+    assert info['inner']['count'] == 4 and info['inner']['peak_bytes'] is None
+    assert info['inner']['wall_ms'] == round(inner_wall * 1000, 2)
+    header = recorder.server_timing()
+    assert header.startswith('inner;dur=') and 'n=4' in header and ', outer;dur=' in header
+
+
+def test_trace_memory_peaks():
+    """内层的峰值计入外层；最后一个使用者退出后停止 tracemalloc"""
+    assert not tracemalloc.is_tracing()
+    with instrumentation.recording(trace_memory=True) as recorder:
+        with instrumentation.stage('outer'):
+            with instrumentation.stage('alloc'):
+                block = np.ones(4 << 20, dtype=np.uint8)
+                del block
+            with instrumentation.stage('small'):
+                pass
+    assert not tracemalloc.is_tracing()
+    assert recorder.stages['alloc'][3] >= 4 << 20
+    assert recorder.stages['small'][3] < 1 << 20
+    assert recorder.stages['outer'][3] >= recorder.stages['alloc'][3]
+
+
+def test_recorders_are_per_thread_and_nest():
+    seen = []
+    with instrumentation.recording() as outer:
+        thread = threading.Thread(target=lambda: seen.append(instrumentation.current_recorder()))
+        thread.start()
+        thread.join()
+        with instrumentation.recording() as inner:
+            with instrumentation.stage('lut'):
+                pass
+        assert instrumentation.current_recorder() is outer
+    assert seen == [None]
+    assert 'lut' in inner.stages and 'lut' not in outer.stages
+
+
+def test_merge_worker_records():
+    """工作进程的 records() 可序列化，合并后次数和耗时相加、峰值取最大"""
+    worker = StageRecorder()
+    worker.add('extrude', 0.5, 0.4, peak_bytes=100)
+    worker.add('extrude', 0.25, 0.2, peak_bytes=300)
+    worker.add('contour', 0.1, 0.1)
+    records = pickle.loads(pickle.dumps(worker.records()))
+    assert records == [('extrude', 2, 0.75, pytest.approx(0.6), 300), ('contour', 1, 0.1, 0.1, None)]
+
+    # 没有记录器时忽略
+    instrumentation.merge(records)
+    with instrumentation.recording() as recorder:
+        recorder.add('extrude', 1.0, 1.0, peak_bytes=200)
+        instrumentation.merge(records)
+        instrumentation.merge(None)
+    assert recorder.stages['extrude'] == [3, 1.75, pytest.approx(1.6), 300]
+    assert recorder.stages['contour'] == [1, 0.1, 0.1, None]
+
+
+def test_merge_from_process_pool(monkeypatch):
+    """进程池中记录的轮廓提取与拉伸阶段合并到主进程，次数与单进程相同"""
+    import parallel_mesher
+    from ChromaStackStudio import StackCodec
+    from layer_mesher import layer_slabs
+
+    rng = np.random.default_rng(0)
+    codec = StackCodec(3, 4)
+    codes = rng.integers(0, codec.num_codes, (12, 16)).astype(codec.dtype)
+    mask = rng.random(codes.shape) > 0.2
+    with instrumentation.recording() as serial:
+        layer_slabs(codes, mask, codec, 0.08, 0.2)
+
+    monkeypatch.setattr(parallel_mesher, 'PARALLEL_MIN_VOXELS', 0)
+    try:
+        with instrumentation.recording() as parallel:
+            parallel_mesher.parallel_layer_slabs(codes, mask, codec, 0.08, 0.2, workers=2)
+    finally:
+        parallel_mesher.shutdown_pool()
+    assert {name: entry[0] for name, entry in parallel.stages.items()} == \
+           {name: entry[0] for name, entry in serial.stages.items()} == {'contour': 4, 'extrude': 4}
+
+
+def test_histogram_render():
+    histograms = StageHistograms()
+    for wall in (0.02, 0.4, 1000.0):
+        recorder = StageRecorder()
+        recorder.add('match', wall, wall / 2)
+        histograms.observe('preview', recorder, job_seconds=wall + 0.1)
+    recorder = StageRecorder()
+    recorder.add('mesh', 0.003, 0.003, peak_bytes=3 << 20)
+    histograms.observe('generate', recorder)
+
+    text = histograms.render()
+    samples = parse_metrics(text)
+    assert '# TYPE chromastack_stage_wall_seconds histogram' in text
+    prefix = 'chromastack_stage_wall_seconds_bucket{kind="preview",stage="match",le='
+    buckets = [(line.split('le="')[1].split('"')[0], samples[line.split(' ')[0]])
+               for line in text.splitlines() if line.startswith(prefix)]
+    assert [le for le, _ in buckets] == [repr(float(bound)) for bound in SECONDS_BUCKETS] + ['+Inf']
+    counts = [count for _, count in buckets]
+    assert counts == sorted(counts)   # 累积计数
+    assert samples[prefix + '"0.01"}'] == 0
+    assert samples[prefix + '"0.025"}'] == 1
+    assert samples[prefix + '"0.5"}'] == 2
+    assert samples[prefix + '"300.0"}'] == 2
+    assert samples[prefix + '"+Inf"}'] == 3   # 超出最大桶的值只计入 +Inf
+    assert samples['chromastack_stage_wall_seconds_count{kind="preview",stage="match"}'] == 3
+    assert samples['chromastack_stage_wall_seconds_sum{kind="preview",stage="match"}'] == pytest.approx(1000.42)
+    assert samples['chromastack_job_wall_seconds_count{kind="preview"}'] == 3
+
+    # 只有记录了峰值的阶段才有内存直方图
+    assert samples['chromastack_stage_peak_bytes_bucket{kind="generate",stage="mesh",le="1048576.0"}'] == 0
+    assert samples['chromastack_stage_peak_bytes_bucket{kind="generate",stage="mesh",le="4194304.0"}'] == 1
+    assert not any('stage_peak_bytes' in name and 'preview' in name for name in samples)
+    assert not any('job_wall_seconds' in name and 'generate' in name for name in samples)
+
+
+def test_stage_without_recorder_is_shared_noop():
+    assert not instrumentation.is_recording()
+    first, second = instrumentation.stage('lut'), instrumentation.stage('mesh')
+    assert first is second is instrumentation._NULL_STAGE
+    with first as entered:
+        assert entered is first
+    with pytest.raises(ValueError):
+        with instrumentation.stage('lut'):
+            raise ValueError('不吞掉异常')
+    with instrumentation.recording():
+        assert instrumentation.stage('lut') is not instrumentation._NULL_STAGE
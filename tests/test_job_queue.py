@@ -0,0 +1,148 @@
+"""后台任务队列: 取消 (排队中 / 下一个检查点)、队列上限、已结束任务的保留数和按类型的统计"""
+
+import threading
+
+import pytest
+
+from GUI.backend.utils.job_queue import CANCELLED, FAILED, QUEUED, SUCCEEDED, JobCancelled, JobQueue, QueueFull
+
+TIMEOUT = 5
+
+
+def blocking(release):
+    """占住工作线程直到 release 被设置"""
+    def fn(job):
+        assert release.wait(TIMEOUT)
+        return {'success': True}, 200
+    return fn
+
+
+def quick(job, value=1):
+    return {'success': True, 'value': value}, 200
+
+
+def test_cancel_queued_job():
+    queue = JobQueue(workers=1, max_pending=4, history=10)
+    release, calls = threading.Event(), []
+    running = queue.submit('generate', blocking(release))
+    queued = queue.submit('generate', lambda job: calls.append(job) or ({}, 200))
+    assert queued.state == QUEUED
+
+    assert queue.cancel(queued.id) is queued
+    release.set()
+    assert running.wait(TIMEOUT) and queued.wait(TIMEOUT)
+    assert running.state == SUCCEEDED
+    assert queued.state == CANCELLED and queued.status_code == 499
+    assert queued.result == {'error': '任务已取消', 'job_id': queued.id}
+    assert calls == []   # 任务函数没有运行
+    assert queue.cancel('missing') is None
+
+
+def test_cancel_at_next_checkpoint():
+    queue = JobQueue(workers=1, max_pending=4, history=10)
+    started, resume, reached = threading.Event(), threading.Event(), []
+
+    def fn(job):
+        job.report('meshing', 40, triangles=123)
+        started.set()
+        assert resume.wait(TIMEOUT)
+        reached.append('before')
+        job.report('export', 90)   # 检查点: 已取消时抛出 JobCancelled
+        reached.append('after')
+        return {'success': True}, 200
+
+    job = queue.submit('generate', fn)
+    assert started.wait(TIMEOUT)
+    queue.cancel(job.id)
+    assert job.cancel_requested and job.state != CANCELLED   # 运行到检查点之前不会停止
+    resume.set()
+    assert job.wait(TIMEOUT)
+
+    assert reached == ['before']
+    assert job.state == CANCELLED and job.status_code == 499
+    info = job.to_dict()
+    assert info['state'] == info['stage'] == CANCELLED
+    assert info['cancel_requested'] and info['status_code'] == 499
+    assert info['partial'] == {'triangles': 123} and info['percent'] == 40.0
+    assert list(info['timing']['stages']) == ['preparing', 'meshing']
+
+    # 已结束的任务不能再取消
+    done = queue.submit('preview', quick)
+    assert done.wait(TIMEOUT)
+    queue.cancel(done.id)
+    assert not done.cancel_requested and done.state == SUCCEEDED
+
+
+def test_report_raises_after_cancel():
+    queue = JobQueue(workers=1, max_pending=1, history=1)
+    release = threading.Event()
+    job = queue.submit('preview', blocking(release))
+    queue.cancel(job.id)
+    with pytest.raises(JobCancelled):
+        job.report('lut', 10)
+    release.set()
+    assert job.wait(TIMEOUT)
+
+
+def test_queue_full():
+    """排队 + 运行中的任务数达到 max_pending 时拒绝提交，有任务结束后恢复"""
+    queue = JobQueue(workers=1, max_pending=2, history=10)
+    release = threading.Event()
+    jobs = [queue.submit('generate', blocking(release)) for _ in range(2)]
+    with pytest.raises(QueueFull):
+        queue.submit('preview', quick)
+    assert queue.stats()['queued'] + queue.stats()['running'] == 2
+
+    release.set()
+    assert all(job.wait(TIMEOUT) for job in jobs)
+    assert queue.submit('preview', quick).wait(TIMEOUT)
+
+
+def test_history_keeps_recent_finished_jobs():
+    """只保留最近结束的 history 个任务 (按结束顺序)，未结束的任务不删除"""
+    queue = JobQueue(workers=2, max_pending=8, history=2)
+    release = threading.Event()
+    running = queue.submit('generate', blocking(release))
+    finished = []
+    for value in range(4):
+        job = queue.submit('preview', quick, value)
+        assert job.wait(TIMEOUT)
+        finished.append(job)
+
+    kept = [info['job_id'] for info in queue.list_jobs()]
+    assert kept == [running.id, finished[2].id, finished[3].id]
+    assert queue.get(finished[0].id) is None
+    assert all('result' not in info for info in queue.list_jobs())
+
+    release.set()
+    assert running.wait(TIMEOUT)
+    assert [info['job_id'] for info in queue.list_jobs()] == [finished[3].id, running.id]
+
+
+def test_stats_per_kind():
+    queue = JobQueue(workers=2, max_pending=8, history=10)
+
+    def staged(job):
+        job.report('matching', 50)
+        job.report('preview', 80)
+        return {'success': True}, 200
+
+    def rejected(job):
+        return {'error': '参数错误'}, 400
+
+    def crashed(job):
+        raise RuntimeError('boom')
+
+    jobs = [queue.submit('preview', staged), queue.submit('preview', rejected), queue.submit('generate', crashed)]
+    assert all(job.wait(TIMEOUT) for job in jobs)
+    assert jobs[1].state == FAILED and jobs[1].error == '参数错误' and jobs[1].status_code == 400
+    assert jobs[2].state == FAILED and jobs[2].error == 'boom' and jobs[2].status_code == 500
+
+    stats = queue.stats()
+    assert (stats['workers'], stats['max_pending'], stats['queued'], stats['running']) == (2, 8, 0, 0)
+    preview, generate = stats['kinds']['preview'], stats['kinds']['generate']
+    assert preview['count'] == 2 and preview['states'] == {SUCCEEDED: 1, FAILED: 1}
+    assert generate['count'] == 1 and generate['states'] == {FAILED: 1}
+    assert set(preview['avg_stage_seconds']) == {'preparing', 'matching', 'preview'}
+    assert set(generate['avg_stage_seconds']) == {'preparing'}
+    assert all(value >= 0 for value in (preview['avg_queue_seconds'], preview['avg_run_seconds']))
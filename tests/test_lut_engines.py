@@ -0,0 +1,110 @@
+"""LUT 引擎: 前缀共享、折半合成与稀疏 LUT 都与逐个层叠的 K-M 递推 (float64) 一致"""
+
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+from ChromaStackStudio import (
+    BACKING_REFLECTANCE,
+    LAYER_HEIGHT,
+    StackCodec,
+    VirtualPhysics,
+    linear_to_srgb_bytes,
+    load_inventory,
+)
+
+INVENTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "my_filament_example.json")
+
+
+@pytest.fixture(scope="module")
+def inventory():
+    filaments = load_inventory(INVENTORY)
+    assert len(filaments) >= 5
+    return filaments
+
+
+def reference_reflectance(filaments, total_layers):
+    """逐个层叠 (itertools.product 顺序) 从底座开始逐层套用 km_reflectance_vectorized，float64"""
+    Ks = np.array([f['FILAMENT_K'] for f in filaments], dtype=np.float64)
+    Ss = np.array([f['FILAMENT_S'] for f in filaments], dtype=np.float64)
+    stacks = np.array(list(itertools.product(range(len(filaments)), repeat=total_layers)))
+    R = np.broadcast_to(BACKING_REFLECTANCE.astype(np.float64), (len(stacks), 3))
+    for layer_idx in range(total_layers):
+        slot = stacks[:, layer_idx]
+        R = VirtualPhysics.km_reflectance_vectorized(Ks[slot], Ss[slot], LAYER_HEIGHT, R)
+    return R
+
+
+def assert_srgb_close(lut_colors, reference):
+    """float32 与 float64 截断取整后最多差 1 级"""
+    assert lut_colors.dtype == np.uint8
+    assert lut_colors.shape == reference.shape
+    assert np.abs(lut_colors.astype(np.int16) - reference.astype(np.int16)).max() <= 1
+
+
+@pytest.mark.parametrize("total_layers", [4, 5, 6])
+@pytest.mark.parametrize("num_filaments", [3, 5])
+@pytest.mark.parametrize("method", ["prefix", "mitm"])
+def test_full_lut_matches_reference(inventory, method, num_filaments, total_layers):
+    filaments = inventory[:num_filaments]
+    reference = reference_reflectance(filaments, total_layers)
+    lut_colors, lut_codes = VirtualPhysics().generate_lut_km(filaments, total_layers, method=method)
+    assert_srgb_close(lut_colors, linear_to_srgb_bytes(reference))
+    codec = StackCodec(num_filaments, total_layers)
+    assert lut_codes.dtype == codec.dtype
+    np.testing.assert_array_equal(lut_codes, np.arange(codec.num_codes))
+
+
+@pytest.mark.parametrize("total_layers", [4, 5, 6])
+def test_prefix_reflectance_matches_reference(inventory, total_layers):
+    filaments = inventory[:4]
+    Ks = np.array([f['FILAMENT_K'] for f in filaments], dtype=np.float32)
+    Ss = np.array([f['FILAMENT_S'] for f in filaments], dtype=np.float32)
+    R = VirtualPhysics()._prefix_reflectance(Ks, Ss, total_layers, LAYER_HEIGHT, BACKING_REFLECTANCE)
+    np.testing.assert_allclose(R, reference_reflectance(filaments, total_layers), rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize("total_layers", [5, 6])
+def test_mitm_chunks_cover_all_codes(inventory, total_layers):
+    """块大小不整除时各块首尾相接，拼起来与不分块的结果相同"""
+    filaments = inventory[:4]
+    physics = VirtualPhysics()
+    full, _ = physics.generate_lut_km(filaments, total_layers, method="mitm")
+    parts, expected_start = [], 0
+    for start, chunk in physics.iter_lut_chunks_mitm(filaments, total_layers, chunk_combos=37):
+        assert start == expected_start
+        parts.append(chunk)
+        expected_start += len(chunk)
+    assert expected_start == len(full)
+    np.testing.assert_array_equal(np.concatenate(parts), full)
+
+
+@pytest.mark.parametrize("total_layers", [4, 5, 6])
+@pytest.mark.parametrize("constraints", [
+    dict(max_distinct=2),
+    dict(max_changes=1),
+    dict(max_distinct=3, max_changes=2, base_slot=0),
+])
+def test_sparse_rows_match_full_lut(inventory, total_layers, constraints):
+    filaments = inventory[:4]
+    physics = VirtualPhysics()
+    full_colors, _ = physics.generate_lut_km(filaments, total_layers, method="prefix")
+    sparse_colors, sparse_codes = physics.generate_lut_sparse(filaments, total_layers, **constraints)
+    assert np.all(np.diff(sparse_codes.astype(np.int64)) > 0)
+    np.testing.assert_array_equal(sparse_colors, full_colors[sparse_codes])
+
+    slots = StackCodec(len(filaments), total_layers).decode(sparse_codes)
+    if 'max_changes' in constraints:
+        assert np.count_nonzero(slots[:, 1:] != slots[:, :-1], axis=1).max() <= constraints['max_changes']
+    if 'max_distinct' in constraints:
+        assert max(len(set(row)) for row in slots.tolist()) <= constraints['max_distinct']
+    if 'base_slot' in constraints:
+        assert np.all(slots[:, 0] == constraints['base_slot'])
+
+    # ΔE 合并只挑代表，不改变颜色
+    merged_colors, merged_codes = physics.generate_lut_sparse(filaments, total_layers, merge_delta_e=2.0, **constraints)
+    assert np.isin(merged_codes, sparse_codes).all()
+    assert len(merged_codes) < len(sparse_codes)
+    np.testing.assert_array_equal(merged_colors, full_colors[merged_codes])
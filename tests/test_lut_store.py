@@ -0,0 +1,125 @@
+"""lut_store: 缓存键包含实际使用的引擎，写入原子、读取为只读内存映射，按 meta.json 的修改时间淘汰"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import lut_store
+from ChromaStackStudio import MITM_MIN_LAYERS, load_inventory
+from lut_store import LutStore, lut_key, lut_method
+
+INVENTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "my_filament_example.json")
+
+
+@pytest.fixture(scope="module")
+def filaments():
+    return load_inventory(INVENTORY)[:3]
+
+
+def fake_lut(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.integers(0, 256, (rows, 3)).astype(np.uint8), rng.random((rows, 3)), np.arange(rows, dtype=np.uint16))
+
+
+def entry_files(store, key):
+    return sorted(os.listdir(os.path.join(store.root, key)))
+
+
+def test_key_includes_resolved_method(filaments):
+    layers = MITM_MIN_LAYERS
+    assert lut_key(filaments, layers, method="prefix") != lut_key(filaments, layers, method="mitm")
+    # "auto" 与它解析出的引擎是同一个条目
+    assert lut_key(filaments, layers, method="auto") == lut_key(filaments, layers, method="mitm")
+    assert lut_key(filaments, layers - 1, method="auto") == lut_key(filaments, layers - 1, method="prefix")
+    # 稀疏 LUT 不使用完整 LUT 的引擎
+    sparse = {'max_changes': 1}
+    assert lut_method(layers, sparse, "prefix") == "sparse"
+    assert lut_key(filaments, layers, sparse=sparse, method="prefix") == lut_key(filaments, layers, sparse=sparse,
+                                                                                method="mitm")
+    assert lut_key(filaments, layers, sparse=sparse) != lut_key(filaments, layers)
+    with pytest.raises(ValueError):
+        lut_key(filaments, layers, method="fast")
+
+
+@pytest.mark.parametrize("method, expected", [("prefix", "prefix"), ("mitm", "mitm"), ("auto", "prefix")])
+def test_get_or_build_records_method(tmp_path, filaments, method, expected):
+    store = LutStore(str(tmp_path))
+    lut_rgb, _, lut_codes = store.get_or_build(filaments, 4, method=method)
+    assert len(lut_rgb) == len(lut_codes) == 3 ** 4
+
+    key = lut_key(filaments, 4, method=method)
+    with open(os.path.join(store.root, key, "meta.json"), encoding='utf-8') as f:
+        meta = json.load(f)
+    assert meta['method'] == expected
+    assert meta['key'] == key and meta['version'] == lut_store.STORE_VERSION
+    assert meta['filaments'] == [f['Name'] for f in filaments]
+
+
+def test_put_is_atomic(tmp_path, monkeypatch):
+    store = LutStore(str(tmp_path))
+    arrays = fake_lut(10)
+
+    # 写到一半出错: 不留下条目，也不留下临时目录
+    real_save = np.save
+    calls = []
+
+    def failing_save(path, arr):
+        calls.append(path)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        real_save(path, arr)
+
+    monkeypatch.setattr(np, "save", failing_save)
+    store.put("a" * 64, *arrays)
+    monkeypatch.setattr(np, "save", real_save)
+    assert os.listdir(store.root) == []
+    assert store.get("a" * 64) is None
+
+    store.put("a" * 64, *arrays)
+    assert os.listdir(store.root) == ["a" * 64]
+    assert entry_files(store, "a" * 64) == ["lut_codes.npy", "lut_lab.npy", "lut_rgb.npy", "meta.json"]
+
+    # 已存在的条目不会被覆盖 (另一个进程抢先写入时同样丢弃临时目录)
+    store.put("a" * 64, *fake_lut(10, seed=1))
+    np.testing.assert_array_equal(store.get("a" * 64)[0], arrays[0])
+    os.makedirs(os.path.join(store.root, "b" * 64, "other"))
+    store.put("b" * 64, *arrays)
+    assert sorted(os.listdir(store.root)) == ["a" * 64, "b" * 64]
+
+
+def test_get_returns_read_only_mmap(tmp_path):
+    store = LutStore(str(tmp_path))
+    arrays = fake_lut(16)
+    store.put("c" * 64, *arrays)
+    loaded = store.get("c" * 64)
+    for original, mapped in zip(arrays, loaded):
+        assert isinstance(mapped, np.memmap)
+        assert mapped.mode == 'r' and not mapped.flags.writeable
+        np.testing.assert_array_equal(mapped, original)
+    with pytest.raises(ValueError):
+        loaded[0][0] = 0
+    assert store.get("d" * 64) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = LutStore(str(tmp_path))
+    keys = [str(i) * 64 for i in range(4)]
+    for i, key in enumerate(keys[:3]):
+        store.put(key, *fake_lut(1000, seed=i))
+        os.utime(os.path.join(store.root, key, "meta.json"), (1000 + i, 1000 + i))
+    # meta.json 含时间戳，各条目大小相差几个字节
+    entry_bytes = max(size for _, size, _ in store.entries())
+
+    # 读取刷新访问时间: 最旧的条目 0 变为最新，超出上限时先删除条目 1
+    store.get(keys[0])
+    assert store.evict(store.total_bytes() - 1) == 1
+    assert sorted(key for key, _, _ in store.entries()) == [keys[0], keys[2]]
+
+    # 写入超出容量时自动淘汰
+    store.max_bytes = 2 * entry_bytes + 64
+    os.utime(os.path.join(store.root, keys[0], "meta.json"), (2000, 2000))
+    store.put(keys[3], *fake_lut(1000, seed=3))
+    assert sorted(key for key, _, _ in store.entries()) == [keys[0], keys[3]]
+    assert store.total_bytes() <= store.max_bytes
@@ -0,0 +1,228 @@
+"""model_export: 流式 3MF (多零件、核心命名空间的 basematerials、挤出机映射)、二进制 STL 与层叠图 (.npz)"""
+
+import os
+import xml.etree.ElementTree as ET
+import zipfile
+
+import numpy as np
+import pytest
+import trimesh
+
+from ChromaStackStudio import StackCodec
+from model_export import (
+    CORE_NS,
+    MODEL_PATH,
+    SETTINGS_PATH,
+    STL_DTYPE,
+    load_stack_map,
+    part_name,
+    save_stack_map,
+    write_3mf,
+    write_stl,
+    write_stl_parts,
+)
+
+NS = {'m': CORE_NS}
+NAMES = ['Jade White', 'Black', 'Cyan Blue']
+COLORS = ['#F5F5F0', '#000000', '#00aeef']
+
+
+@pytest.fixture
+def slot_parts():
+    """槽位 0 两个网格 (分开写出，不合并)，槽位 1 为空，槽位 2 一个网格"""
+    box = trimesh.creation.box((1.0, 1.0, 0.5))
+    bar = trimesh.creation.box((2.0, 0.4, 0.5))
+    bar.apply_translation((3.0, 0.0, 0.0))
+    sphere = trimesh.creation.icosphere(subdivisions=2)
+    sphere.apply_translation((0.0, 4.0, 0.0))
+    return [[box, bar], [], [sphere]]
+
+
+def read_model(path):
+    with zipfile.ZipFile(path) as archive:
+        return ET.fromstring(archive.read(MODEL_PATH)), ET.fromstring(archive.read(SETTINGS_PATH))
+
+
+def test_3mf_round_trip(tmp_path, slot_parts):
+    path = tmp_path / 'model.3mf'
+    reports = []
+    stats = write_3mf(path, slot_parts, NAMES, COLORS, on_part=lambda done, total: reports.append((done, total)))
+    assert stats['parts'] == 2
+    assert stats['triangles'] == sum(len(mesh.faces) for meshes in slot_parts for mesh in meshes)
+    assert stats['vertices'] == sum(len(mesh.vertices) for meshes in slot_parts for mesh in meshes)
+    assert reports == [(1, 2), (2, 2)]
+
+    scene = trimesh.load(path)
+    assert sorted(scene.geometry) == ['Cyan Blue', 'Jade White']
+    assert len(scene.geometry['Jade White'].faces) == 24
+    assert len(scene.geometry['Cyan Blue'].faces) == len(slot_parts[2][0].faces)
+    np.testing.assert_allclose(scene.geometry['Jade White'].bounds, [[-0.5, -0.5, -0.25], [4.0, 0.5, 0.25]])
+    assert scene.geometry['Cyan Blue'].volume == pytest.approx(slot_parts[2][0].volume)
+
+
+def test_3mf_core_namespace_materials(tmp_path, slot_parts):
+    """basematerials 是核心命名空间的元素，零件通过 pid/pindex 引用对应槽位的颜色"""
+    path = tmp_path / 'model.3mf'
+    write_3mf(path, slot_parts, NAMES, COLORS)
+    model, _ = read_model(path)
+    assert model.tag == f'{{{CORE_NS}}}model'
+
+    materials = model.find('m:resources/m:basematerials', NS)
+    assert materials is not None and materials.get('id') == '1'
+    bases = materials.findall('m:base', NS)
+    assert [base.get('name') for base in bases] == NAMES
+    assert [base.get('displaycolor') for base in bases] == ['#F5F5F0FF', '#000000FF', '#00AEEFFF']
+
+    parts = {obj.get('name'): obj for obj in model.findall('m:resources/m:object', NS)
+             if obj.find('m:mesh', NS) is not None}
+    assert sorted(parts) == ['Cyan Blue', 'Jade White']
+    for name, obj in parts.items():
+        assert obj.get('pid') == '1'
+        assert bases[int(obj.get('pindex'))].get('name') == name
+
+    # 多零件对象引用所有零件，build 只放这一个对象
+    assembly = model.find('m:resources/m:object/m:components/..', NS)
+    components = [component.get('objectid') for component in assembly.findall('m:components/m:component', NS)]
+    assert components == [parts['Jade White'].get('id'), parts['Cyan Blue'].get('id')]
+    assert [item.get('objectid') for item in model.findall('m:build/m:item', NS)] == [assembly.get('id')]
+
+
+def test_3mf_extruder_mapping(tmp_path, slot_parts):
+    """model_settings.config: 每个零件的挤出机为槽位号 + 1 (空槽位没有零件)"""
+    path = tmp_path / 'model.3mf'
+    write_3mf(path, slot_parts, NAMES, COLORS, model_name='Portrait')
+    model, settings = read_model(path)
+    ids = {obj.get('name'): obj.get('id') for obj in model.findall('m:resources/m:object', NS)}
+
+    obj = settings.find('object')
+    assert obj.get('id') == ids['Portrait']
+    assert obj.find("metadata[@key='name']").get('value') == 'Portrait'
+    mapping = {part.get('id'): (part.find("metadata[@key='name']").get('value'),
+                                part.find("metadata[@key='extruder']").get('value'))
+               for part in obj.findall('part')}
+    assert mapping == {ids['Jade White']: ('Jade White', '1'), ids['Cyan Blue']: ('Cyan Blue', '3')}
+
+
+def test_3mf_without_parts_writes_nothing(tmp_path):
+    path = tmp_path / 'empty.3mf'
+    assert write_3mf(path, [[], []], NAMES[:2])['parts'] == 0
+    assert not path.exists()
+
+
+def test_binary_stl_size_and_round_trip(tmp_path, slot_parts):
+    path = tmp_path / 'part.stl'
+    triangles = write_stl(path, slot_parts[0], 'Jade White')
+    assert triangles == 24
+    assert os.path.getsize(path) == 84 + 50 * triangles
+
+    mesh = trimesh.load(path)
+    assert len(mesh.faces) == triangles
+    np.testing.assert_allclose(mesh.bounds, [[-0.5, -0.5, -0.25], [4.0, 0.5, 0.25]])
+    # 法向由顶点叉积计算，与 trimesh 的面法向一致 (朝外)
+    expected = np.concatenate([part.face_normals for part in slot_parts[0]])
+    records = np.fromfile(path, dtype=STL_DTYPE, offset=84)
+    assert len(records) == triangles
+    np.testing.assert_allclose(records['normal'], expected, atol=1e-6)
+
+
+def test_stl_parts_one_file_per_slot(tmp_path, slot_parts):
+    names = ['Jade White', 'Black', 'Cyan/Blue?']
+    written = write_stl_parts(tmp_path, 'model', slot_parts, names)
+    assert written == [('model_1_Jade_White.stl', 24), ('model_3_Cyan_Blue.stl', len(slot_parts[2][0].faces))]
+    for filename, triangles in written:
+        assert os.path.getsize(tmp_path / filename) == 84 + 50 * triangles
+    assert sorted(os.listdir(tmp_path)) == sorted(filename for filename, _ in written)
+
+
+@pytest.fixture
+def stack_map(tmp_path):
+    """5 种耗材 x 4 层的层叠图 (掩码外的编码是任意值，不写入文件)"""
+    rng = np.random.default_rng(0)
+    codec = StackCodec(5, 4)
+    codes = rng.integers(0, codec.num_codes, (17, 23)).astype(codec.dtype)
+    mask = rng.random((17, 23)) > 0.3
+    path = tmp_path / 'stack.npz'
+    save_stack_map(path, codes, mask, codec, 0.2, 0.08, names=['Jade White', 'Black', 'Cyan Blue', ' /', 'Red'],
+                   colors=['#ffffff', '#000000', '#00AEEF', None, 'bad'])
+    return path, codes, mask, codec
+
+
+def tamper(path, **changes):
+    """改写层叠图中的条目后另存为新文件"""
+    with np.load(path, allow_pickle=False) as data:
+        entries = {key: data[key] for key in data.files}
+    entries.update(changes)
+    out = path.with_name('tampered.npz')
+    np.savez(out, **entries)
+    return out
+
+
+def test_stack_map_round_trip(stack_map):
+    path, codes, mask, codec = stack_map
+    loaded = load_stack_map(path)
+    np.testing.assert_array_equal(loaded['mask'], mask)
+    assert loaded['codes'].dtype == codec.dtype
+    np.testing.assert_array_equal(loaded['codes'], np.where(mask, codes, 0))
+    assert (loaded['num_filaments'], loaded['total_layers']) == (5, 4)
+    assert (loaded['pixel_size'], loaded['layer_height']) == (0.2, 0.08)
+    assert loaded['names'] == ['Jade_White', 'Black', 'Cyan_Blue', 'Slot_4', 'Red']
+    assert loaded['colors'] == ['#FFFFFF', '#000000', '#00AEEF', '#808080', '#808080']
+
+
+@pytest.mark.parametrize('changes, message', [
+    (dict(shape=np.array([20000, 20000])), '层叠图过大'),
+    (dict(shape=np.array([17, 23, 1])), '尺寸无效'),
+    (dict(version=np.int32(2)), '版本'),
+    (dict(total_layers=np.int32(17)), '参数超出范围'),
+    (dict(pixel_size=np.float64(0.0)), '像素尺寸或层高无效'),
+    (dict(layer_height=np.float64(np.nan)), '像素尺寸或层高无效'),
+    (dict(names=np.array(['a', 'b'])), '数量与耗材数'),
+    (dict(mask=np.zeros(3, dtype=np.uint8)), '掩码与尺寸不一致'),
+    (dict(codes=np.zeros(4, dtype=np.uint16)), '数量与实心像素数不一致'),
+    (dict(codes=np.zeros(4, dtype=np.int16)), '类型无效'),
+])
+def test_stack_map_rejects_invalid(stack_map, changes, message):
+    with pytest.raises(ValueError, match=message):
+        load_stack_map(tamper(stack_map[0], **changes))
+
+
+def test_stack_map_rejects_codes_out_of_range(stack_map):
+    """编码必须小于 num_filaments ** total_layers (5 ** 4 = 625)"""
+    path, _, _, codec = stack_map
+    with np.load(path) as data:
+        codes = data['codes'].copy()
+    codes[-1] = codec.num_codes
+    with pytest.raises(ValueError, match='编码超出范围'):
+        load_stack_map(tamper(path, codes=codes))
+
+
+def test_stack_map_rejects_object_arrays(stack_map):
+    """包含对象数组 (需要 pickle) 的文件不会被反序列化"""
+    path = tamper(stack_map[0], names=np.array([{'name': 'Jade White'}] * 5, dtype=object))
+    with pytest.raises(ValueError, match='allow_pickle'):
+        load_stack_map(path)
+
+
+def test_stack_map_rejects_oversized_entry(stack_map):
+    """按 zip 目录中的原始大小拒绝过大的条目，不先解压"""
+    path = tamper(stack_map[0], padding=np.zeros(2 << 20, dtype=np.uint8))
+    with pytest.raises(ValueError, match='条目过大'):
+        load_stack_map(path, max_pixels=1000)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('Jade White', 'Jade_White'),
+    ('PLA Basic\tBlack', 'PLA_Basic_Black'),
+    ('../../etc/passwd', 'etc_passwd'),
+    ('a:b*c?"d"<e>|f', 'a_b_c__d__e__f'),
+    ('  ', 'Part'),
+    ('...', 'Part'),
+    (42, '42'),
+    ('x' * 100, 'x' * 64),
+])
+def test_part_name(name, expected):
+    assert part_name(name) == expected
+
+
+def test_part_name_default():
+    assert part_name('', 'Slot_3') == 'Slot_3'
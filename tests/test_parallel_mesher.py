@@ -0,0 +1,86 @@
+"""parallel_mesher: 进程池 (spawn) 的输出与单进程路径逐个顶点、逐个三角形一致 (contour / 区域 / greedy)"""
+
+import numpy as np
+import pytest
+
+import parallel_mesher
+from ChromaStackStudio import StackCodec
+from greedy_mesher import mesh_model
+from layer_mesher import ContourSimplifier, SlabCache, layer_slabs, region_layer_slabs, stack_volume
+from region_stack import RegionStackMap
+
+PIXEL_SIZE = 0.2
+LAYER_HEIGHT = 0.08
+WORKERS = 3
+
+
+@pytest.fixture(scope="module", autouse=True)
+def small_parallel_threshold():
+    """小模型也走进程池；进程池在本模块结束时关闭"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(parallel_mesher, "PARALLEL_MIN_VOXELS", 0)
+        yield
+    parallel_mesher.shutdown_pool()
+
+
+def random_model(seed, blocky):
+    rng = np.random.default_rng(seed)
+    codec = StackCodec(int(rng.integers(2, 5)), int(rng.integers(2, 6)))
+    codes = rng.integers(0, codec.num_codes, tuple(int(n) for n in rng.integers(4, 20, 2))).astype(codec.dtype)
+    if blocky:
+        codes = np.kron(codes, np.ones((2, 2), dtype=codes.dtype))
+    mask = rng.random(codes.shape) > 0.25
+    return codec, codes, mask
+
+
+def assert_same_mesh(serial, parallel):
+    if serial is None:
+        assert parallel is None
+        return
+    np.testing.assert_array_equal(parallel.vertices, serial.vertices)
+    np.testing.assert_array_equal(parallel.faces, serial.faces)
+    assert parallel.metadata == serial.metadata
+
+
+def assert_same_slabs(serial, parallel):
+    assert len(serial) == len(parallel)
+    for serial_layer, parallel_layer in zip(serial, parallel):
+        assert len(serial_layer) == len(parallel_layer)
+        for serial_mesh, parallel_mesh in zip(serial_layer, parallel_layer):
+            assert_same_mesh(serial_mesh, parallel_mesh)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("tolerance", [0.0, 0.7])
+def test_contour_slabs_match_serial(seed, tolerance):
+    codec, codes, mask = random_model(seed, blocky=seed % 2)
+    simplifier = ContourSimplifier(stack_volume(codes, mask, codec), tolerance) if tolerance else None
+    serial = layer_slabs(codes, mask, codec, LAYER_HEIGHT, PIXEL_SIZE, SlabCache(simplifier))
+    parallel = parallel_mesher.parallel_layer_slabs(codes, mask, codec, LAYER_HEIGHT, PIXEL_SIZE, workers=WORKERS,
+                                                    simplifier=simplifier)
+    assert_same_slabs(serial, parallel)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("tolerance", [0.0, 0.7])
+def test_region_slabs_match_serial(seed, tolerance):
+    codec, codes, mask = random_model(seed, blocky=True)
+    region_map = RegionStackMap.from_code_matrix(codes, mask)
+    simplifier = ContourSimplifier(region_map.code_columns(), tolerance) if tolerance else None
+    serial = region_layer_slabs(region_map, codec, LAYER_HEIGHT, PIXEL_SIZE, SlabCache(simplifier))
+    parallel = parallel_mesher.parallel_region_slabs(region_map, codec, LAYER_HEIGHT, PIXEL_SIZE, workers=WORKERS,
+                                                     simplifier=simplifier)
+    assert_same_slabs(serial, parallel)
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_greedy_match_serial(seed):
+    """每个槽位单独计算 (其他槽位视为空气)，顶点顺序与三角形顺序都与整体计算相同"""
+    codec, codes, mask = random_model(seed, blocky=seed % 2)
+    options = dict(double_sided=bool(seed % 3), base_slot=seed % codec.num_filaments)
+    serial = mesh_model(codes, mask, codec, LAYER_HEIGHT, 0.8, PIXEL_SIZE, **options)
+    parallel = parallel_mesher.parallel_mesh_model(codes, mask, codec, LAYER_HEIGHT, 0.8, PIXEL_SIZE,
+                                                   workers=WORKERS, **options)
+    assert len(parallel) == len(serial) == codec.num_filaments
+    for serial_mesh, parallel_mesh in zip(serial, parallel):
+        assert_same_mesh(serial_mesh, parallel_mesh)
@@ -0,0 +1,97 @@
+"""region_stack: 相邻同层叠区域的合并，区域表上计算的段切片与逐像素编码矩阵的结果一致"""
+
+import numpy as np
+import pytest
+
+from ChromaStackStudio import StackCodec
+from layer_mesher import SlabCache, layer_slabs, region_layer_slabs
+from region_stack import RegionStackMap, merge_same_stack_regions
+
+PIXEL_SIZE = 0.2
+LAYER_HEIGHT = 0.08
+
+
+def random_regions(seed, codec, block=3):
+    """block x block 的分割区域 (ID 从 1 开始，0 为背景)，层叠只从少数几个中选，相邻区域经常相同"""
+    rng = np.random.default_rng(seed)
+    rows, cols = (int(n) for n in rng.integers(3, 8, 2))
+    regions = np.arange(1, rows * cols + 1, dtype=np.int32).reshape(rows, cols)
+    regions = np.kron(regions, np.ones((block, block), dtype=np.int32))
+    regions[rng.random(regions.shape) < 0.05] = 0
+    palette = rng.integers(0, codec.num_codes, 3)
+    region_codes = np.zeros(rows * cols + 1, dtype=codec.dtype)
+    region_codes[1:] = rng.choice(palette, rows * cols)
+    mask = rng.random(regions.shape) > 0.1
+    return regions, region_codes, mask
+
+
+def test_merge_same_stack_regions():
+    labels = np.array([[1, 1, 2, 3, 0],
+                       [4, 4, 2, 3, 0],
+                       [0, 0, 0, 0, 6]], dtype=np.int32)
+    codes = np.array([0, 5, 5, 7, 9, 5, 5])   # 区域 5 不出现；6 与 1/2 层叠相同但不相邻
+    merged_labels, merged_codes = merge_same_stack_regions(labels, codes)
+    np.testing.assert_array_equal(merged_labels, [[1, 1, 1, 2, 0],
+                                                  [3, 3, 1, 2, 0],
+                                                  [0, 0, 0, 0, 4]])
+    np.testing.assert_array_equal(merged_codes, [0, 5, 7, 9, 5])
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_from_regions_merges_adjacent_stacks(seed):
+    """
+    合并后: 每个分割区域整体属于一个新区域，新区域内层叠相同，
+    相邻的不同新区域层叠不同 (相邻且层叠相同的区域都已合并)，ID 从 1 连续编号
+    """
+    codec = StackCodec(3, 4)
+    regions, region_codes, mask = random_regions(seed, codec)
+    region_map = RegionStackMap.from_regions(regions, region_codes, mask=mask)
+    solid = mask & (regions > 0)
+    np.testing.assert_array_equal(region_map.mask, solid)
+    np.testing.assert_array_equal(region_map.code_matrix(), np.where(solid, region_codes[regions], 0))
+    np.testing.assert_array_equal(np.unique(region_map.labels[solid]), np.arange(1, len(region_map) + 1))
+
+    pairs = np.unique(np.stack([regions[solid], region_map.labels[solid]], axis=1), axis=0)
+    assert len(np.unique(pairs[:, 0])) == len(pairs)
+    assert len(region_map) < len(np.unique(regions[solid]))
+
+    labels = region_map.labels
+    for a, b in ((labels[:, :-1], labels[:, 1:]), (labels[:-1, :], labels[1:, :])):
+        edge = (a != b) & (a > 0) & (b > 0)
+        assert np.all(region_map.codes[a[edge]] != region_map.codes[b[edge]])
+
+    unmerged = RegionStackMap.from_regions(regions, region_codes, mask=mask, merge=False)
+    assert len(unmerged) == len(region_codes) - 1
+    np.testing.assert_array_equal(unmerged.code_matrix(), region_map.code_matrix())
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_region_layer_slabs_match_layer_slabs(seed):
+    codec = StackCodec(3, 4) if seed % 2 else StackCodec(4, 3)
+    regions, region_codes, mask = random_regions(seed, codec)
+    region_map = RegionStackMap.from_regions(regions, region_codes, mask=mask)
+    solid = mask & (regions > 0)
+    code_matrix = np.where(solid, region_codes[regions], 0).astype(codec.dtype)
+
+    expected = layer_slabs(code_matrix, solid, codec, LAYER_HEIGHT, PIXEL_SIZE)
+    slabs = region_layer_slabs(region_map, codec, LAYER_HEIGHT, PIXEL_SIZE)
+    assert len(slabs) == len(expected) == codec.total_layers
+    for layer, expected_layer in zip(slabs, expected):
+        assert len(layer) == len(expected_layer) == codec.num_filaments * codec.total_layers
+        for mesh, expected_mesh in zip(layer, expected_layer):
+            if expected_mesh is None:
+                assert mesh is None
+                continue
+            np.testing.assert_array_equal(mesh.vertices, expected_mesh.vertices)
+            np.testing.assert_array_equal(mesh.faces, expected_mesh.faces)
+
+
+def test_region_layer_slabs_share_cache_with_flipped_map():
+    """正反两面共用 SlabCache: 镜像的区域图与逐像素路径的镜像命中同一批切片"""
+    codec = StackCodec(3, 4)
+    regions, region_codes, mask = random_regions(1, codec)
+    region_map = RegionStackMap.from_regions(regions, region_codes, mask=mask).flip(axis=1)
+    cache = SlabCache()
+    region_layer_slabs(region_map, codec, LAYER_HEIGHT, PIXEL_SIZE, cache)
+    layer_slabs(region_map.code_matrix(), region_map.mask, codec, LAYER_HEIGHT, PIXEL_SIZE, cache)
+    assert cache.hits == cache.misses == codec.total_layers